@@ -0,0 +1,547 @@
+"""Load generator and benchmark for the lookup service REST API.
+
+The caches are populated with a synthetic fleet of clusters, training portals,
+workshop environments and workshop sessions. Training portals are emulated by
+a local aiohttp application implementing the OAuth token and workshop session
+request endpoints, with an optional artificial latency. Concurrent clients then
+log in to the lookup service, drive the selected scenario and throughput and
+latency percentiles are reported.
+
+Run from the lookup-service directory, for example:
+
+    python -m scripts.benchmark --clusters 10 --portals 3 --environments 20 \\
+        --sessions 50 --concurrency 20 --requests 5000 --scenario get-workshops
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from aiohttp import ClientSession, TCPConnector, web
+
+from service.caches.clients import ClientConfig
+from service.caches.clusters import ClusterConfig
+from service.caches.databases import client_database, cluster_database, tenant_database
+from service.caches.environments import WorkshopEnvironment
+from service.caches.portals import PortalCredentials, TrainingPortal
+from service.caches.sessions import WorkshopSession
+from service.caches.tenants import TenantConfig
+from service.routes import register_routes
+from service.service import ServiceState
+
+CLIENT_NAME = "benchmark"
+CLIENT_PASSWORD = "benchmark"
+TENANT_NAME = "benchmark"
+
+
+def populate_fleet(
+    args: argparse.Namespace, portal_base_url: str
+) -> List[Tuple[str, str]]:
+    """Populate the caches with a synthetic fleet. Returns the names of the
+    users which have been allocated workshop sessions, paired with the name of
+    the workshop."""
+
+    users = []
+
+    for cluster_index in range(args.clusters):
+        cluster = ClusterConfig(
+            name=f"cluster-{cluster_index}",
+            uid=f"cluster-uid-{cluster_index}",
+            labels=[{"name": "benchmark", "value": "true"}],
+            kubeconfig={},
+        )
+
+        cluster_database.add_cluster(cluster)
+
+        for portal_index in range(args.portals):
+            portal_name = f"portal-{cluster_index}-{portal_index}"
+
+            portal = TrainingPortal(
+                cluster=cluster,
+                name=portal_name,
+                uid=f"{portal_name}-uid",
+                generation=1,
+                labels=[{"name": "benchmark", "value": "true"}],
+                url=f"{portal_base_url}/{portal_name}",
+                credentials=PortalCredentials(
+                    client_id="client-id",
+                    client_secret="client-secret",
+                    username="robot",
+                    password="robot",
+                ),
+                phase="Running",
+                capacity=0,
+                allocated=0,
+            )
+
+            cluster.add_portal(portal)
+
+            for environment_index in range(args.environments):
+                environment_name = f"{portal_name}-w{environment_index:03d}"
+
+                environment = WorkshopEnvironment(
+                    portal=portal,
+                    name=environment_name,
+                    uid=f"{environment_name}-uid",
+                    generation=1,
+                    workshop=f"workshop-{environment_index % args.workshops}",
+                    title=f"Workshop {environment_index % args.workshops}",
+                    description="Synthetic workshop for benchmarking.",
+                    labels=[],
+                    capacity=args.sessions * 2,
+                    reserved=args.sessions,
+                    allocated=0,
+                    available=0,
+                    phase="Running",
+                )
+
+                portal.add_environment(environment)
+
+                for session_index in range(args.sessions):
+                    session_name = f"{environment_name}-s{session_index:04d}"
+
+                    user = None
+                    phase = "Available"
+
+                    if random.random() < args.allocated_fraction:
+                        user = f"user-{session_name}"
+                        phase = "Allocated"
+
+                        users.append((user, environment.workshop))
+
+                    environment.add_session(
+                        WorkshopSession(
+                            environment=environment,
+                            name=session_name,
+                            generation=1,
+                            phase=phase,
+                            user=user,
+                        )
+                    )
+
+    tenant_database.update_tenant(
+        TenantConfig(
+            name=TENANT_NAME,
+            clusters={"labelSelector": {"matchLabels": {"benchmark": "true"}}},
+            portals={"labelSelector": {"matchLabels": {"benchmark": "true"}}},
+        )
+    )
+
+    client_database.update_client(
+        ClientConfig(
+            name=CLIENT_NAME,
+            uid="benchmark-uid",
+            issue=1,
+            password=CLIENT_PASSWORD,
+            user="",
+            tenants=[TENANT_NAME],
+            roles=["admin", "tenant"],
+        )
+    )
+
+    return users
+
+
+def fake_portal_application(latency: float) -> web.Application:
+    """Create an application emulating the REST API of training portals. All
+    portals are served by the same application using the portal name as a
+    path prefix."""
+
+    counter = {"sessions": 0}
+
+    async def delay() -> None:
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def token(request: web.Request) -> web.Response:
+        await delay()
+
+        return web.json_response(
+            {
+                "access_token": f"token-{request.match_info['portal']}",
+                "expires_in": 36000,
+                "token_type": "Bearer",
+            }
+        )
+
+    async def revoke(_: web.Request) -> web.Response:
+        return web.json_response({})
+
+    async def request_session(request: web.Request) -> web.Response:
+        await delay()
+
+        session_name = request.query.get("session")
+
+        if not session_name:
+            counter["sessions"] += 1
+            session_name = (
+                f"{request.match_info['environment']}-n{counter['sessions']:06d}"
+            )
+
+        return web.json_response(
+            {
+                "name": session_name,
+                "url": f"/workshops/session/{session_name}/activate/",
+            }
+        )
+
+    async def terminate_session(_: web.Request) -> web.Response:
+        await delay()
+
+        return web.json_response({})
+
+    app = web.Application()
+
+    app.add_routes(
+        [
+            web.post("/{portal}/oauth2/token/", token),
+            web.post("/{portal}/oauth2/revoke-token/", revoke),
+            web.get(
+                "/{portal}/workshops/environment/{environment}/request/",
+                request_session,
+            ),
+            web.get(
+                "/{portal}/workshops/session/{session}/terminate/",
+                terminate_session,
+            ),
+        ]
+    )
+
+    return app
+
+
+def lookup_service_application() -> web.Application:
+    """Create the lookup service application backed by the global caches."""
+
+    app = web.Application()
+
+    app["service_state"] = ServiceState(
+        client_database=client_database,
+        tenant_database=tenant_database,
+        cluster_database=cluster_database,
+    )
+
+    register_routes(app)
+
+    return app
+
+
+async def start_application(app: web.Application) -> web.AppRunner:
+    """Start an application on a free local port."""
+
+    runner = web.AppRunner(app, access_log=None)
+
+    await runner.setup()
+
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+
+    await site.start()
+
+    return runner
+
+
+def runner_url(runner: web.AppRunner) -> str:
+    """Return the base URL for an application which has been started."""
+
+    host, port = runner.addresses[0][:2]
+
+    return f"http://{host}:{port}"
+
+
+def scenario_requests(
+    args: argparse.Namespace, users: List[Tuple[str, str]]
+) -> Callable[[int], Dict[str, Any]]:
+    """Return a function generating the details of the request to make for
+    the selected scenario, given the sequence number of the request."""
+
+    def get_workshops(_: int) -> Dict[str, Any]:
+        return {
+            "method": "GET",
+            "path": "/api/v1/workshops",
+            "params": {"tenant": TENANT_NAME},
+        }
+
+    # Workshops are assigned to the environments of each portal in turn, so if
+    # there are fewer environments than workshops, some workshops will have no
+    # environment. Only workshops which have an environment are requested.
+
+    workshops = min(args.workshops, args.environments)
+
+    def post_workshops(sequence: int) -> Dict[str, Any]:
+        return {
+            "method": "POST",
+            "path": "/api/v1/workshops",
+            "json": {
+                "tenantName": TENANT_NAME,
+                "workshopName": f"workshop-{sequence % workshops}",
+                "clientUserId": f"new-user-{sequence}",
+            },
+        }
+
+    def reacquire_workshops(sequence: int) -> Dict[str, Any]:
+        user, workshop = users[sequence % len(users)]
+
+        return {
+            "method": "POST",
+            "path": "/api/v1/workshops",
+            "json": {
+                "tenantName": TENANT_NAME,
+                "workshopName": workshop,
+                "clientUserId": user,
+            },
+        }
+
+    # Indices are derived from the sequence number such that all portals, and
+    # all environments of every portal, are visited in turn.
+
+    def list_environments(sequence: int) -> Dict[str, Any]:
+        cluster, portal = divmod(
+            sequence % (args.clusters * args.portals), args.portals
+        )
+
+        return {
+            "method": "GET",
+            "path": f"/api/v1/clusters/cluster-{cluster}/portals/portal-{cluster}-{portal}/environments",  # pylint: disable=line-too-long
+        }
+
+    def list_sessions(sequence: int) -> Dict[str, Any]:
+        environments = args.portals * args.environments
+
+        cluster, index = divmod(sequence % (args.clusters * environments), environments)
+        portal, environment = divmod(index, args.environments)
+
+        return {
+            "method": "GET",
+            "path": f"/api/v1/clusters/cluster-{cluster}/portals/portal-{cluster}-{portal}/environments/portal-{cluster}-{portal}-w{environment:03d}/sessions",  # pylint: disable=line-too-long
+        }
+
+    scenarios = {
+        "get-workshops": get_workshops,
+        "post-workshops": post_workshops,
+        "reacquire-workshops": reacquire_workshops,
+        "list-environments": list_environments,
+        "list-sessions": list_sessions,
+    }
+
+    if args.scenario == "reacquire-workshops" and not users:
+        raise SystemExit("No allocated sessions, increase --allocated-fraction.")
+
+    return scenarios[args.scenario]
+
+
+async def drive_load(
+    args: argparse.Namespace,
+    base_url: str,
+    generate_request: Callable[[int], Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Drive concurrent clients against the lookup service and collect the
+    latency and status of each request."""
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    sequence = iter(range(args.requests))
+
+    async with ClientSession(connector=TCPConnector(limit=0)) as http_client:
+        async with http_client.post(
+            f"{base_url}/login",
+            json={"username": CLIENT_NAME, "password": CLIENT_PASSWORD},
+        ) as response:
+            token = (await response.json())["access_token"]
+
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async def worker() -> None:
+            for index in sequence:
+                details = generate_request(index)
+
+                started = time.perf_counter()
+
+                async with http_client.request(
+                    details["method"],
+                    f"{base_url}{details['path']}",
+                    params=details.get("params"),
+                    json=details.get("json"),
+                    headers=headers,
+                ) as response:
+                    await response.read()
+
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+        elapsed = time.perf_counter() - started
+
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the given percentile of a sorted list of values."""
+
+    if not values:
+        return 0.0
+
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+
+    return values[index]
+
+
+def summarize(args: argparse.Namespace, results: Dict[str, Any]) -> Dict[str, Any]:
+    """Summarize the results of a benchmark run."""
+
+    latencies = sorted(results["latencies"])
+
+    return {
+        "scenario": args.scenario,
+        "fleet": {
+            "clusters": args.clusters,
+            "portals": args.clusters * args.portals,
+            "environments": args.clusters * args.portals * args.environments,
+            "sessions": args.clusters
+            * args.portals
+            * args.environments
+            * args.sessions,
+        },
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "statuses": {str(key): value for key, value in results["statuses"].items()},
+        "throughput": len(latencies) / results["elapsed"] if results["elapsed"] else 0,
+        "latency": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p90": percentile(latencies, 0.90),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+    }
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    """Print a human readable summary of a benchmark run."""
+
+    fleet = summary["fleet"]
+
+    print(f"Scenario:     {summary['scenario']}")
+    print(
+        f"Fleet:        {fleet['clusters']} clusters, {fleet['portals']} portals, "
+        f"{fleet['environments']} environments, {fleet['sessions']} sessions"
+    )
+    print(f"Requests:     {summary['requests']} ({summary['concurrency']} concurrent)")
+    print(f"Statuses:     {summary['statuses']}")
+    print(f"Throughput:   {summary['throughput']:.1f} requests/sec")
+
+    latency = summary["latency"]
+
+    print(
+        "Latency (ms): "
+        + ", ".join(f"{key}={value * 1000:.2f}" for key, value in latency.items())
+    )
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the benchmark and return a summary of the results."""
+
+    random.seed(args.seed)
+
+    portal_runner = await start_application(
+        fake_portal_application(args.portal_latency)
+    )
+    service_runner = await start_application(lookup_service_application())
+
+    try:
+        populate_started = time.perf_counter()
+
+        users = populate_fleet(args, runner_url(portal_runner))
+
+        populate_elapsed = time.perf_counter() - populate_started
+
+        results = await drive_load(
+            args, runner_url(service_runner), scenario_requests(args, users)
+        )
+
+    finally:
+        for cluster in cluster_database.get_clusters():
+            cluster_database.remove_cluster(cluster.name)
+
+        await asyncio.sleep(0.1)
+
+        await service_runner.cleanup()
+        await portal_runner.cleanup()
+
+    summary = summarize(args, results)
+
+    summary["populate"] = populate_elapsed
+
+    return summary
+
+
+def parse_arguments() -> argparse.Namespace:
+    """Parse the command line arguments."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--portals", type=int, default=2, help="portals per cluster")
+    parser.add_argument(
+        "--environments", type=int, default=10, help="environments per portal"
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=20, help="sessions per environment"
+    )
+    parser.add_argument(
+        "--workshops", type=int, default=10, help="number of distinct workshops"
+    )
+    parser.add_argument(
+        "--allocated-fraction",
+        type=float,
+        default=0.5,
+        help="fraction of sessions allocated to users",
+    )
+    parser.add_argument(
+        "--scenario",
+        default="get-workshops",
+        choices=[
+            "get-workshops",
+            "post-workshops",
+            "reacquire-workshops",
+            "list-environments",
+            "list-sessions",
+        ],
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument(
+        "--portal-latency",
+        type=float,
+        default=0.0,
+        help="artificial latency in seconds for emulated portal requests",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="output results as JSON")
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Main entry point for the benchmark."""
+
+    args = parse_arguments()
+
+    summary = asyncio.run(run_benchmark(args))
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+        print(f"Populate:     {summary['populate']:.2f} sec")
+
+
+if __name__ == "__main__":
+    main()
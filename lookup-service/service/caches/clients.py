@@ -1,8 +1,11 @@
 """Configuration for clients of the service."""
 
-import fnmatch
-from dataclasses import dataclass
-from typing import List, Set
+import re
+from dataclasses import dataclass, field
+from typing import List, Set, Union
+
+from ..helpers.selectors import compile_glob_patterns, match_glob_patterns
+from .tokens import token_cache
 
 
 @dataclass
@@ -16,6 +19,12 @@ class ClientConfig:
     user: str
     tenants: List[str]
     roles: List[str]
+    compiled_tenants: Union[re.Pattern, None] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self.compiled_tenants = compile_glob_patterns(self.tenants)
 
     @property
     def identity(self) -> str:
@@ -28,6 +37,8 @@ class ClientConfig:
 
         self.issue += 1
 
+        token_cache.invalidate_client(self.name)
+
     def check_password(self, password: str) -> bool:
         """Checks the password provided against the client's password."""
 
@@ -53,8 +64,4 @@ class ClientConfig:
     def allowed_access_to_tenant(self, tenant: str) -> bool:
         """Check if the client has access to the tenant."""
 
-        for pattern in self.tenants:
-            if fnmatch.fnmatch(tenant, pattern):
-                return True
-
-        return False
+        return match_glob_patterns(self.compiled_tenants, tenant)
@@ -1,9 +1,10 @@
 """Configuration for target clusters."""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import TYPE_CHECKING, Any, Dict, List
 
 if TYPE_CHECKING:
+    from .databases import ClusterDatabase
     from .portals import TrainingPortal
 
 
@@ -17,6 +18,7 @@ class ClusterConfig:
     labels: List[Dict[str, str]]
     kubeconfig: Dict[str, Any]
     portals: Dict[str, "TrainingPortal"]
+    database: "ClusterDatabase" = field(default=None, repr=False, compare=False)
 
     def __init__(
         self, name: str, uid: str, labels: List[Dict[str, str]], kubeconfig: Dict[str, Any]
@@ -26,16 +28,47 @@ class ClusterConfig:
         self.labels = labels
         self.kubeconfig = kubeconfig
         self.portals = {}
+        self.database = None
+
+    def increment_generation(self) -> None:
+        """Increment the generation of the cluster database this cluster is
+        registered with. This must be called when portals are added to or
+        removed from the cluster, or the labels of the cluster or its portals
+        change, so that cached tenant access rules are recalculated."""
+
+        if self.database is not None:
+            self.database.increment_generation()
+
+    def update_labels(self, labels: List[Dict[str, str]]) -> None:
+        """Update the labels of the cluster."""
+
+        if labels != self.labels:
+            self.labels = labels
+
+            self.increment_generation()
 
     def add_portal(self, portal: "TrainingPortal") -> None:
         """Add a portal to the cluster."""
 
         self.portals[portal.name] = portal
 
+        if self.database is not None:
+            self.database.index_portal(portal)
+
+        self.increment_generation()
+
     def remove_portal(self, name: str) -> None:
-        """Remove a portal from the cluster."""
+        """Remove a portal from the cluster, closing its pooled HTTP client."""
+
+        portal = self.portals.pop(name, None)
+
+        if portal:
+            if self.database is not None:
+                self.database.unindex_portal(portal)
+
+            portal.close_client_pool()
 
-        self.portals.pop(name, None)
+            self.increment_generation()
 
     def get_portals(self) -> List["TrainingPortal"]:
         """Retrieve a list of portals from the cluster."""
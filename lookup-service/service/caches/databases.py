@@ -1,11 +1,17 @@
 """Database classes for storing state of everything."""
 
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Dict, List
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from wrapt import synchronized
+
+from .tokens import token_cache
 
 if TYPE_CHECKING:
     from .clients import ClientConfig
     from .clusters import ClusterConfig
+    from .portals import TrainingPortal
+    from .sessions import WorkshopSession
     from .tenants import TenantConfig
 
 
@@ -22,15 +28,20 @@ class ClientDatabase:
 
     def update_client(self, client: "ClientConfig") -> None:
         """Update the client in the database. If the client does not exist in
-        the database, it will be added."""
+        the database, it will be added. Any cached tokens for the client are
+        discarded as the client's roles or identity may have changed."""
 
         self.clients[client.name] = client
 
+        token_cache.invalidate_client(client.name)
+
     def remove_client(self, name: str) -> None:
-        """Remove a client from the database."""
+        """Remove a client from the database, discarding any cached tokens."""
 
         self.clients.pop(name, None)
 
+        token_cache.invalidate_client(name)
+
     def get_clients(self) -> List["ClientConfig"]:
         """Retrieve a list of clients from the database."""
 
@@ -91,22 +102,53 @@ class TenantDatabase:
 class ClusterDatabase:
     """Database for storing cluster configurations. Clusters are stored in a
     dictionary with the cluster's name as the key and the cluster configuration
-    object as the value."""
+    object as the value. The generation is incremented whenever clusters or
+    portals are added or removed, or their labels change, and is used to
+    invalidate cached results of evaluating tenant access rules. An index of
+    allocated workshop sessions keyed by user and workshop is maintained across
+    all clusters, so that existing sessions for a user can be found without
+    visiting every portal."""
 
     clusters: Dict[str, "ClusterConfig"]
+    generation: int
+    user_sessions: Dict[Tuple[str, str], Dict[Tuple[str, str, str], "WorkshopSession"]]
 
     def __init__(self) -> None:
         self.clusters = {}
+        self.generation = 0
+        self.user_sessions = {}
+
+    def increment_generation(self) -> None:
+        """Increment the generation of the database."""
+
+        with synchronized(self):
+            self.generation += 1
 
     def add_cluster(self, cluster: "ClusterConfig") -> None:
         """Add the cluster to the database."""
 
+        cluster.database = self
+
         self.clusters[cluster.name] = cluster
 
+        for portal in cluster.get_portals():
+            self.index_portal(portal)
+
+        self.increment_generation()
+
     def remove_cluster(self, name: str) -> None:
-        """Remove a cluster from the database."""
+        """Remove a cluster from the database, closing the pooled HTTP clients
+        for any portals hosted on the cluster."""
+
+        cluster = self.clusters.pop(name, None)
+
+        if cluster:
+            for portal in cluster.get_portals():
+                self.unindex_portal(portal)
 
-        self.clusters.pop(name, None)
+                portal.close_client_pool()
+
+            self.increment_generation()
 
     def get_clusters(self) -> List["ClusterConfig"]:
         """Retrieve a list of clusters from the database."""
@@ -118,6 +160,63 @@ class ClusterDatabase:
 
         return self.clusters.get(name)
 
+    def index_session(self, session: "WorkshopSession") -> None:
+        """Add a workshop session to the index of sessions by user. Sessions of
+        portals which are no longer registered with the database are ignored."""
+
+        portal = session.environment.portal
+        cluster = portal.cluster
+
+        if self.clusters.get(cluster.name) is not cluster:
+            return
+
+        if cluster.get_portal(portal.name) is not portal:
+            return
+
+        key = (session.user, session.environment.workshop)
+
+        with synchronized(self):
+            self.user_sessions.setdefault(key, {})[
+                (cluster.name, portal.name, session.name)
+            ] = session
+
+    def unindex_session(self, session: "WorkshopSession") -> None:
+        """Remove a workshop session from the index of sessions by user."""
+
+        portal = session.environment.portal
+
+        key = (session.user, session.environment.workshop)
+        name = (portal.cluster.name, portal.name, session.name)
+
+        with synchronized(self):
+            sessions = self.user_sessions.get(key, {})
+
+            if sessions.get(name) is session:
+                sessions.pop(name)
+
+            if not sessions:
+                self.user_sessions.pop(key, None)
+
+    def index_portal(self, portal: "TrainingPortal") -> None:
+        """Add the allocated workshop sessions of a portal to the index."""
+
+        for session in portal.get_user_sessions():
+            self.index_session(session)
+
+    def unindex_portal(self, portal: "TrainingPortal") -> None:
+        """Remove the allocated workshop sessions of a portal from the index."""
+
+        for session in portal.get_user_sessions():
+            self.unindex_session(session)
+
+    def find_existing_workshop_sessions_for_user(
+        self, user_id: str, workshop_name: str
+    ) -> List["WorkshopSession"]:
+        """Find any existing workshop sessions for a user across all clusters
+        using the index of sessions by user and workshop."""
+
+        return list(self.user_sessions.get((user_id, workshop_name), {}).values())
+
 
 # Create the database instances.
 
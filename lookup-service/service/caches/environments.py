@@ -2,10 +2,8 @@
 
 import logging
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Dict, List
-
-from aiohttp import ClientSession
-from wrapt import synchronized
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
 if TYPE_CHECKING:
     from .portals import TrainingPortal
@@ -14,6 +12,27 @@ if TYPE_CHECKING:
 logger = logging.getLogger("educates")
 
 
+@dataclass
+class CapacitySnapshot:
+    """Capacity counts of a workshop environment together with the phases of
+    its workshop sessions, taken at the same point in time."""
+
+    allocated: int
+    available: int
+    phases: List[str]
+
+    @cached_property
+    def actual(self) -> Tuple[int, int]:
+        """The allocated and available counts calculated from the phases."""
+
+        return self.phases.count("Allocated"), self.phases.count("Available")
+
+    def drifted(self) -> bool:
+        """Check if the counts differ from those calculated from the phases."""
+
+        return self.actual != (self.allocated, self.available)
+
+
 @dataclass
 class WorkshopEnvironment:
     """Snapshot of workshop environment state. This includes a database of
@@ -78,37 +97,98 @@ class WorkshopEnvironment:
     def add_session(self, session: "WorkshopSession") -> None:
         """Add a session to the environment."""
 
+        self.remove_session(session.name)
+
         self.sessions[session.name] = session
 
+        self.portal.index_session(session)
+
+        self.adjust_capacity(None, session.phase)
+
+    def update_session(
+        self, session: "WorkshopSession", generation: int, phase: str, user: str
+    ) -> None:
+        """Update the state of a session of the environment, keeping the index
+        of sessions by user held by the portal and the capacity counters up to
+        date."""
+
+        self.portal.unindex_session(session)
+
+        previous_phase = session.phase
+
+        session.generation = generation
+        session.phase = phase
+        session.user = user
+
+        self.portal.index_session(session)
+
+        self.adjust_capacity(previous_phase, phase)
+
     def remove_session(self, session_name: str) -> None:
         """Remove a session from the environment."""
 
-        self.sessions.pop(session_name, None)
+        session = self.sessions.pop(session_name, None)
 
-    @synchronized
-    def recalculate_capacity(self) -> None:
-        """Recalculate the available capacity of the environment."""
+        if session:
+            self.portal.unindex_session(session)
 
-        allocated = 0
-        available = 0
+            self.adjust_capacity(session.phase, None)
 
-        for session in list(self.sessions.values()):
-            if session.phase == "Allocated":
-                allocated += 1
-            elif session.phase == "Available":
-                available += 1
+    def adjust_capacity(self, previous_phase: str | None, phase: str | None) -> None:
+        """Adjust the allocated and available counts for the environment, and
+        the allocated count for the portal, when a session transitions from
+        one phase to another. A phase of None is used when a session is being
+        added or removed."""
 
-        self.allocated = allocated
-        self.available = available
+        allocated = (phase == "Allocated") - (previous_phase == "Allocated")
+        available = (phase == "Available") - (previous_phase == "Available")
+
+        self.allocated += allocated
+        self.available += available
+
+        self.portal.allocated += allocated
+
+    def capacity_snapshot(self) -> CapacitySnapshot:
+        """Return a snapshot of the capacity counts of the environment and the
+        phases of the sessions it holds. This must be called with the lock for
+        the cluster configuration held."""
+
+        return CapacitySnapshot(
+            allocated=self.allocated,
+            available=self.available,
+            phases=[session.phase for session in self.sessions.values()],
+        )
+
+    def correct_capacity(self, snapshot: CapacitySnapshot) -> bool:
+        """Correct any drift found in a snapshot of the capacity counts. This
+        is used to audit the counts maintained by adjust_capacity(). The drift
+        is applied as a correction to the current counts, as they may have been
+        adjusted since the snapshot was taken. This must be called with the
+        lock for the cluster configuration held. Returns whether the counts
+        had drifted and needed to be corrected."""
+
+        if not snapshot.drifted():
+            return False
 
-        logger.info(
-            "Recalculated capacity for environment %s of portal %s in cluster %s: %s",
+        allocated = self.allocated + snapshot.actual[0] - snapshot.allocated
+        available = self.available + snapshot.actual[1] - snapshot.available
+
+        logger.warning(
+            "Corrected capacity drift for environment %s of portal %s in cluster %s: %s",
             self.name,
             self.portal.name,
             self.portal.cluster.name,
-            {"allocated": allocated, "available": available},
+            {
+                "allocated": [self.allocated, allocated],
+                "available": [self.available, available],
+            },
         )
 
+        self.allocated = allocated
+        self.available = available
+
+        return True
+
     async def request_workshop_session(
         self,
         user_id: str,
@@ -123,18 +203,29 @@ class WorkshopEnvironment:
 
         portal = self.portal
 
-        async with ClientSession() as http_client:
-            async with portal.client_session(http_client) as portal_client:
-                if not portal_client.connected:
-                    return
-
-                return await portal_client.request_workshop_session(
-                    environment_name=self.name,
-                    user_id=user_id,
-                    user_email=user_email,
-                    user_first_name=user_first_name,
-                    user_last_name=user_last_name,
-                    parameters=parameters,
-                    index_url=index_url,
-                    analytics_url=analytics_url,
-                )
+        async with portal.client_session() as portal_client:
+            if not portal_client.connected:
+                return
+
+            return await portal_client.request_workshop_session(
+                environment_name=self.name,
+                user_id=user_id,
+                user_email=user_email,
+                user_first_name=user_first_name,
+                user_last_name=user_last_name,
+                parameters=parameters,
+                index_url=index_url,
+                analytics_url=analytics_url,
+            )
+
+    async def terminate_workshop_session(self, session_name: str) -> bool:
+        """Terminate a workshop session which was allocated from the workshop
+        environment but is no longer required."""
+
+        portal = self.portal
+
+        async with portal.client_session() as portal_client:
+            if not portal_client.connected:
+                return False
+
+            return await portal_client.terminate_workshop_session(session_name)
@@ -1,15 +1,34 @@
 """Configuration database for training portals."""
 
+import asyncio
+import collections
 import logging
-from dataclasses import dataclass
-from typing import TYPE_CHECKING, Dict, List, Tuple, Union
-
-from aiohttp import BasicAuth, ClientSession, ClientConnectorError, ClientError
-
+import time
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple, Union
+
+from aiohttp import (
+    BasicAuth,
+    ClientConnectorError,
+    ClientError,
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    TraceConfig,
+)
+
+from ..config import (
+    PORTAL_CIRCUIT_COOLDOWN,
+    PORTAL_CIRCUIT_FAILURE_THRESHOLD,
+    PORTAL_HEALTH_WINDOW,
+    PORTAL_REQUEST_TIMEOUT,
+)
 from .clusters import ClusterConfig
 
 if TYPE_CHECKING:
-    from .environments import WorkshopEnvironment
+    from .environments import CapacitySnapshot, WorkshopEnvironment
     from .sessions import WorkshopSession
 
 
@@ -26,6 +45,282 @@ class PortalCredentials:
     password: str
 
 
+# Settings for the pooled HTTP client used to talk to each training portal. The
+# connection limit bounds how many concurrent requests we will make against a
+# single portal. Access tokens are refreshed once this fraction of their
+# lifetime has elapsed so we never present a token which is about to expire.
+# If the portal doesn't say how long a token is valid for, the default lifetime
+# in seconds is assumed.
+
+PORTAL_CONNECTION_LIMIT = 32
+PORTAL_TOKEN_REFRESH_FRACTION = 0.9
+PORTAL_TOKEN_DEFAULT_LIFETIME = 3600
+
+
+@dataclass
+class PortalAccessToken:
+    """Cached OAuth access token for a portal's robot account. The credentials
+    used to obtain the token are recorded so the token can be discarded if the
+    credentials for the portal change."""
+
+    token: str
+    credentials: PortalCredentials
+    refresh_at: float
+
+    def is_valid(self, credentials: PortalCredentials) -> bool:
+        """Check if the token can still be used with the given credentials."""
+
+        return self.credentials == credentials and time.monotonic() < self.refresh_at
+
+
+@dataclass
+class PortalClientStatistics:
+    """Counters recording reuse of pooled HTTP connections and access tokens.
+    Connection counters are updated from the connection pool of the HTTP client
+    so only count requests which actually reused or opened a connection."""
+
+    clients_created: int = 0
+    connections_reused: int = 0
+    connections_created: int = 0
+    token_hits: int = 0
+    token_misses: int = 0
+    token_invalidations: int = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        """Return the counters as a dictionary."""
+
+        return {
+            "clientsCreated": self.clients_created,
+            "connectionsReused": self.connections_reused,
+            "connectionsCreated": self.connections_created,
+            "tokenHits": self.token_hits,
+            "tokenMisses": self.token_misses,
+            "tokenInvalidations": self.token_invalidations,
+        }
+
+
+@dataclass
+class PortalHealth:
+    """Rolling record of the outcome and latency of requests made against a
+    training portal, with a circuit breaker which trips when consecutive
+    requests fail. While the circuit is open the portal should not be used for
+    placing workshop sessions. Once the cool down period has elapsed the
+    circuit is half open and a single trial request is allowed through, with
+    its outcome determining whether the circuit closes or opens again. If no
+    outcome is recorded within the request timeout, another trial request is
+    allowed through."""
+
+    samples: collections.deque = field(
+        default_factory=lambda: collections.deque(maxlen=PORTAL_HEALTH_WINDOW)
+    )
+    consecutive_failures: int = 0
+    circuit_opened_at: float | None = None
+    circuit_trips: int = 0
+    trial_started_at: float | None = None
+
+    def record(self, success: bool, latency: float) -> None:
+        """Record the outcome and latency of a request."""
+
+        self.samples.append((success, latency))
+
+        self.trial_started_at = None
+
+        if success:
+            self.consecutive_failures = 0
+            self.circuit_opened_at = None
+
+            return
+
+        self.consecutive_failures += 1
+
+        if self.circuit_opened_at is not None:
+            # A failure while half open, or while open for requests which were
+            # already in flight, restarts the cool down period.
+
+            self.circuit_opened_at = time.monotonic()
+
+        elif self.consecutive_failures >= PORTAL_CIRCUIT_FAILURE_THRESHOLD:
+            self.circuit_opened_at = time.monotonic()
+            self.circuit_trips += 1
+
+    @property
+    def circuit_state(self) -> str:
+        """Return the state of the circuit breaker."""
+
+        if self.circuit_opened_at is None:
+            return "closed"
+
+        if time.monotonic() - self.circuit_opened_at < PORTAL_CIRCUIT_COOLDOWN:
+            return "open"
+
+        return "half-open"
+
+    def is_available(self) -> bool:
+        """Check if the portal can be used for placing workshop sessions. When
+        the circuit is half open, only the caller which is granted the trial
+        request is told the portal is available."""
+
+        state = self.circuit_state
+
+        if state == "closed":
+            return True
+
+        if state == "open":
+            return False
+
+        now = time.monotonic()
+
+        if (
+            self.trial_started_at is not None
+            and now - self.trial_started_at < PORTAL_REQUEST_TIMEOUT
+        ):
+            return False
+
+        self.trial_started_at = now
+
+        return True
+
+    @property
+    def error_rate(self) -> float:
+        """Return the fraction of recent requests which failed."""
+
+        if not self.samples:
+            return 0.0
+
+        return sum(1 for success, _ in self.samples if not success) / len(self.samples)
+
+    @property
+    def latency(self) -> float:
+        """Return the mean latency of recent requests in seconds."""
+
+        if not self.samples:
+            return 0.0
+
+        return sum(latency for _, latency in self.samples) / len(self.samples)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the health of the portal as a dictionary."""
+
+        return {
+            "circuit": self.circuit_state,
+            "circuitTrips": self.circuit_trips,
+            "errorRate": self.error_rate,
+            "latency": self.latency,
+            "samples": len(self.samples),
+        }
+
+
+@dataclass
+class PortalClientPool:
+    """Long lived HTTP client and access token cache for a training portal. The
+    HTTP client is bound to the event loop it was created in, so if it is later
+    used from a different event loop a new client is created."""
+
+    http_client: ClientSession | None = None
+    event_loop: asyncio.AbstractEventLoop | None = None
+    token_lock: asyncio.Lock | None = None
+    access_token: PortalAccessToken | None = None
+    statistics: PortalClientStatistics = field(default_factory=PortalClientStatistics)
+
+    def get_http_client(self) -> ClientSession:
+        """Return the pooled HTTP client, creating it if required. Must be
+        called from within a running event loop."""
+
+        event_loop = asyncio.get_running_loop()
+
+        if (
+            self.http_client is not None
+            and not self.http_client.closed
+            and self.event_loop is event_loop
+        ):
+            return self.http_client
+
+        self.statistics.clients_created += 1
+
+        self.close()
+
+        self.http_client = ClientSession(
+            connector=TCPConnector(limit=PORTAL_CONNECTION_LIMIT),
+            timeout=ClientTimeout(total=PORTAL_REQUEST_TIMEOUT),
+            trace_configs=[self.trace_config()],
+        )
+        self.event_loop = event_loop
+        self.token_lock = asyncio.Lock()
+        self.access_token = None
+
+        return self.http_client
+
+    def trace_config(self) -> TraceConfig:
+        """Return a trace config which counts connections reused from, or
+        newly opened by, the connection pool of the HTTP client."""
+
+        statistics = self.statistics
+
+        async def on_connection_reused(*_) -> None:
+            statistics.connections_reused += 1
+
+        async def on_connection_created(*_) -> None:
+            statistics.connections_created += 1
+
+        trace_config = TraceConfig()
+        trace_config.on_connection_reuseconn.append(on_connection_reused)
+        trace_config.on_connection_create_end.append(on_connection_created)
+
+        return trace_config
+
+    def close(self) -> None:
+        """Close the pooled HTTP client. This can be called from any thread, the
+        close being scheduled on the event loop which owns the client."""
+
+        http_client, event_loop = self.http_client, self.event_loop
+
+        self.http_client = None
+        self.event_loop = None
+        self.token_lock = None
+        self.access_token = None
+
+        if http_client is None or http_client.closed or event_loop is None:
+            return
+
+        if event_loop.is_closed():
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is event_loop:
+            event_loop.create_task(http_client.close())
+        else:
+            asyncio.run_coroutine_threadsafe(http_client.close(), event_loop)
+
+
+@dataclass
+class PortalCapacitySnapshot:
+    """Capacity counts of a training portal together with snapshots of the
+    capacity counts of each workshop environment, taken at the same point in
+    time. The actual counts are only calculated when first required, so this
+    can be done after releasing the lock under which the snapshot was taken."""
+
+    allocated: int
+    environments: List[Tuple["WorkshopEnvironment", "CapacitySnapshot"]]
+
+    @cached_property
+    def actual(self) -> int:
+        """The allocated count calculated from the workshop sessions."""
+
+        return sum(snapshot.actual[0] for _, snapshot in self.environments)
+
+    def drifted(self) -> bool:
+        """Check if any of the counts differ from those calculated from the
+        workshop sessions."""
+
+        return self.actual != self.allocated or any(
+            snapshot.drifted() for _, snapshot in self.environments
+        )
+
+
 @dataclass
 class TrainingPortal:
     """Snapshot of training portal state. This includes a database of the
@@ -42,6 +337,10 @@ class TrainingPortal:
     capacity: int
     allocated: int
     environments: Dict[str, "WorkshopEnvironment"]
+    workshop_environments: Dict[str, Dict[str, "WorkshopEnvironment"]]
+    user_sessions: Dict[Tuple[str, str], Dict[str, "WorkshopSession"]]
+    client_pool: PortalClientPool
+    health: PortalHealth
 
     def __init__(
         self,
@@ -67,18 +366,39 @@ class TrainingPortal:
         self.capacity = capacity
         self.allocated = allocated
         self.environments = {}
+        self.workshop_environments = {}
+        self.user_sessions = {}
+        self.client_pool = PortalClientPool()
+        self.health = PortalHealth()
+
+    def update_labels(self, labels: List[Dict[str, str]]) -> None:
+        """Update the labels of the portal."""
+
+        if labels != self.labels:
+            self.labels = labels
+
+            self.cluster.increment_generation()
 
     def get_environments(self) -> List["WorkshopEnvironment"]:
         """Returns all workshop environments."""
 
         return list(self.environments.values())
 
-    def get_running_environments(self) -> List["WorkshopEnvironment"]:
-        """Returns all running workshop environments."""
+    def get_running_environments(
+        self, workshop_name: str = None
+    ) -> List["WorkshopEnvironment"]:
+        """Returns all running workshop environments. If a workshop name is
+        supplied, only environments for that workshop are returned, with the
+        environments being looked up using the workshop index."""
+
+        if workshop_name is None:
+            environments = self.environments.values()
+        else:
+            environments = self.workshop_environments.get(workshop_name, {}).values()
 
         return [
             environment
-            for environment in self.environments.values()
+            for environment in list(environments)
             if environment.phase == "Running"
         ]
 
@@ -90,64 +410,280 @@ class TrainingPortal:
     def add_environment(self, environment: "WorkshopEnvironment") -> None:
         """Add a workshop environment to the portal."""
 
+        self.remove_environment(environment.name)
+
         self.environments[environment.name] = environment
 
+        self.allocated += environment.allocated
+
+        self.workshop_environments.setdefault(environment.workshop, {})[
+            environment.name
+        ] = environment
+
+        for session in environment.get_sessions():
+            self.index_session(session)
+
     def remove_environment(self, environment_name: str) -> None:
         """Remove a workshop environment from the portal."""
 
-        self.environments.pop(environment_name, None)
+        environment = self.environments.pop(environment_name, None)
+
+        if not environment:
+            return
+
+        self.allocated -= environment.allocated
+
+        environments = self.workshop_environments.get(environment.workshop, {})
+
+        environments.pop(environment_name, None)
+
+        if not environments:
+            self.workshop_environments.pop(environment.workshop, None)
+
+        for session in environment.get_sessions():
+            self.unindex_session(session)
+
+    def index_session(self, session: "WorkshopSession") -> None:
+        """Add a workshop session to the index of sessions by user. Sessions
+        which have not been allocated to a user are not indexed."""
+
+        if not session.user:
+            return
+
+        key = (session.user, session.environment.workshop)
+
+        self.user_sessions.setdefault(key, {})[session.name] = session
+
+        if self.cluster.database is not None:
+            self.cluster.database.index_session(session)
+
+    def unindex_session(self, session: "WorkshopSession") -> None:
+        """Remove a workshop session from the index of sessions by user."""
+
+        if not session.user:
+            return
+
+        key = (session.user, session.environment.workshop)
+
+        sessions = self.user_sessions.get(key, {})
+
+        sessions.pop(session.name, None)
+
+        if not sessions:
+            self.user_sessions.pop(key, None)
+
+        if self.cluster.database is not None:
+            self.cluster.database.unindex_session(session)
+
+    def get_user_sessions(self) -> List["WorkshopSession"]:
+        """Returns all workshop sessions which have been allocated to a user."""
+
+        return [
+            session
+            for sessions in list(self.user_sessions.values())
+            for session in list(sessions.values())
+        ]
 
     def hosts_workshop(self, workshop_name: str) -> bool:
         """Check if the portal hosts a workshop."""
 
-        for environment in self.environments.values():
-            if environment.workshop == workshop_name:
-                return True
+        return bool(self.workshop_environments.get(workshop_name))
+
+    def capacity_snapshot(self) -> "PortalCapacitySnapshot":
+        """Return a snapshot of the capacity counts of the portal and of each
+        workshop environment. This must be called with the lock for the cluster
+        configuration held."""
 
-        return False
+        return PortalCapacitySnapshot(
+            allocated=self.allocated,
+            environments=[
+                (environment, environment.capacity_snapshot())
+                for environment in self.environments.values()
+            ],
+        )
 
-    def recalculate_capacity(self) -> None:
-        """Recalculate the capacity of the portal."""
+    def correct_capacity(self, snapshot: "PortalCapacitySnapshot") -> bool:
+        """Correct any drift found in a snapshot of the capacity counts of the
+        portal and its workshop environments. This is used to audit the counts
+        which are otherwise maintained incrementally as sessions change phase.
+        This must be called with the lock for the cluster configuration held.
+        Returns whether any of the counts had drifted and needed to be
+        corrected."""
 
-        for environment in self.environments.values():
-            environment.recalculate_capacity()
+        drifted = False
 
-        self.allocated = sum(
-            environment.allocated for environment in self.environments.values()
-        )
+        for environment, environment_snapshot in snapshot.environments:
+            if environment.correct_capacity(environment_snapshot):
+                drifted = True
 
-        logger.info(
-            "Recalculated capacity for portal %s in cluster %s: %s",
-            self.name,
-            self.cluster.name,
-            {"allocated": self.allocated, "capacity": self.capacity},
-        )
+        if snapshot.actual != snapshot.allocated:
+            allocated = self.allocated + snapshot.actual - snapshot.allocated
+
+            logger.warning(
+                "Corrected capacity drift for portal %s in cluster %s: %s",
+                self.name,
+                self.cluster.name,
+                {"allocated": [self.allocated, allocated], "capacity": self.capacity},
+            )
+
+            self.allocated = allocated
+
+            drifted = True
+
+        return drifted
 
     def find_existing_workshop_session_for_user(
         self, user_id: str, workshop_name: str
     ) -> Union["WorkshopSession", None]:
         """Find an existing workshop session for a user."""
 
-        for environment in self.environments.values():
-            for session in environment.get_sessions():
-                if (
-                    session.user == user_id
-                    and session.environment.workshop == workshop_name
-                ):
-                    return session
+        sessions = list(self.user_sessions.get((user_id, workshop_name), {}).values())
+
+        if sessions:
+            return sessions[0]
 
         return None
 
-    def client_session(self, session: ClientSession) -> "TrainingPortalClientSession":
+    def client_session(self) -> "TrainingPortalClientSession":
         """Create a HTTP client session for accessing the remote training
-        portal."""
+        portal. The session uses the pooled HTTP client and cached access
+        token for the portal."""
+
+        return TrainingPortalClientSession(self, self.client_pool.get_http_client())
+
+    def client_statistics(self) -> Dict[str, int]:
+        """Return counters for reuse of pooled connections and tokens."""
+
+        return self.client_pool.statistics.as_dict()
+
+    def close_client_pool(self) -> None:
+        """Close the pooled HTTP client for the portal. This is called when the
+        portal is discarded."""
+
+        self.client_pool.close()
+
+    async def acquire_access_token(self, session: ClientSession) -> str | None:
+        """Return a cached access token for the portal robot account, logging
+        in to the portal if there is no valid cached token."""
+
+        pool = self.client_pool
+
+        access_token = pool.access_token
+
+        if access_token and access_token.is_valid(self.credentials):
+            pool.statistics.token_hits += 1
+
+            return access_token.token
+
+        # Serialize logins so that a burst of requests results in a single
+        # token grant. Check again after acquiring the lock in case another
+        # task obtained a token while we were waiting. The lock will be absent
+        # if the pool was closed because the portal was discarded.
+
+        token_lock = pool.token_lock
 
-        return TrainingPortalClientSession(self, session)
+        if token_lock is None:
+            return None
+
+        async with token_lock:
+            access_token = pool.access_token
+
+            if access_token and access_token.is_valid(self.credentials):
+                pool.statistics.token_hits += 1
+
+                return access_token.token
+
+            pool.statistics.token_misses += 1
+
+            started = time.monotonic()
+
+            pool.access_token = await self.login(session)
+
+            self.health.record(bool(pool.access_token), time.monotonic() - started)
+
+            return pool.access_token and pool.access_token.token
+
+    def invalidate_access_token(self, token: str) -> None:
+        """Discard the cached access token if it is still the one given. This
+        is used when the portal rejects a token we believed to be valid."""
+
+        pool = self.client_pool
+
+        if pool.access_token and pool.access_token.token == token:
+            pool.statistics.token_invalidations += 1
+
+            pool.access_token = None
+
+    async def login(self, session: ClientSession) -> PortalAccessToken | None:
+        """Login to the portal service, returning the access token."""
+
+        credentials = self.credentials
+
+        try:
+            async with session.post(
+                f"{self.url}/oauth2/token/",
+                data={
+                    "grant_type": "password",
+                    "username": credentials.username,
+                    "password": credentials.password,
+                },
+                auth=BasicAuth(
+                    credentials.client_id,
+                    credentials.client_secret,
+                ),
+            ) as response:
+                if response.status != 200:
+                    logger.error(
+                        "Failed to login to portal %s of cluster %s.",
+                        self.name,
+                        self.cluster.name,
+                    )
+
+                    return None
+
+                data = await response.json()
+
+                token = data.get("access_token")
+
+                if not token:
+                    return None
+
+                expires_in = data.get("expires_in") or PORTAL_TOKEN_DEFAULT_LIFETIME
+
+                return PortalAccessToken(
+                    token=token,
+                    credentials=credentials,
+                    refresh_at=time.monotonic()
+                    + expires_in * PORTAL_TOKEN_REFRESH_FRACTION,
+                )
+
+        except ClientConnectorError as exc:
+            logger.error(
+                "Failed to connect to portal %s of cluster %s when attempting to login: %s",
+                self.name,
+                self.cluster.name,
+                exc,
+            )
+
+            return None
+
+        except (ClientError, asyncio.TimeoutError) as exc:
+            logger.error(
+                "Failed to login to portal %s of cluster %s: %r",
+                self.name,
+                self.cluster.name,
+                exc,
+            )
+
+            return None
 
 
 @dataclass
 class TrainingPortalClientSession:
-    """HTTP client session for accessing the remote training portal."""
+    """HTTP client session for accessing the remote training portal. The
+    underlying HTTP client and the access token are shared with all other
+    client sessions for the same portal, so entering the session only results
+    in a login to the portal if there is no valid cached access token."""
 
     portal: TrainingPortal
     session: ClientSession
@@ -166,9 +702,8 @@ class TrainingPortalClientSession:
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback) -> None:
-        """Logout from the portal service."""
-
-        await self.logout()
+        """Release the client session. The access token is deliberately not
+        revoked as it is cached for use by subsequent client sessions."""
 
     @property
     def connected(self):
@@ -177,76 +712,58 @@ class TrainingPortalClientSession:
         return bool(self.access_token)
 
     async def login(self) -> bool:
-        """Login to the portal service ."""
+        """Login to the portal service, using a cached access token if one is
+        available."""
 
-        try:
-            async with self.session.post(
-                f"{self.portal.url}/oauth2/token/",
-                data={
-                    "grant_type": "password",
-                    "username": self.portal.credentials.username,
-                    "password": self.portal.credentials.password,
-                },
-                auth=BasicAuth(
-                    self.portal.credentials.client_id,
-                    self.portal.credentials.client_secret,
-                ),
-            ) as response:
-                if response.status != 200:
-                    logger.error(
-                        "Failed to login to portal %s of cluster %s.",
-                        self.portal.name,
-                        self.portal.cluster.name,
-                    )
+        self.access_token = await self.portal.acquire_access_token(self.session)
 
-                    return False
+        return self.connected
 
-                data = await response.json()
+    async def relogin(self) -> bool:
+        """Discard the current access token, which the portal has rejected, and
+        login to the portal service again."""
 
-                self.access_token = data.get("access_token")
+        if self.access_token:
+            self.portal.invalidate_access_token(self.access_token)
 
-                return True
+        return await self.login()
 
-        except ClientConnectorError as exc:
-            logger.error(
-                "Failed to connect to portal %s of cluster %s when attempting to login: %s",
-                self.portal.name,
-                self.portal.cluster.name,
-                exc,
-            )
+    async def authorized_get(self, url: str, **kwargs) -> ClientResponse:
+        """Make a GET request against the portal using the access token. If the
+        portal rejects the token, for example because the portal was redeployed
+        since the token was cached, login again and retry the request once."""
 
-            return False
+        response = await self.timed_get(url, **kwargs)
 
-    async def logout(self) -> None:
-        """Logout from the portal service."""
+        if response.status == 401 and await self.relogin():
+            response.release()
 
-        if not self.connected:
-            return
+            response = await self.timed_get(url, **kwargs)
 
-        try:
-            async with self.session.post(
-                f"{self.portal.url}/oauth2/revoke-token/",
-                data={
-                    "client_id": self.portal.credentials.client_id,
-                    "client_secret": self.portal.credentials.client_secret,
-                    "token": self.access_token,
-                },
-            ) as response:
-                if response.status != 200:
-                    logger.error(
-                        "Failed to logout from portal %s of cluster %s.",
-                        self.portal.name,
-                        self.portal.cluster.name,
-                    )
+        return response
 
-        except ClientConnectorError as exc:
-            logger.error(
-                "Failed to connect to portal %s of cluster %s when attempting to logout: %s",
-                self.portal.name,
-                self.portal.cluster.name,
-                exc,
+    async def timed_get(self, url: str, **kwargs) -> ClientResponse:
+        """Make a GET request against the portal using the access token,
+        recording the outcome and latency of the request against the health of
+        the portal. Server errors, timeouts and connection failures count as
+        failed requests."""
+
+        started = time.monotonic()
+
+        try:
+            response = await self.session.get(
+                url, headers={"Authorization": f"Bearer {self.access_token}"}, **kwargs
             )
 
+        except (ClientError, asyncio.TimeoutError):
+            self.portal.health.record(False, time.monotonic() - started)
+
+            raise
+
+        self.portal.health.record(response.status < 500, time.monotonic() - started)
+
+        return response
+
     async def reacquire_workshop_session(
         self, user_id: str, environment_name: str, session_name: str, index_url: str
     ) -> Dict[str, str] | None:
@@ -258,12 +775,9 @@ class TrainingPortalClientSession:
         if not session_name:
             return
 
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-
         try:
-            async with self.session.get(
+            async with await self.authorized_get(
                 f"{self.portal.url}/workshops/environment/{environment_name}/request/",
-                headers=headers,
                 params={
                     "index_url": index_url,
                     "user": user_id,
@@ -307,6 +821,52 @@ class TrainingPortalClientSession:
                 exc,
             )
 
+        except (ClientError, asyncio.TimeoutError) as exc:
+            logger.error(
+                "Failed to reacquire session %s from portal %s of cluster %s for user %s: %r",
+                session_name,
+                self.portal.name,
+                self.portal.cluster.name,
+                user_id,
+                exc,
+            )
+
+    async def terminate_workshop_session(self, session_name: str) -> bool:
+        """Terminate a workshop session. This is used to release a workshop
+        session which was allocated but is no longer required."""
+
+        if not self.connected:
+            return False
+
+        try:
+            async with await self.authorized_get(
+                f"{self.portal.url}/workshops/session/{session_name}/terminate/",
+            ) as response:
+                if response.status != 200:
+                    logger.error(
+                        "Failed to terminate session %s from portal %s of cluster %s.",
+                        session_name,
+                        self.portal.name,
+                        self.portal.cluster.name,
+                    )
+                    logger.error("Failed response status: %s", response.status)
+                    logger.error("Failed response text: %s", await response.text())
+
+                    return False
+
+                return True
+
+        except (ClientError, asyncio.TimeoutError) as exc:
+            logger.error(
+                "Failed to terminate session %s from portal %s of cluster %s: %r",
+                session_name,
+                self.portal.name,
+                self.portal.cluster.name,
+                exc,
+            )
+
+            return False
+
     async def request_workshop_session(
         self,
         environment_name: str,
@@ -323,12 +883,9 @@ class TrainingPortalClientSession:
         if not self.connected:
             return
 
-        headers = {"Authorization": f"Bearer {self.access_token}"}
-
         try:
-            async with self.session.get(
+            async with await self.authorized_get(
                 f"{self.portal.url}/workshops/environment/{environment_name}/request/",
-                headers=headers,
                 params={
                     "user": user_id,
                     "email": user_email,
@@ -375,6 +932,14 @@ class TrainingPortalClientSession:
                 exc,
             )
 
+        except asyncio.TimeoutError:
+            logger.error(
+                "Timeout requesting workshop session from portal %s of cluster %s for user %s.",
+                self.portal.name,
+                self.portal.cluster.name,
+                user_id,
+            )
+
         except ClientError as exc:
             logger.error(
                 "Failed to request workshop session from portal %s of cluster %s for user %s: %s",
@@ -3,8 +3,6 @@
 from dataclasses import dataclass
 from typing import TYPE_CHECKING, Dict
 
-from aiohttp import ClientSession
-
 if TYPE_CHECKING:
     from .environments import WorkshopEnvironment
 
@@ -24,14 +22,13 @@ class WorkshopSession:
 
         portal = self.environment.portal
 
-        async with ClientSession() as http_client:
-            async with portal.client_session(http_client) as portal_client:
-                if not portal_client.connected:
-                    return
-
-                return await portal_client.reacquire_workshop_session(
-                    self.user,
-                    environment_name=self.environment.name,
-                    session_name=self.name,
-                    index_url=index_url,
-                )
+        async with portal.client_session() as portal_client:
+            if not portal_client.connected:
+                return
+
+            return await portal_client.reacquire_workshop_session(
+                self.user,
+                environment_name=self.environment.name,
+                session_name=self.name,
+                index_url=index_url,
+            )
@@ -1,7 +1,7 @@
 """Configuration database for training plaform tenants."""
 
-from dataclasses import dataclass
-from typing import Any, Dict, List
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
 
 from ..helpers.selectors import ResourceSelector
 from .clusters import ClusterConfig
@@ -11,16 +11,23 @@ from .portals import TrainingPortal
 
 @dataclass
 class TenantConfig:
-    """Configuration object for a tenant of the training platform."""
+    """Configuration object for a tenant of the training platform. The set of
+    portals accessible by the tenant is cached against the generation of the
+    cluster database. A tenant configuration object is replaced rather than
+    updated when the tenant rules change, so the cache is discarded then."""
 
     name: str
     clusters: ResourceSelector
     portals: ResourceSelector
+    accessible_portals: Tuple[int, List[TrainingPortal]] = field(
+        default=None, repr=False, compare=False
+    )
 
     def __init__(self, name: str, clusters: Dict[str, Any], portals: Dict[str, Any]):
         self.name = name
         self.clusters = ResourceSelector(clusters)
         self.portals = ResourceSelector(portals)
+        self.accessible_portals = None
 
     def allowed_access_to_cluster(self, cluster: ClusterConfig) -> bool:
         """Check if the tenant has access to the cluster."""
@@ -57,6 +64,16 @@ class TenantConfig:
     def portals_which_are_accessible(self) -> List[TrainingPortal]:
         """Retrieve a list of training portals accessible by a tenant."""
 
+        # Return the cached list of portals if the cluster database has not
+        # changed since it was calculated. The generation is read before the
+        # list is calculated so that changes made while it is being calculated
+        # will result in it being calculated again on the next call.
+
+        generation = cluster_database.generation
+
+        if self.accessible_portals and self.accessible_portals[0] == generation:
+            return list(self.accessible_portals[1])
+
         # Get the list of clusters and portals that match the tenant's rules.
         # To do this we iterate over all the portals and for each portal we then
         # check the cluster it belongs to against the tenant's cluster rules.
@@ -71,4 +88,6 @@ class TenantConfig:
                     if self.allowed_access_to_portal(portal):
                         accessible_portals.append(portal)
 
-        return accessible_portals
+        self.accessible_portals = (generation, accessible_portals)
+
+        return list(accessible_portals)
@@ -0,0 +1,121 @@
+"""Cache of verified client access tokens."""
+
+import collections
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+from ..config import JWT_TOKEN_CACHE_SIZE
+
+if TYPE_CHECKING:
+    from .clients import ClientConfig
+
+
+@dataclass
+class VerifiedToken:
+    """Details of a client access token which has been verified."""
+
+    client: "ClientConfig"
+    decoded_token: Dict[str, Any]
+    expires_at: float
+
+    def has_expired(self) -> bool:
+        """Check if the token has expired."""
+
+        return time.time() >= self.expires_at
+
+
+@dataclass
+class TokenCache:
+    """Bounded least recently used cache of verified client access tokens.
+    Tokens are keyed by the encoded token string so that a cache hit avoids
+    decoding the token and verifying its signature. Entries for a client must
+    be invalidated when tokens for the client are revoked or the client is
+    updated or removed. A generation is kept for each client which is bumped
+    whenever the client is invalidated, so that a token verified against the
+    client before it was invalidated is not then added to the cache."""
+
+    tokens: "collections.OrderedDict[str, VerifiedToken]" = field(
+        default_factory=collections.OrderedDict
+    )
+    maxsize: int = JWT_TOKEN_CACHE_SIZE
+    generations: Dict[str, int] = field(default_factory=dict)
+    hits: int = 0
+    misses: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get_token(self, token: str) -> Union[VerifiedToken, None]:
+        """Return the verified token if it is in the cache and has not expired."""
+
+        with self.lock:
+            verified_token = self.tokens.get(token)
+
+            if verified_token is None:
+                self.misses += 1
+
+                return None
+
+            if verified_token.has_expired():
+                del self.tokens[token]
+
+                self.misses += 1
+
+                return None
+
+            self.tokens.move_to_end(token)
+
+            self.hits += 1
+
+            return verified_token
+
+    def client_generation(self, name: str) -> int:
+        """Return the current generation for the named client. This must be
+        obtained before looking up the client to verify a token."""
+
+        with self.lock:
+            return self.generations.get(name, 0)
+
+    def add_token(
+        self,
+        token: str,
+        client: "ClientConfig",
+        decoded_token: Dict[str, Any],
+        generation: int,
+    ) -> None:
+        """Add a verified token to the cache. The token is not added if the
+        client has been invalidated since the generation was obtained, as the
+        token was then verified against stale details of the client."""
+
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            if self.generations.get(client.name, 0) != generation:
+                return
+
+            self.tokens[token] = VerifiedToken(
+                client=client,
+                decoded_token=decoded_token,
+                expires_at=decoded_token.get("exp", 0),
+            )
+
+            self.tokens.move_to_end(token)
+
+            while len(self.tokens) > self.maxsize:
+                self.tokens.popitem(last=False)
+
+    def invalidate_client(self, name: str) -> None:
+        """Remove all tokens for the named client from the cache."""
+
+        with self.lock:
+            self.generations[name] = self.generations.get(name, 0) + 1
+
+            for token, verified_token in list(self.tokens.items()):
+                if verified_token.client.name == name:
+                    del self.tokens[token]
+
+
+# Create the cache instance.
+
+token_cache = TokenCache()
@@ -1,8 +1,56 @@
 """Configuration for the lookup service."""
 
 import functools
+import os
 import random
 
+# Maximum number of verified client access tokens which are cached so that the
+# signature of a token doesn't need to be verified on every request. A size of
+# 0 disables the cache.
+
+JWT_TOKEN_CACHE_SIZE = int(os.getenv("JWT_TOKEN_CACHE_SIZE", "1024"))
+
+# Number of event loops on which the operators watching managed clusters are
+# run. With the default of 0, each managed cluster is given its own dedicated
+# event loop and thread. Otherwise operators are spread across the given fixed
+# number of event loops, keeping the number of threads constant as clusters are
+# added.
+
+OPERATOR_EVENT_LOOPS = int(os.getenv("OPERATOR_EVENT_LOOPS", "0"))
+
+# Interval in seconds at which the capacity counts maintained incrementally for
+# training portals and workshop environments are audited against the sessions
+# actually held. An interval of 0 disables the audit.
+
+CAPACITY_AUDIT_INTERVAL = float(os.getenv("CAPACITY_AUDIT_INTERVAL", "300"))
+
+# Timeouts in seconds used when allocating workshop sessions. The portal request
+# timeout applies to each individual HTTP request made against a training
+# portal. The placement deadline bounds the total time spent trying candidate
+# workshop environments for a single request. If a candidate hasn't responded
+# within the hedge delay, the next best candidate is tried in parallel, with at
+# most the given number of candidates being tried at the same time. Candidates
+# are only tried in parallel for requests which don't identify a user.
+
+PORTAL_REQUEST_TIMEOUT = float(os.getenv("PORTAL_REQUEST_TIMEOUT", "10"))
+PLACEMENT_DEADLINE = float(os.getenv("PLACEMENT_DEADLINE", "30"))
+PLACEMENT_HEDGE_DELAY = float(os.getenv("PLACEMENT_HEDGE_DELAY", "2"))
+PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT = int(
+    os.getenv("PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT", "2")
+)
+
+# Settings for tracking the health of training portals. The outcome and latency
+# of the most recent requests made against a portal are retained. If the given
+# number of consecutive requests fail, the portal is removed from consideration
+# when placing workshop sessions for the cool down period, after which a trial
+# request is allowed through to determine if the portal has recovered.
+
+PORTAL_HEALTH_WINDOW = int(os.getenv("PORTAL_HEALTH_WINDOW", "20"))
+PORTAL_CIRCUIT_FAILURE_THRESHOLD = int(
+    os.getenv("PORTAL_CIRCUIT_FAILURE_THRESHOLD", "5")
+)
+PORTAL_CIRCUIT_COOLDOWN = float(os.getenv("PORTAL_CIRCUIT_COOLDOWN", "30"))
+
 
 @functools.lru_cache(maxsize=1)
 def jwt_token_secret() -> str:
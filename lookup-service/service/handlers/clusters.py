@@ -2,8 +2,11 @@
 
 import asyncio
 import base64
+import datetime
+import functools
 import logging
-from typing import Any, Dict
+import time
+from typing import Any, Callable, Dict
 
 import kopf
 import yaml
@@ -13,11 +16,17 @@ from ..caches.clusters import ClusterConfig
 from ..caches.environments import WorkshopEnvironment
 from ..caches.portals import PortalCredentials, TrainingPortal
 from ..caches.sessions import WorkshopSession
+from ..config import CAPACITY_AUDIT_INTERVAL
 from ..helpers.kubeconfig import (
     create_kubeconfig_from_access_token_secret,
     extract_context_from_kubeconfig,
     verify_kubeconfig_format,
 )
+from ..helpers.metrics import (
+    operator_event_duration_seconds,
+    operator_event_lag_seconds,
+    operator_events_total,
+)
 from ..helpers.objects import xgetattr
 from ..helpers.operator import GenericOperator
 from ..service import ServiceState
@@ -164,7 +173,7 @@ def clusterconfigs_update(
                 generation,
             )
 
-            cluster_config.labels = xgetattr(spec, "labels", [])
+            cluster_config.update_labels(xgetattr(spec, "labels", []))
             cluster_config.kubeconfig = kubeconfig
 
 
@@ -181,14 +190,115 @@ def clusterconfigs_delete(name: str, meta: kopf.Meta, memo: ServiceState, **_):
     cluster_database.remove_cluster(name)
 
 
+def resource_modification_lag(body: Dict[str, Any]) -> float | None:
+    """Return the time in seconds since the resource was last modified, as
+    recorded in the managed fields of the resource. Returns None if this
+    cannot be determined."""
+
+    timestamps = [
+        entry.get("time")
+        for entry in xgetattr(body, "metadata.managedFields", [])
+        if entry.get("time")
+    ]
+
+    if not timestamps:
+        return None
+
+    try:
+        modified = max(
+            datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+            for timestamp in timestamps
+        )
+
+    except ValueError:
+        return None
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    return max(0.0, (now - modified).total_seconds())
+
+
+def operator_event_metrics(cluster_name: str, resource: str) -> Callable:
+    """Decorator for kopf event handlers of a managed cluster which records the
+    number of events processed, the time taken to process them, and the lag
+    between a resource being modified and the event being processed."""
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        async def wrapper(event: kopf.RawEvent, **kwargs) -> Any:
+            started = time.perf_counter()
+
+            # Events from the initial listing of resources have no type and
+            # are excluded as the resources may not have changed for a long
+            # time. Deleted resources are excluded as finalizers may delay
+            # the event well after the resource was last modified.
+
+            if xgetattr(event, "type") in ("ADDED", "MODIFIED"):
+                lag = resource_modification_lag(xgetattr(event, "object", {}))
+
+                if lag is not None:
+                    operator_event_lag_seconds.observe(lag, cluster_name, resource)
+
+            try:
+                return await handler(event=event, **kwargs)
+
+            finally:
+                operator_events_total.inc(cluster_name, resource)
+                operator_event_duration_seconds.observe(
+                    time.perf_counter() - started, cluster_name, resource
+                )
+
+        return wrapper
+
+    return decorator
+
+
 class ClusterOperator(GenericOperator):
     """Operator for interacting with training platform on separate cluster."""
 
+    periodic_tasks_interval = CAPACITY_AUDIT_INTERVAL
+
     def __init__(self, cluster_name: str, service_state: ServiceState) -> None:
         """Initializes the operator."""
 
         super().__init__(cluster_name, service_state=service_state)
 
+    def run_periodic_tasks(self) -> None:
+        """Audit the capacity counts for each training portal of the cluster.
+        The counts are maintained incrementally as workshop session events are
+        received, so this is a safety net which corrects and reports any drift
+        from the sessions actually held. The lock for the cluster configuration
+        is also acquired by the event handlers, which may share an event loop
+        with other clusters, so it is only held while taking a snapshot of the
+        counts and while applying any corrections."""
+
+        with synchronized(self.cluster_config):
+            snapshots = [
+                (portal, portal.capacity_snapshot())
+                for portal in self.cluster_config.get_portals()
+            ]
+
+        drifted = [
+            (portal, snapshot) for portal, snapshot in snapshots if snapshot.drifted()
+        ]
+
+        if not drifted:
+            return
+
+        with synchronized(self.cluster_config):
+            corrected = [
+                portal.name
+                for portal, snapshot in drifted
+                if portal.correct_capacity(snapshot)
+            ]
+
+        if corrected:
+            logger.warning(
+                "Capacity audit for cluster %s corrected drift for portals %s.",
+                self.cluster_name,
+                corrected,
+            )
+
     def register_handlers(self) -> None:
         """Register the handlers for the training platform operator."""
 
@@ -196,6 +306,7 @@ class ClusterOperator(GenericOperator):
             "trainingportals.training.educates.dev",
             registry=self.operator_registry,
         )
+        @operator_event_metrics(self.cluster_name, "trainingportals")
         async def trainingportals_event(event: kopf.RawEvent, **_):
             """Handles events for training portals."""
 
@@ -271,7 +382,7 @@ class ClusterOperator(GenericOperator):
 
                         portal_state.uid = portal_uid
                         portal_state.generation = xgetattr(metadata, "generation")
-                        portal_state.labels = xgetattr(spec, "portal.labels", [])
+                        portal_state.update_labels(xgetattr(spec, "portal.labels", []))
                         portal_state.url = xgetattr(status, "educates.url")
                         portal_state.phase = xgetattr(status, "educates.phase")
                         portal_state.credentials = credentials
@@ -279,13 +390,12 @@ class ClusterOperator(GenericOperator):
                             spec, "portal.sessions.maximum", 0
                         )
 
-                    portal_state.recalculate_capacity()
-
         @kopf.on.event(
             "workshopenvironments.training.educates.dev",
             labels={"training.educates.dev/portal.name": kopf.PRESENT},
             registry=self.operator_registry,
         )
+        @operator_event_metrics(self.cluster_name, "workshopenvironments")
         async def workshopenvironments_event(event: kopf.RawEvent, **_):
             """Handles events for workshop environments."""
 
@@ -325,7 +435,6 @@ class ClusterOperator(GenericOperator):
                         )
 
                         portal.remove_environment(environment_name)
-                        portal.recalculate_capacity()
 
                         if portal.phase == "Unknown" and not portal.get_environments():
                             logger.info(
@@ -429,8 +538,6 @@ class ClusterOperator(GenericOperator):
                             status, "educates.reserved", 0
                         )
 
-                    portal.recalculate_capacity()
-
         @kopf.on.event(
             "workshopsessions.training.educates.dev",
             labels={
@@ -439,6 +546,7 @@ class ClusterOperator(GenericOperator):
             },
             registry=self.operator_registry,
         )
+        @operator_event_metrics(self.cluster_name, "workshopsessions")
         async def workshopsessions_event(event: kopf.RawEvent, **_):
             """Handles events for workshop sessions."""
 
@@ -482,7 +590,6 @@ class ClusterOperator(GenericOperator):
                             )
 
                             environment.remove_session(session_name)
-                            portal.recalculate_capacity()
 
                             if environment.phase == "Unknown" and not environment.get_sessions():
                                 logger.info(
@@ -611,19 +718,19 @@ class ClusterOperator(GenericOperator):
                             xgetattr(status, "educates.user"),
                         )
 
-                        session_state.generation = xgetattr(metadata, "generation")
-                        session_state.phase = xgetattr(status, "educates.phase")
-                        session_state.user = xgetattr(status, "educates.user")
-
-                    portal.recalculate_capacity()
+                        environment.update_session(
+                            session_state,
+                            generation=xgetattr(metadata, "generation"),
+                            phase=xgetattr(status, "educates.phase"),
+                            user=xgetattr(status, "educates.user"),
+                        )
 
 
 @kopf.daemon(
     "clusterconfigs.lookup.educates.dev",
     cancellation_backoff=5.0,
-    cancellation_polling=5.0,
 )
-def clusterconfigs_daemon(
+async def clusterconfigs_daemon(
     stopped: kopf.DaemonStopped,
     name: str,
     uid: str,
@@ -647,11 +754,13 @@ def clusterconfigs_daemon(
             delay=5 if not retry else 15,
         )
 
-    # Start the cluster operator and wait for it to complete. An infinite loop
-    # is used to keep the daemon thread running until the daemon is stopped as
-    # kopf framework expects this daemon thread to be running indefinitely until
-    # it is stopped.
+    # Start the cluster operator and wait for it to complete. The daemon is
+    # async so that no thread is dedicated to each cluster, the operator itself
+    # running on an event loop shared with operators for other clusters. An
+    # infinite loop is used to keep the daemon running until it is stopped as
+    # kopf framework expects this daemon to be running indefinitely until it is
+    # stopped.
 
     operator = ClusterOperator(cluster_config, memo)
 
-    operator.run_until_stopped(stopped)
+    await operator.run_until_stopped(stopped)
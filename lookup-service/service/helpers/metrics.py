@@ -0,0 +1,268 @@
+"""Minimal metrics registry rendering the Prometheus text exposition format.
+
+Metrics are updated from both the kopf operator threads and the aiohttp server
+thread, so each metric guards its values with a lock. Values which are derived
+from the state of the caches are calculated only when metrics are collected by
+registering a collector function.
+"""
+
+import bisect
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Default histogram buckets in seconds, suitable for request latencies.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    """Format label names and values for the text exposition format."""
+
+    pairs = []
+
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{value}"')
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(pairs) + "}"
+
+
+@dataclass
+class Counter:
+    """Counter metric which can only increase."""
+
+    name: str
+    documentation: str
+    labels: Tuple[str, ...] = ()
+    values: Dict[LabelValues, float] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Increment the counter for the given label values."""
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        """Render the metric in the text exposition format."""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+
+        return lines
+
+
+@dataclass
+class Histogram:
+    """Histogram metric recording the distribution of observed values."""
+
+    name: str
+    documentation: str
+    labels: Tuple[str, ...] = ()
+    buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    values: Dict[LabelValues, Tuple[List[int], float, int]] = field(
+        default_factory=dict
+    )
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Record an observed value for the given label values."""
+
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts, total, count = self.values.get(
+                labels, ([0] * len(self.buckets), 0.0, 0)
+            )
+
+            if index < len(counts):
+                counts[index] += 1
+
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        """Render the metric in the text exposition format."""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self.lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{self.name}_bucket"
+                        f"{format_labels(self.labels + ('le',), labels + (bound,))}"
+                        f" {cumulative}"
+                    )
+
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{format_labels(self.labels + ('le',), labels + ('+Inf',))}"
+                    f" {count}"
+                )
+                lines.append(
+                    f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+                )
+                lines.append(
+                    f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+                )
+
+        return lines
+
+
+@dataclass
+class Gauge:
+    """Gauge metric whose values are calculated when metrics are collected by
+    calling the supplied function, which returns a mapping of label values to
+    the current value."""
+
+    name: str
+    documentation: str
+    labels: Tuple[str, ...]
+    collect: Callable[[], Dict[LabelValues, float]]
+    kind: str = "gauge"
+
+    def render(self) -> List[str]:
+        """Render the metric in the text exposition format."""
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+
+        return lines
+
+
+@dataclass
+class MetricsRegistry:
+    """Registry of metrics to be exposed."""
+
+    metrics: Dict[str, Counter | Histogram | Gauge] = field(default_factory=dict)
+
+    def register(
+        self, metric: Counter | Histogram | Gauge
+    ) -> Counter | Histogram | Gauge:
+        """Register a metric, returning the metric."""
+
+        self.metrics[metric.name] = metric
+
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labels: Tuple[str, ...] = ()
+    ) -> Counter:
+        """Create and register a counter metric."""
+
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Create and register a histogram metric."""
+
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labels: Tuple[str, ...],
+        collect: Callable[[], Dict[LabelValues, float]],
+        kind: str = "gauge",
+    ) -> Gauge:
+        """Create and register a gauge metric calculated at collection time."""
+
+        return self.register(Gauge(name, documentation, labels, collect, kind))
+
+    def render(self) -> str:
+        """Render all metrics in the text exposition format."""
+
+        lines = []
+
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+# Global registry and metrics shared by the REST API handlers and the kopf
+# operator handlers.
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    "lookup_http_requests_total",
+    "Total number of HTTP requests handled.",
+    ("method", "route", "status"),
+)
+
+http_request_duration_seconds = registry.histogram(
+    "lookup_http_request_duration_seconds",
+    "Time taken to handle HTTP requests.",
+    ("method", "route"),
+)
+
+workshop_requests_total = registry.counter(
+    "lookup_workshop_requests_total",
+    "Total number of workshop session requests by outcome.",
+    ("outcome",),
+)
+
+placement_attempts = registry.histogram(
+    "lookup_placement_attempts",
+    "Number of workshop environments tried when placing a workshop session.",
+    (),
+    (1, 2, 3, 4, 5, 10, 20),
+)
+
+operator_events_total = registry.counter(
+    "lookup_operator_events_total",
+    "Total number of resource events processed for managed clusters.",
+    ("cluster", "resource"),
+)
+
+operator_event_duration_seconds = registry.histogram(
+    "lookup_operator_event_duration_seconds",
+    "Time taken to process resource events for managed clusters.",
+    ("cluster", "resource"),
+)
+
+operator_event_lag_seconds = registry.histogram(
+    "lookup_operator_event_lag_seconds",
+    "Time between a resource being modified in a managed cluster and the event being processed.",  # pylint: disable=line-too-long
+    ("cluster", "resource"),
+    (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+operator_loop_lag_seconds = registry.histogram(
+    "lookup_operator_loop_lag_seconds",
+    "Delay in the event loop running the operator for a managed cluster waking up when scheduled.",  # pylint: disable=line-too-long
+    ("cluster",),
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
@@ -1,35 +1,203 @@
 """Base class and helper functions for kopf based operator."""
 
 import asyncio
+import concurrent.futures
 import contextlib
+import contextvars
 import logging
 import threading
 import time
+import weakref
+from typing import Any, Coroutine, Iterator, List, Set
 
 import aiohttp
 import kopf
 
 from ..caches.clusters import ClusterConfig
+from ..config import OPERATOR_EVENT_LOOPS
 from ..service import ServiceState
 from .kubeconfig import create_connection_info_from_kubeconfig
+from .metrics import operator_loop_lag_seconds
 
 logger = logging.getLogger("educates")
 
 
-class GenericOperator(threading.Thread):
+# Context variable identifying the operator on whose behalf an asyncio task was
+# created. This is inherited by any tasks subsequently created by that task and
+# is used to distinguish between tasks of operators sharing an event loop.
+
+_operator_owner: contextvars.ContextVar = contextvars.ContextVar(
+    "operator_owner", default=None
+)
+
+
+class OperatorEventLoop(threading.Thread):
+    """Thread running an event loop on which one or more operators are run."""
+
+    def __init__(self, name: str) -> None:
+        """Initializes the event loop and thread."""
+
+        super().__init__(name=name, daemon=True)
+
+        self.event_loop = asyncio.new_event_loop()
+        self.event_loop.set_task_factory(self._create_task)
+
+        self.operators: Set["GenericOperator"] = set()
+
+        self.task_owners: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _create_task(
+        self,
+        event_loop: asyncio.AbstractEventLoop,
+        coro: Coroutine,
+        context: contextvars.Context | None = None,
+    ) -> asyncio.Task:
+        """Creates a task, recording the operator it was created for."""
+
+        if context is not None:
+            owner = context.get(_operator_owner)
+        else:
+            owner = _operator_owner.get()
+
+        task = asyncio.Task(coro, loop=event_loop, context=context)
+
+        if owner is not None:
+            self.task_owners[task] = owner
+
+        return task
+
+    def run(self) -> None:
+        """Runs the event loop until stopped."""
+
+        asyncio.set_event_loop(self.event_loop)
+
+        with contextlib.closing(self.event_loop):
+            self.event_loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """Schedules a coroutine to run on the event loop."""
+
+        return asyncio.run_coroutine_threadsafe(coro, self.event_loop)
+
+    def stop(self) -> None:
+        """Flags the event loop to stop."""
+
+        self.event_loop.call_soon_threadsafe(self.event_loop.stop)
+
+
+class OperatorEventLoopPool:
+    """Pool of event loops on which operators are run. With a size of 0, each
+    operator is given its own dedicated event loop, which is stopped when the
+    operator exits. Otherwise operators are spread across a fixed number of
+    event loops which are created as needed and then retained."""
+
+    def __init__(self, size: int) -> None:
+        """Initializes the pool."""
+
+        self.size = size
+
+        self.event_loops: List[OperatorEventLoop] = []
+
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, operator: "GenericOperator") -> OperatorEventLoop:
+        """Returns the event loop the operator should run on, choosing the
+        event loop with the least operators when the pool is full."""
+
+        with self._lock:
+            if self.size and len(self.event_loops) >= self.size:
+                event_loop = min(self.event_loops, key=lambda item: len(item.operators))
+
+            else:
+                event_loop = OperatorEventLoop(f"operator-loop-{self._counter}")
+
+                self._counter += 1
+
+                self.event_loops.append(event_loop)
+
+                event_loop.start()
+
+            event_loop.operators.add(operator)
+
+            return event_loop
+
+    def release(
+        self, event_loop: OperatorEventLoop, operator: "GenericOperator"
+    ) -> None:
+        """Releases the event loop the operator was running on. A dedicated
+        event loop is stopped and its thread waited on."""
+
+        with self._lock:
+            event_loop.operators.discard(operator)
+
+            if self.size or event_loop.operators:
+                return
+
+            self.event_loops.remove(event_loop)
+
+        event_loop.stop()
+        event_loop.join()
+
+    def get_event_loops(self) -> List[OperatorEventLoop]:
+        """Returns the current event loops."""
+
+        with self._lock:
+            return list(self.event_loops)
+
+
+# Global pool of event loops for the operators watching managed clusters.
+
+operator_event_loops = OperatorEventLoopPool(OPERATOR_EVENT_LOOPS)
+
+
+class ForeignTasks:
+    """Collection of tasks on an event loop which were not created on behalf of
+    the operator. When the kopf operator exits, it cancels any tasks created
+    since it started which are not in the collection of ignored tasks. Passing
+    this as that collection ensures that tasks of other operators sharing the
+    event loop are left alone."""
+
+    def __init__(self, event_loop: OperatorEventLoop, owner: Any) -> None:
+        self.event_loop = event_loop
+        self.owner = owner
+
+    def __contains__(self, task: object) -> bool:
+        return self.event_loop.task_owners.get(task) is not self.owner
+
+    def __iter__(self) -> Iterator[asyncio.Task]:
+        return (
+            task
+            for task in asyncio.all_tasks(self.event_loop.event_loop)
+            if task in self
+        )
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class GenericOperator:
     """Base class for kopf based operator."""
 
+    # Interval in seconds at which run_periodic_tasks() is called while the
+    # operator is running. An interval of 0 means it is never called.
+
+    periodic_tasks_interval: float = 0.0
+
+    # Interval in seconds at which the delay in the event loop the operator is
+    # running on waking up is sampled.
+
+    loop_lag_interval: float = 1.0
+
     def __init__(
         self,
         cluster_config: ClusterConfig,
         *,
         namespaces: str = None,
-        service_state: ServiceState
+        service_state: ServiceState,
     ) -> None:
         """Initializes the operator."""
 
-        super().__init__()
-
         # Set the name of the operator and the namespaces to watch for
         # resources. When the list of namespaces is empty, the operator will
         # watch for resources cluster wide.
@@ -50,9 +218,16 @@ class GenericOperator(threading.Thread):
 
         # Create a stop flag to signal the operator to stop running. This is
         # used to bridge between the kopf variable for stopping the operator
-        # and event required to stop the event loop for the operator.
+        # and the event used to stop the operator within its event loop.
 
         self._stop_flag = threading.Event()
+        self._stop_event = asyncio.Event()
+
+        # The event loop the operator is running on and the future for when
+        # the operator exits. These are set when the operator is started.
+
+        self._event_loop: OperatorEventLoop | None = None
+        self._future: concurrent.futures.Future | None = None
 
     @property
     def cluster_name(self):
@@ -71,29 +246,37 @@ class GenericOperator(threading.Thread):
 
         raise NotImplementedError("Subclasses must implement this method.")
 
-    def run(self) -> None:
-        """Starts the kopf operator in a separate event loop."""
+    def run_periodic_tasks(self) -> None:
+        """Run any periodic housekeeping tasks for the operator. Subclasses can
+        override this method. It is called from a worker thread and not from
+        the operator event loop."""
 
-        # Register the login function for the operator.
+    async def monitor_loop_lag(self) -> None:
+        """Periodically records how late the event loop the operator is running
+        on is in waking up when scheduled. This grows when the event loop is
+        overloaded, delaying the processing of events for the cluster."""
 
-        @kopf.on.login(registry=self.operator_registry)
-        def login_fn(**_) -> dict:
-            """Returns login credentials for the cluster calculated from the
-            configuration currently held in the cluster configuration cache."""
+        event_loop = asyncio.get_running_loop()
 
-            return create_connection_info_from_kubeconfig(self.kubeconfig)
+        while True:
+            expected = event_loop.time() + self.loop_lag_interval
 
-        @kopf.on.cleanup()
-        async def cleanup_fn(**_) -> None:
-            """Cleanup function for operator."""
+            await asyncio.sleep(self.loop_lag_interval)
 
-            # Workaround for possible kopf bug, set stop flag.
+            operator_loop_lag_seconds.observe(
+                max(0.0, event_loop.time() - expected), self.cluster_name
+            )
 
-            self._stop_flag.set()
+    async def run_operator(self) -> None:
+        """Runs the kopf operator on the current event loop until stopped."""
 
-        # Register the kopf handlers for this operator.
+        # Start monitoring the event loop before marking this task as being
+        # owned by the operator, so kopf doesn't cancel the monitor if the
+        # operator needs to be restarted.
 
-        self.register_handlers()
+        monitor = asyncio.get_running_loop().create_task(self.monitor_loop_lag())
+
+        _operator_owner.set(self)
 
         # Determine if the operator should be run clusterwide or in specific
         # namespaces.
@@ -103,27 +286,23 @@ class GenericOperator(threading.Thread):
         if not self.namespaces:
             clusterwide = True
 
-        # Run the operator in a separate event loop, waiting for the stop flag
-        # to be set, at which point the operator will be stopped and this thread
-        # will exit.
-
-        while not self._stop_flag.is_set():
-            event_loop = asyncio.new_event_loop()
-
-            asyncio.set_event_loop(event_loop)
+        try:
+            while not self._stop_flag.is_set():
+                logger.info(
+                    "Starting managed cluster operator for %s.", self.cluster_name
+                )
 
-            logger.info("Starting managed cluster operator for %s.", self.cluster_name)
-
-            with contextlib.closing(event_loop):
                 try:
-                    event_loop.run_until_complete(
-                        kopf.operator(
-                            registry=self.operator_registry,
-                            clusterwide=clusterwide,
-                            namespaces=self.namespaces,
-                            memo=self.service_state,
-                            stop_flag=self._stop_flag,
-                        )
+                    operator_tasks = await kopf.spawn_tasks(
+                        registry=self.operator_registry,
+                        clusterwide=clusterwide,
+                        namespaces=self.namespaces,
+                        memo=self.service_state,
+                        stop_flag=self._stop_event,
+                    )
+
+                    await kopf.run_tasks(
+                        operator_tasks, ignored=ForeignTasks(self._event_loop, self)
                     )
 
                 except (
@@ -146,27 +325,102 @@ class GenericOperator(threading.Thread):
                         "Connection error, restarting operator after delay."
                     )
 
-                    time.sleep(5.0)
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._stop_event.wait(), 5.0)
+
+        finally:
+            monitor.cancel()
+
+    def start(self) -> None:
+        """Starts the kopf operator on an event loop from the pool."""
+
+        # Register the login function for the operator.
+
+        @kopf.on.login(registry=self.operator_registry)
+        def login_fn(**_) -> dict:
+            """Returns login credentials for the cluster calculated from the
+            configuration currently held in the cluster configuration cache."""
+
+            return create_connection_info_from_kubeconfig(self.kubeconfig)
+
+        @kopf.on.cleanup()
+        async def cleanup_fn(**_) -> None:
+            """Cleanup function for operator."""
+
+            # Workaround for possible kopf bug, set stop flag.
+
+            self.cancel()
+
+        # Register the kopf handlers for this operator.
+
+        self.register_handlers()
+
+        # Run the operator on an event loop from the pool. The operator may be
+        # sharing the event loop with operators for other clusters.
+
+        self._event_loop = operator_event_loops.acquire(self)
+
+        self._future = self._event_loop.submit(self.run_operator())
 
     def cancel(self) -> None:
         """Flags the kopf operator to stop."""
 
-        # Set the stop flag to stop the operator. This will cause the event loop
-        # to stop running and the operator thread to exit.
+        # Set the stop flag to stop the operator. The event used by kopf must
+        # be set from the event loop the operator is running on.
 
         self._stop_flag.set()
 
-    def run_until_stopped(self, stopped: kopf.DaemonStopped) -> None:
-        """Run the operator until stopped."""
+        if self._event_loop:
+            self._event_loop.event_loop.call_soon_threadsafe(self._stop_event.set)
+
+    def join(self) -> None:
+        """Waits for the kopf operator to exit and releases its event loop."""
+
+        if not self._future:
+            return
+
+        try:
+            self._future.result()
+
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception(
+                "Managed cluster operator for %s exited with error.", self.cluster_name
+            )
+
+        finally:
+            operator_event_loops.release(self._event_loop, self)
+
+    async def run_until_stopped(self, stopped: kopf.DaemonStopped) -> None:
+        """Run the operator until stopped. This is called from an async kopf
+        daemon, so waiting on the operator doesn't need a dedicated thread for
+        each cluster. Blocking calls are made from the default thread pool of
+        the event loop the daemon runs on."""
 
         self.start()
 
-        while not stopped:
-            # We should be called from a traditional thread so it is safe to use
-            # blocking sleep call.
+        last_periodic_run = time.monotonic()
 
-            time.sleep(1.0)
+        try:
+            while not stopped:
+                await stopped.wait(1.0)
+
+                if (
+                    self.periodic_tasks_interval
+                    and time.monotonic() - last_periodic_run
+                    >= self.periodic_tasks_interval
+                ):
+                    last_periodic_run = time.monotonic()
+
+                    try:
+                        await asyncio.to_thread(self.run_periodic_tasks)
+
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        logger.exception(
+                            "Periodic tasks failed for managed cluster operator %s.",
+                            self.cluster_name,
+                        )
 
-        self.cancel()
+        finally:
+            self.cancel()
 
-        self.join()
+            await asyncio.to_thread(self.join)
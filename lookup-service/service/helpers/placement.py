@@ -0,0 +1,214 @@
+"""Placement of workshop session requests across candidate environments."""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from ..caches.environments import WorkshopEnvironment
+from ..config import (
+    PLACEMENT_DEADLINE,
+    PLACEMENT_HEDGE_DELAY,
+    PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT,
+)
+
+logger = logging.getLogger("educates")
+
+
+# Strong references to background tasks releasing surplus workshop sessions so
+# they are not garbage collected before they complete.
+
+_release_tasks: Set[asyncio.Task] = set()
+
+
+@dataclass
+class PlacementResult:
+    """Outcome of placing a workshop session request. Where a session could not
+    be allocated, the environment and data will be None."""
+
+    environment: WorkshopEnvironment | None = None
+    data: Dict[str, Any] | None = None
+    attempts: int = 0
+    surplus: List[Tuple[WorkshopEnvironment, Dict[str, Any]]] = field(
+        default_factory=list
+    )
+
+
+async def release_workshop_session(
+    environment: WorkshopEnvironment, data: Dict[str, Any]
+) -> None:
+    """Release a surplus workshop session which was allocated by a speculative
+    request but not returned to the client."""
+
+    session_name = data.get("sessionName")
+
+    if not session_name:
+        return
+
+    logger.info(
+        "Releasing surplus workshop session %s from environment %s of portal %s of cluster %s.",  # pylint: disable=line-too-long
+        session_name,
+        environment.name,
+        environment.portal.name,
+        environment.portal.cluster.name,
+    )
+
+    await environment.terminate_workshop_session(session_name)
+
+
+async def release_surplus_sessions(
+    surplus: List[Tuple[WorkshopEnvironment, Dict[str, Any]]],
+    attempts: Dict[asyncio.Task, WorkshopEnvironment],
+) -> None:
+    """Release surplus workshop sessions, then wait for outstanding placement
+    attempts to complete and release any workshop sessions they allocate. The
+    attempts are not cancelled as the training portal may already have
+    allocated a session which we would then not know about. A failure for one
+    workshop session doesn't stop the others being released."""
+
+    for environment, data in surplus:
+        try:
+            await release_workshop_session(environment, data)
+
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception(
+                "Failed to release surplus workshop session from environment %s.",
+                environment.name,
+            )
+
+    for task, environment in attempts.items():
+        try:
+            data = await task
+
+            if data:
+                await release_workshop_session(environment, data)
+
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception(
+                "Failed to release surplus workshop session from environment %s.",
+                environment.name,
+            )
+
+
+async def place_workshop_session(
+    environments: List[WorkshopEnvironment],
+    request: Callable[[WorkshopEnvironment], Awaitable[Dict[str, Any] | None]],
+    *,
+    deadline: float = PLACEMENT_DEADLINE,
+    hedge_delay: float = PLACEMENT_HEDGE_DELAY,
+    max_in_flight: int = PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT,
+) -> PlacementResult:
+    """Try to allocate a workshop session from a list of candidate workshop
+    environments, which should be sorted with the best candidates first.
+    Candidates are tried in order, however if a candidate hasn't responded
+    within the hedge delay, the next candidate is tried in parallel, up to the
+    maximum number of attempts in flight. A maximum of one disables speculative
+    attempts, with each candidate only being tried after the previous one has
+    failed. The first successful allocation is returned, with any surplus
+    allocations made by speculative attempts being released. No new attempts
+    are made after the deadline has passed."""
+
+    event_loop = asyncio.get_running_loop()
+
+    expires = event_loop.time() + deadline
+
+    result = PlacementResult()
+
+    candidates = iter(enumerate(environments))
+
+    in_flight: Dict[asyncio.Task, Tuple[int, WorkshopEnvironment]] = {}
+
+    def start_next_attempt() -> bool:
+        """Start an attempt against the next candidate if there is one."""
+
+        index, environment = next(candidates, (None, None))
+
+        if environment is None:
+            return False
+
+        task = event_loop.create_task(request(environment))
+
+        in_flight[task] = (index, environment)
+
+        result.attempts += 1
+
+        return True
+
+    start_next_attempt()
+
+    while in_flight and result.data is None:
+        remaining = expires - event_loop.time()
+
+        if remaining <= 0:
+            break
+
+        done, _ = await asyncio.wait(
+            in_flight,
+            timeout=min(hedge_delay, remaining),
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+
+        # If nothing completed within the hedge delay, speculatively start an
+        # attempt against the next candidate, so long as we aren't already at
+        # the limit on the number of attempts in flight.
+
+        if not done:
+            if len(in_flight) < max_in_flight:
+                start_next_attempt()
+
+            continue
+
+        # Process completed attempts in the order the candidates were ranked,
+        # keeping the first success and recording any others as surplus.
+
+        failures = 0
+
+        for task in sorted(done, key=lambda task: in_flight[task][0]):
+            _, environment = in_flight.pop(task)
+
+            try:
+                data = task.result()
+
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception(
+                    "Failed to request workshop session from environment %s.",
+                    environment.name,
+                )
+
+                data = None
+
+            if not data:
+                failures += 1
+
+                continue
+
+            if result.data is None:
+                result.environment = environment
+                result.data = data
+
+            else:
+                result.surplus.append((environment, data))
+
+        # Replace each failed attempt with an attempt against the next candidate.
+
+        if result.data is None:
+            for _ in range(failures):
+                if len(in_flight) >= max_in_flight or not start_next_attempt():
+                    break
+
+    # Release any surplus allocations and any which are still in flight when
+    # they complete. This is done in the background so as not to delay the
+    # response to the client.
+
+    if result.surplus or in_flight:
+        task = event_loop.create_task(
+            release_surplus_sessions(
+                result.surplus,
+                {task: environment for task, (_, environment) in in_flight.items()},
+            )
+        )
+
+        _release_tasks.add(task)
+        task.add_done_callback(_release_tasks.discard)
+
+    return result
@@ -1,18 +1,46 @@
 """Selectors for matching Kubernetes resource objects."""
 
 import fnmatch
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Union
 
 from ..helpers.objects import xgetattr
 
 
+def compile_glob_patterns(patterns: List[str]) -> Union[re.Pattern, None]:
+    """Compiles a list of glob patterns into a single regular expression which
+    matches if any of the glob patterns match. Returns None if the list of
+    patterns is empty."""
+
+    if not patterns:
+        return None
+
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+def match_glob_patterns(compiled: Union[re.Pattern, None], value: str) -> bool:
+    """Checks whether a value matches glob patterns compiled using the function
+    compile_glob_patterns()."""
+
+    if compiled is None or value is None:
+        return False
+
+    return compiled.match(value) is not None
+
+
 @dataclass
 class NameSelector:
     """Selector for matching Kubernetes resource objects by name."""
 
     match_names: List[str]
+    compiled_names: Union[re.Pattern, None] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self.compiled_names = compile_glob_patterns(self.match_names)
 
     def match_resource(self, resource: Dict[str, Any]) -> bool:
         """Check if a resource matches the selector. Note that if the list of
@@ -24,11 +52,7 @@ class NameSelector:
 
         name = xgetattr(resource, "metadata.name")
 
-        for pattern in self.match_names:
-            if fnmatch.fnmatch(name, pattern):
-                return True
-
-        return False
+        return match_glob_patterns(self.compiled_names, name)
 
 
 class Operator(Enum):
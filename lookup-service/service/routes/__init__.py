@@ -2,12 +2,18 @@
 
 from aiohttp import web
 
-from . import authnz, clients, clusters, portals, tenants, workshops
+from . import authnz, clients, clusters, metrics, portals, tenants, workshops
 
 
 def register_routes(app: web.Application) -> None:
     """Register the HTTP API routes with the application."""
 
+    # Register the metrics middleware first so that it also measures the time
+    # spent in the other middleware.
+
+    app.middlewares.extend(metrics.middlewares)
+    app.add_routes(metrics.routes)
+
     # Register authentication and authorization middleware/routes.
 
     app.middlewares.extend(authnz.middlewares)
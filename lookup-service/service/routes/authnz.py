@@ -9,6 +9,7 @@ from aiohttp import web
 
 from ..config import jwt_token_secret
 from ..caches.clients import ClientConfig
+from ..caches.tokens import token_cache
 
 TOKEN_EXPIRATION = 72  # Expiration in hours.
 
@@ -70,10 +71,26 @@ async def jwt_token_middleware(
         if parts[0].lower() != "bearer":
             return web.Response(text="Invalid Authorization header", status=400)
 
+        token = parts[1]
+
+        # Check whether the token has already been verified. If it has and
+        # hasn't expired we can skip decoding and verifying the token, as well
+        # as the subsequent check of the client identity. Cached tokens are
+        # discarded when tokens for the client are revoked or the client is
+        # updated or removed.
+
+        verified_token = token_cache.get_token(token)
+
+        if verified_token:
+            request["jwt_token"] = verified_token.decoded_token
+            request["client_name"] = verified_token.decoded_token["sub"]
+            request["verified_client"] = verified_token.client
+
+            return await handler(request)
+
         # Decode the JWT token passed in the Authorization header.
 
         try:
-            token = parts[1]
             decoded_token = decode_client_token(token)
         except jwt.ExpiredSignatureError:
             return web.Response(text="JWT token has expired", status=401)
@@ -83,6 +100,7 @@ async def jwt_token_middleware(
         # Store the decoded token in the request object for later use.
 
         request["jwt_token"] = decoded_token
+        request["jwt_token_string"] = token
         request["client_name"] = decoded_token["sub"]
 
     # Continue processing the request.
@@ -99,15 +117,27 @@ def login_required(handler: Callable[..., web.Response]) -> web.Response:
         if "jwt_token" not in request:
             return web.Response(text="JWT token not supplied", status=400)
 
+        # If the token was found in the cache of verified tokens, the client
+        # has already been validated.
+
+        if "verified_client" in request:
+            request["remote_client"] = request["verified_client"]
+
+            return await handler(request)
+
         decoded_token = request["jwt_token"]
 
         # Check the client database for the client by the name of the client
         # taken from the JWT token subject. Then check if the identity of the
-        # client is still the same as the one recorded in the JWT token.
+        # client is still the same as the one recorded in the JWT token. The
+        # generation of the client in the token cache is obtained first, so
+        # the token isn't cached if the client is updated in the meantime.
 
         service_state = request.app["service_state"]
         client_database = service_state.client_database
 
+        generation = token_cache.client_generation(decoded_token["sub"])
+
         client = client_database.get_client(decoded_token["sub"])
 
         if not client:
@@ -118,6 +148,12 @@ def login_required(handler: Callable[..., web.Response]) -> web.Response:
 
         request["remote_client"] = client
 
+        # Remember that the token has been verified for this client.
+
+        token_cache.add_token(
+            request["jwt_token_string"], client, decoded_token, generation
+        )
+
         # Continue processing the request.
 
         return await handler(request)
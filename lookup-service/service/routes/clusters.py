@@ -133,6 +133,8 @@ async def api_get_v1_clusters_portals_details(request: web.Request) -> web.Respo
         "capacity": portal.capacity,
         "allocated": portal.allocated,
         "phase": portal.phase,
+        "statistics": portal.client_statistics(),
+        "health": portal.health.as_dict(),
     }
 
     return web.json_response(details)
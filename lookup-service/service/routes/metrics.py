@@ -0,0 +1,217 @@
+"""HTTP API handlers and middleware for exposing service metrics."""
+
+import time
+from typing import Callable, Dict
+
+from aiohttp import web
+
+from ..caches.tokens import token_cache
+from ..helpers.metrics import (
+    Gauge,
+    LabelValues,
+    http_request_duration_seconds,
+    http_requests_total,
+    registry,
+)
+from ..helpers.operator import operator_event_loops
+from ..service import ServiceState
+
+
+@web.middleware
+async def metrics_middleware(
+    request: web.Request, handler: Callable[..., web.Response]
+) -> web.Response:
+    """Record the number of requests and the time taken to handle them. The
+    route pattern rather than the request path is used as the label so that
+    the number of distinct label values remains bounded."""
+
+    started = time.perf_counter()
+
+    resource = request.match_info.route.resource
+
+    route = resource.canonical if resource else "unmatched"
+
+    status = 500
+
+    try:
+        response = await handler(request)
+        status = response.status
+
+        return response
+
+    except web.HTTPException as exc:
+        status = exc.status
+
+        raise
+
+    finally:
+        http_requests_total.inc(request.method, route, str(status))
+        http_request_duration_seconds.observe(
+            time.perf_counter() - started, request.method, route
+        )
+
+
+def cache_metrics(service_state: ServiceState) -> list:
+    """Return gauges describing the current state of the caches. These are
+    calculated only when metrics are collected."""
+
+    cluster_database = service_state.cluster_database
+
+    def portals() -> list:
+        return [
+            portal
+            for cluster in cluster_database.get_clusters()
+            for portal in cluster.get_portals()
+        ]
+
+    def count_entries() -> Dict[LabelValues, float]:
+        clusters = cluster_database.get_clusters()
+        all_portals = portals()
+        environments = [
+            environment
+            for portal in all_portals
+            for environment in portal.get_environments()
+        ]
+
+        return {
+            ("clients",): len(service_state.client_database.get_clients()),
+            ("tenants",): len(service_state.tenant_database.get_tenants()),
+            ("clusters",): len(clusters),
+            ("portals",): len(all_portals),
+            ("environments",): len(environments),
+            ("sessions",): sum(
+                len(environment.sessions) for environment in environments
+            ),
+            ("tokens",): len(token_cache.tokens),
+        }
+
+    def portal_values(name: str) -> Callable[[], Dict[LabelValues, float]]:
+        def collect() -> Dict[LabelValues, float]:
+            values = {}
+
+            for portal in portals():
+                details = portal.client_statistics()
+                details.update(portal.health.as_dict())
+                details["allocated"] = portal.allocated
+                details["capacity"] = portal.capacity
+                details["circuitOpen"] = int(details["circuit"] == "open")
+
+                values[(portal.cluster.name, portal.name)] = details[name]
+
+            return values
+
+        return collect
+
+    labels = ("cluster", "portal")
+
+    return [
+        Gauge(
+            "lookup_cache_entries",
+            "Number of entries held in the caches by type.",
+            ("type",),
+            count_entries,
+        ),
+        Gauge(
+            "lookup_token_cache_hits_total",
+            "Number of requests using a cached verified access token.",
+            (),
+            lambda: {(): token_cache.hits},
+            "counter",
+        ),
+        Gauge(
+            "lookup_token_cache_misses_total",
+            "Number of requests where the access token had to be verified.",
+            (),
+            lambda: {(): token_cache.misses},
+            "counter",
+        ),
+        Gauge(
+            "lookup_operator_event_loop_clusters",
+            "Number of managed cluster operators running on each event loop.",
+            ("loop",),
+            lambda: {
+                (event_loop.name,): len(event_loop.operators)
+                for event_loop in operator_event_loops.get_event_loops()
+            },
+        ),
+        Gauge(
+            "lookup_portal_allocated_sessions",
+            "Number of allocated workshop sessions for each portal.",
+            labels,
+            portal_values("allocated"),
+        ),
+        Gauge(
+            "lookup_portal_capacity_sessions",
+            "Maximum number of workshop sessions for each portal.",
+            labels,
+            portal_values("capacity"),
+        ),
+        Gauge(
+            "lookup_portal_connections_reused_total",
+            "Number of portal requests which reused a pooled HTTP connection.",
+            labels,
+            portal_values("connectionsReused"),
+            "counter",
+        ),
+        Gauge(
+            "lookup_portal_connections_created_total",
+            "Number of HTTP connections opened to each portal.",
+            labels,
+            portal_values("connectionsCreated"),
+            "counter",
+        ),
+        Gauge(
+            "lookup_portal_token_hits_total",
+            "Number of portal requests which reused a cached access token.",
+            labels,
+            portal_values("tokenHits"),
+            "counter",
+        ),
+        Gauge(
+            "lookup_portal_token_misses_total",
+            "Number of portal requests which required a login to the portal.",
+            labels,
+            portal_values("tokenMisses"),
+            "counter",
+        ),
+        Gauge(
+            "lookup_portal_error_rate",
+            "Fraction of recent requests against each portal which failed.",
+            labels,
+            portal_values("errorRate"),
+        ),
+        Gauge(
+            "lookup_portal_latency_seconds",
+            "Mean latency of recent requests against each portal.",
+            labels,
+            portal_values("latency"),
+        ),
+        Gauge(
+            "lookup_portal_circuit_open",
+            "Whether the circuit breaker for each portal is open.",
+            labels,
+            portal_values("circuitOpen"),
+        ),
+    ]
+
+
+async def api_get_metrics(request: web.Request) -> web.Response:
+    """Returns service metrics in the Prometheus text exposition format."""
+
+    service_state = request.app["service_state"]
+
+    lines = []
+
+    for gauge in cache_metrics(service_state):
+        lines.extend(gauge.render())
+
+    text = registry.render() + "\n".join(lines) + "\n"
+
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+# Set up the middleware and routes for exposing metrics.
+
+middlewares = [metrics_middleware]
+
+routes = [web.get("/metrics", api_get_metrics)]
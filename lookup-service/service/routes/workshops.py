@@ -6,6 +6,9 @@ from typing import List
 from aiohttp import web
 
 from ..caches.environments import WorkshopEnvironment
+from ..config import PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT
+from ..helpers.metrics import placement_attempts, workshop_requests_total
+from ..helpers.placement import place_workshop_session
 from .authnz import login_required, roles_accepted
 
 logger = logging.getLogger("educates")
@@ -147,18 +150,16 @@ async def api_post_v1_workshops(request: web.Request) -> web.Response:
     cluster_database = service_state.cluster_database
 
     if user_id:
-        for cluster in cluster_database.get_clusters():
-            for portal in cluster.get_portals():
-                session = portal.find_existing_workshop_session_for_user(
-                    user_id, workshop_name
-                )
+        for session in cluster_database.find_existing_workshop_sessions_for_user(
+            user_id, workshop_name
+        ):
+            data = await session.reacquire_workshop_session(index_url)
 
-                if session:
-                    data = await session.reacquire_workshop_session(index_url)
+            if data:
+                workshop_requests_total.inc("reacquired")
 
-                    if data:
-                        data["tenantName"] = tenant_name
-                        return web.json_response(data)
+                data["tenantName"] = tenant_name
+                return web.json_response(data)
 
     # Get the list of portals hosting the workshop and calculate the subset that
     # are accessible to the tenant.
@@ -200,9 +201,7 @@ async def api_post_v1_workshops(request: web.Request) -> web.Response:
     environments = []
 
     for portal in selected_portals:
-        for environment in portal.get_running_environments():
-            if environment.workshop == workshop_name:
-                environments.append(environment)
+        environments.extend(portal.get_running_environments(workshop_name))
 
     if not environments:
         logger.warning(
@@ -213,15 +212,39 @@ async def api_post_v1_workshops(request: web.Request) -> web.Response:
 
         return web.Response(text="Workshop not available", status=503)
 
+    # Exclude workshop environments hosted by portals which have been failing
+    # requests and for which the circuit breaker has tripped.
+
+    environments = [
+        environment
+        for environment in environments
+        if environment.portal.health.is_available()
+    ]
+
+    if not environments:
+        logger.warning(
+            "Workshop %r requested by client %r not available as portals failing",
+            workshop_name,
+            client.name,
+        )
+
+        return web.Response(text="Workshop not available", status=503)
+
     # Sort the workshop environments so that those deemed to be the best
     # candidates for running a workshop session are at the front of the list.
 
     environments = sort_workshop_environments(environments)
 
-    # Loop over the workshop environments and try to allocate a session.
+    # Try to allocate a session from the workshop environments. The best
+    # candidate is tried first, with the next best candidates being tried in
+    # parallel if a candidate is slow to respond. Speculative attempts are only
+    # made for anonymous requests. Where a user ID is supplied, any surplus
+    # workshop session would count against limits on the number of workshop
+    # sessions for that user until released, so candidates are tried one at a
+    # time instead.
 
-    for environment in environments:
-        data = await environment.request_workshop_session(
+    async def request_workshop_session(environment: WorkshopEnvironment) -> dict:
+        return await environment.request_workshop_session(
             user_id,
             user_email,
             user_first_name,
@@ -231,13 +254,26 @@ async def api_post_v1_workshops(request: web.Request) -> web.Response:
             analytics_url,
         )
 
-        if data:
-            data["tenantName"] = tenant_name
-            return web.json_response(data)
+    placement = await place_workshop_session(
+        environments,
+        request_workshop_session,
+        max_in_flight=1 if user_id else PLACEMENT_MAX_ATTEMPTS_IN_FLIGHT,
+    )
+
+    placement_attempts.observe(placement.attempts)
+
+    if placement.data:
+        workshop_requests_total.inc("allocated")
+
+        data = placement.data
+        data["tenantName"] = tenant_name
+        return web.json_response(data)
 
     # If we get here, then we don't believe there is any available capacity for
     # creating a workshop session.
 
+    workshop_requests_total.inc("unavailable")
+
     logger.warning(
         "Workshop %r requested by client %r not available", workshop_name, client.name
     )
@@ -297,6 +333,28 @@ def sort_workshop_environments(
 
         return 1
 
+    def score_based_on_portal_health(environment: WorkshopEnvironment) -> int:
+        """Return a score based on the rate of recent requests against the
+        portal hosting the workshop environment which failed. The error rate
+        is bucketed so small differences don't override capacity."""
+
+        error_rate = environment.portal.health.error_rate
+
+        if error_rate < 0.1:
+            return 2
+
+        if error_rate < 0.5:
+            return 1
+
+        return 0
+
+    def score_based_on_portal_latency(environment: WorkshopEnvironment) -> float:
+        """Return a score based on the latency of recent requests against the
+        portal hosting the workshop environment. Lower latency gives a higher
+        score. This is only used to break ties."""
+
+        return -environment.portal.health.latency
+
     def score_based_on_reserved_sessions(environment: WorkshopEnvironment) -> int:
         """Return a score based on the number of reserved sessions currently
         available for the workshop environment. Where as we didn't before, we
@@ -349,8 +407,10 @@ def sort_workshop_environments(
         key=lambda environment: (
             score_based_on_portal_availability(environment),
             score_based_on_environment_availability(environment),
+            score_based_on_portal_health(environment),
             score_based_on_reserved_sessions(environment),
             score_based_on_available_capacity(environment),
+            score_based_on_portal_latency(environment),
         ),
         reverse=True,
     )
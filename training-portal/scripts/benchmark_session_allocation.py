@@ -0,0 +1,229 @@
+"""Measures throughput of allocating reserved workshop sessions to users
+against a scratch SQLite database. Run from anywhere with:
+
+    python training-portal/scripts/benchmark_session_allocation.py [sessions] [threads]
+
+Each database configuration is measured in a separate process. The "baseline"
+configuration is the stock Django SQLite backend, as used before the custom
+backend was introduced. The other configurations use the custom backend of
+the training portal with each of its SQLite profiles.
+
+Each allocation is made in its own transaction under the lock for the
+workshop environment, as is done when a user requests a workshop session,
+while other threads concurrently read the catalog of workshop environments.
+Allocations which fail because the database is locked are retried and
+reported separately.
+
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+)
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+CONFIGURATION = sys.argv[3] if len(sys.argv) > 3 else None
+
+CONFIGURATIONS = {
+    "baseline": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "OPTIONS": {"timeout": 15},
+    },
+    "default": {
+        "ENGINE": "project.backends.sqlite3",
+        "OPTIONS": {"timeout": 15, "profile": "default"},
+    },
+    "performance": {
+        "ENGINE": "project.backends.sqlite3",
+        "OPTIONS": {"timeout": 15, "profile": "performance"},
+    },
+}
+
+import django  # pylint: disable=wrong-import-position
+
+from django.conf import settings  # pylint: disable=wrong-import-position
+
+# Use a scratch database rather than that of the training portal.
+
+if CONFIGURATION:
+    settings.DATABASES["default"].update(CONFIGURATIONS[CONFIGURATION])
+
+settings.DATABASES["default"]["NAME"] = os.path.join(tempfile.mkdtemp(), "db.sqlite3")
+
+django.setup()
+
+# pylint: disable=wrong-import-position
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+
+from project.apps.workshops.manager.locking import environment_lock
+from project.apps.workshops.models import (
+    Environment,
+    Session,
+    SessionState,
+    TrainingPortal,
+    Workshop,
+)
+
+User = get_user_model()  # pylint: disable=invalid-name
+
+
+def setup_database():
+    """Creates a scratch database with reserved workshop sessions."""
+
+    call_command("migrate", verbosity=0)
+
+    portal = TrainingPortal.objects.create(name="benchmark", generation=1)
+    workshop = Workshop.objects.create(name="benchmark", generation=1)
+
+    environments = []
+
+    for index in range(THREADS):
+        environment = Environment.objects.create(
+            portal=portal,
+            workshop=workshop,
+            workshop_name=workshop.name,
+            name=f"benchmark-w{index:02}",
+            capacity=SESSIONS,
+        )
+
+        for count in range(SESSIONS // THREADS):
+            Session.objects.create(
+                name=f"{environment.name}-s{count:03}",
+                environment=environment,
+                state=SessionState.WAITING,
+            )
+
+        environments.append(environment)
+
+    return environments
+
+
+def allocate_sessions(environment, results, failures):
+    """Allocates all the reserved sessions of the workshop environment."""
+
+    allocated = 0
+    failed = 0
+
+    try:
+        while True:
+            try:
+                with environment_lock(environment), transaction.atomic():
+                    session = environment.available_sessions().first()
+
+                    if not session:
+                        break
+
+                    user = User.objects.create(username=f"user-{session.name}")
+
+                    session.mark_as_running(user)
+
+            except OperationalError:
+                failed += 1
+
+                continue
+
+            allocated += 1
+
+    finally:
+        results.append(allocated)
+        failures.append(failed)
+        connection.close()
+
+
+def read_catalog(environments, stop):
+    """Repeatedly reads the details of the workshop environments."""
+
+    try:
+        while not stop.is_set():
+            try:
+                for environment in Environment.objects.filter(
+                    pk__in=[environment.pk for environment in environments]
+                ).select_related("workshop"):
+                    environment.sessions_allocated  # pylint: disable=pointless-statement
+
+            except OperationalError:
+                pass
+
+            time.sleep(0.01)
+
+    finally:
+        connection.close()
+
+
+def run_benchmark():
+    """Runs the benchmark returning the number of allocations, the number of
+    allocations which had to be retried and the elapsed time."""
+
+    environments = setup_database()
+
+    connection.close()
+
+    results = []
+    failures = []
+    stop = threading.Event()
+
+    readers = [
+        threading.Thread(target=read_catalog, args=(environments, stop))
+        for _ in range(THREADS // 2 or 1)
+    ]
+
+    writers = [
+        threading.Thread(
+            target=allocate_sessions, args=(environment, results, failures)
+        )
+        for environment in environments
+    ]
+
+    for thread in readers:
+        thread.start()
+
+    start = time.monotonic()
+
+    for thread in writers:
+        thread.start()
+
+    for thread in writers:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+
+    stop.set()
+
+    for thread in readers:
+        thread.join()
+
+    return sum(results), sum(failures), elapsed
+
+
+def main():
+    if CONFIGURATION:
+        allocated, failed, elapsed = run_benchmark()
+
+        print(
+            f"{CONFIGURATION:12} {allocated} sessions in {elapsed:.2f}s,"
+            f" {allocated / elapsed:.1f} allocations/s, {failed} retries"
+        )
+
+        return
+
+    for configuration in CONFIGURATIONS:
+        subprocess.run(
+            [sys.executable, __file__, str(SESSIONS), str(THREADS), configuration],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
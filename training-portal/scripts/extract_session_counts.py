@@ -1,15 +1,16 @@
-import csv
+# Run from a Django shell for the training portal. For other formats or to
+# restrict the export to a date range use instead:
+#
+#   python manage.py export_sessions counts --output session-counts.csv
 
-from workshops.models import (TrainingPortal, Workshop,
-        SessionState, Session, Environment)
+import csv
 
-environments = Environment.objects.all()
+from project.apps.workshops.management.commands.export_sessions import (
+    session_counts,
+)
 
-with open('session-counts.csv', 'w', newline='') as csvfile:
+with open("session-counts.csv", "w", newline="") as csvfile:
     writer = csv.writer(csvfile)
-    writer.writerow(['Workshop', 'Sessions'])
-    for environment in environments:
-        count = Session.objects.filter(
-                environment__name=environment.name,
-                state=SessionState.STOPPED).count()
-        writer.writerow([environment.workshop.name, count])
+    writer.writerow(["Workshop", "Sessions"])
+    for workshop, _, count in session_counts():
+        writer.writerow([workshop, count])
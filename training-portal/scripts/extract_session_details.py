@@ -1,18 +1,26 @@
+# Run from a Django shell for the training portal. For other formats or to
+# restrict the export to a date range use instead:
+#
+#   python manage.py export_sessions details --output session-details.csv
+
 import csv
 
-from workshops.models import (TrainingPortal, Workshop,
-        SessionState, Session, Environment)
+from project.apps.workshops.management.commands.export_sessions import (
+    session_details,
+)
 
-sessions = Session.objects.filter(state=SessionState.STOPPED)
+format = "%d/%m/%Y %H:%M:%S"
 
-with open('session-details.csv', 'w', newline='') as csvfile:
+with open("session-details.csv", "w", newline="") as csvfile:
     writer = csv.writer(csvfile)
-    writer.writerow(['Workshop', 'Session', 'Created', 'Started', 'Ended'])
-    for session in sessions:
-        created = session.created
-        finished = session.expires
-        started = session.started or finished
-        format = "%d/%m/%Y %H:%M:%S"
-        writer.writerow([session.environment.workshop.name,
-            session.name, created.strftime(format),
-            started.strftime(format), finished.strftime(format)])
+    writer.writerow(["Workshop", "Session", "Created", "Started", "Ended"])
+    for workshop, _, name, created, started, ended in session_details():
+        writer.writerow(
+            [
+                workshop,
+                name,
+                created.strftime(format),
+                started.strftime(format),
+                ended.strftime(format),
+            ]
+        )
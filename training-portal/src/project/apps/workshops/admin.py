@@ -51,6 +51,12 @@ class TrainingPortalAdmin(admin.ModelAdmin):
         "update_workshop",
     ]
 
+    readonly_fields = [
+        "sessions_active",
+        "sessions_allocated",
+        "sessions_available",
+    ]
+
     def has_add_permission(self, request):
         return False
 
@@ -113,6 +119,13 @@ class EnvironmentAdmin(admin.ModelAdmin):
         "tally",
     ]
 
+    readonly_fields = [
+        "sessions_total",
+        "sessions_active",
+        "sessions_allocated",
+        "sessions_available",
+    ]
+
     def has_add_permission(self, request):
         return False
 
@@ -0,0 +1,74 @@
+"""Defines a cache of catalog responses for the REST API, which is shared
+between the views generating the responses and the models which invalidate
+them when workshop sessions are changed.
+
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+
+class CatalogCache:
+    """Short lived cache of catalog responses for the REST API. Cached
+    responses are discarded whenever a training portal, workshop environment,
+    workshop or workshop session is changed, including by bulk updates which
+    bypass model signals. Caching is disabled when the time to live is zero.
+
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+
+    def invalidate(self):
+        """Discard all cached responses."""
+
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def fetch(self, key, generate):
+        """Returns the cached response for the key, or generates and caches
+        it if there is no current response. A response generated while the
+        cache is being invalidated is not cached.
+
+        """
+
+        if self.ttl <= 0:
+            return generate()
+
+        now = time.monotonic()
+
+        with self._lock:
+            generation = self._generation
+
+            entry = self._entries.get(key)
+
+            if entry and entry[0] > now:
+                return entry[1]
+
+        result = generate()
+
+        with self._lock:
+            if self._generation == generation:
+                self._entries[key] = (now + self.ttl, result)
+
+        return result
+
+
+catalog_cache = CatalogCache(settings.CATALOG_CACHE_TTL)
+
+
+def invalidate_catalog_cache(**_):
+    """Discards cached catalog responses once the current database
+    transaction has been committed.
+
+    """
+
+    transaction.on_commit(catalog_cache.invalidate)
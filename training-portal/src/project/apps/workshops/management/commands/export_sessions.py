@@ -0,0 +1,185 @@
+"""Management command for exporting the history of workshop sessions.
+
+Records are streamed from the database using a server side cursor where the
+database supports it and written out as they are read, so memory use doesn't
+grow with the number of workshop sessions being exported.
+
+"""
+
+import csv
+import datetime
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from ...models import Environment, Session, SessionState
+
+
+def parse_date(value):
+    """Parses a date, or date and time, given on the command line."""
+
+    try:
+        result = datetime.datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise CommandError(f"Invalid date {value}.") from exc
+
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result, datetime.timezone.utc)
+
+    return result
+
+
+def format_date(value):
+    return value and value.isoformat() or ""
+
+
+def session_details(since=None, until=None, chunk_size=2000):
+    """Yields the workshop, workshop environment, name and the times it was
+    created, started and ended for each stopped workshop session, in order
+    of creation. Where a workshop session was never started, the time it
+    ended is given as when it started. Only the fields needed are retrieved,
+    with the workshop name obtained using a join.
+
+    """
+
+    sessions = Session.objects.filter(state=SessionState.STOPPED)
+
+    if since:
+        sessions = sessions.filter(created__gte=since)
+
+    if until:
+        sessions = sessions.filter(created__lt=until)
+
+    records = (
+        sessions.order_by("created", "name")
+        .values_list(
+            "environment__workshop__name",
+            "environment__name",
+            "name",
+            "created",
+            "started",
+            "expires",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+    for workshop, environment, name, created, started, ended in records:
+        yield workshop, environment, name, created, started or ended, ended
+
+
+def session_counts(since=None, until=None, chunk_size=2000):
+    """Yields the workshop, name and count of stopped workshop sessions for
+    each workshop environment, including those with none, calculated by the
+    database in a single query.
+
+    """
+
+    stopped = Q(session__state=SessionState.STOPPED)
+
+    if since:
+        stopped &= Q(session__created__gte=since)
+
+    if until:
+        stopped &= Q(session__created__lt=until)
+
+    records = (
+        Environment.objects.annotate(sessions=Count("session", filter=stopped))
+        .order_by("name")
+        .values_list("workshop__name", "name", "sessions")
+        .iterator(chunk_size=chunk_size)
+    )
+
+    yield from records
+
+
+class Command(BaseCommand):
+    help = "Exports details or counts of stopped workshop sessions."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "report",
+            choices=["details", "counts"],
+            help="Export a record per workshop session, or counts per workshop environment.",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            default="csv",
+            help="Output as CSV or as a JSON object per line.",
+        )
+        parser.add_argument(
+            "--since",
+            type=parse_date,
+            help="Only include workshop sessions created at or after this date.",
+        )
+        parser.add_argument(
+            "--until",
+            type=parse_date,
+            help="Only include workshop sessions created before this date.",
+        )
+        parser.add_argument(
+            "--output",
+            help="File to write the export to, defaults to standard output.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of records to fetch from the database at a time.",
+        )
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        until = options["until"]
+        chunk_size = options["chunk_size"]
+
+        if options["report"] == "details":
+            fields = [
+                "workshop",
+                "environment",
+                "session",
+                "created",
+                "started",
+                "ended",
+            ]
+            rows = (
+                (workshop, environment, name, *map(format_date, dates))
+                for workshop, environment, name, *dates in session_details(
+                    since, until, chunk_size
+                )
+            )
+        else:
+            fields = ["workshop", "environment", "sessions"]
+            rows = session_counts(since, until, chunk_size)
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as fp:
+                count = self.write(fp, options["format"], fields, rows)
+        else:
+            count = self.write(sys.stdout, options["format"], fields, rows)
+
+        self.stderr.write(f"Exported {count} records.")
+
+    def write(self, fp, output_format, fields, rows):
+        """Writes out the rows as they are produced, returning the count."""
+
+        count = 0
+
+        if output_format == "csv":
+            writer = csv.writer(fp)
+            writer.writerow(fields)
+
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+
+        else:
+            for row in rows:
+                fp.write(json.dumps(dict(zip(fields, row))))
+                fp.write("\n")
+                count += 1
+
+        return count
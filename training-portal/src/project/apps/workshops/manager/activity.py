@@ -0,0 +1,151 @@
+"""Defines functions for querying workshop sessions for how long they have
+been idle. Workshop sessions are queried concurrently, with a bound on the
+number of requests in flight and a timeout on each request, so a workshop
+session which doesn't respond can't hold up the checks for the others.
+
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from datetime import timedelta
+
+import aiohttp
+
+from django.conf import settings
+
+logger = logging.getLogger("educates")
+
+
+class SessionActivity:
+    """Details of the activity of a workshop session as reported by the
+    workshop session itself.
+
+    """
+
+    def __init__(self, idle_time, last_view):
+        self.idle_time = idle_time
+        self.last_view = last_view
+
+
+# Cache of recent results of querying workshop sessions. The key is the name
+# of the workshop session and the value a tuple of the time the result was
+# obtained and the result. A result of None means the workshop session could
+# not be queried.
+
+_activity_cache = {}
+_activity_cache_lock = threading.Lock()
+
+
+def activity_url(session):
+    """Returns the URL for querying the activity of the workshop session. Use
+    the internal Kubernetes service for accessing the workshop instance as
+    will fail if use public ingress and using a self signed CA as not
+    currently injected such a CA into the training portal pod.
+
+    """
+
+    return f"http://{session.name}.{session.environment.name}/session/activity"
+
+
+async def fetch_session_activity(client, semaphore, session):
+    """Queries the activity of a single workshop session. Returns None if
+    the workshop session could not be queried.
+
+    """
+
+    async with semaphore:
+        try:
+            async with client.get(activity_url(session)) as response:
+                if response.status != 200:
+                    # XXX If we don't get a valid response then not currently
+                    # doing anything. Need a better method to determine if was
+                    # running but has since failed in some way and become
+                    # uncontactable. In that case right now will only be
+                    # deleted when workshop timeout expires if there is one.
+
+                    return None
+
+                details = await response.json(content_type=None)
+
+                return SessionActivity(
+                    timedelta(seconds=details["idle-time"]),
+                    timedelta(seconds=details["last-view"]),
+                )
+
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            # XXX This can just be because it is slow to start up. Need a
+            # better method to determine if was running but has since failed
+            # in some way and become uncontactable.
+
+            logger.warning("Cannot connect to workshop session %s.", session.name)
+
+        except Exception:  # pylint: disable=broad-except
+            # Not aware of circumstances where would get an unexpected
+            # exception, but need to log and ignore it as we don't want to
+            # stop checking the other sessions.
+
+            logger.exception(
+                "Failed to query idle time for workshop session %s.", session.name
+            )
+
+    return None
+
+
+async def fetch_sessions_activity(sessions):
+    """Queries the activity of the workshop sessions concurrently."""
+
+    semaphore = asyncio.Semaphore(max(1, settings.ACTIVITY_PROBE_CONCURRENCY))
+
+    timeout = aiohttp.ClientTimeout(total=settings.ACTIVITY_PROBE_TIMEOUT)
+
+    connector = aiohttp.TCPConnector(limit=max(1, settings.ACTIVITY_PROBE_CONCURRENCY))
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as client:
+        return await asyncio.gather(
+            *(
+                fetch_session_activity(client, semaphore, session)
+                for session in sessions
+            )
+        )
+
+
+def query_sessions_activity(sessions):
+    """Returns a dictionary mapping the names of the workshop sessions to
+    their activity, or None where the workshop session could not be queried.
+    Recent results are reused rather than querying the workshop session again.
+    This must be called from a thread which isn't running an event loop, such
+    as that of a background task.
+
+    """
+
+    now = time.monotonic()
+
+    results = {}
+
+    pending = []
+
+    with _activity_cache_lock:
+        for name in list(_activity_cache):
+            if now - _activity_cache[name][0] >= settings.ACTIVITY_PROBE_CACHE_TTL:
+                del _activity_cache[name]
+
+        for session in sessions:
+            if session.name in _activity_cache:
+                results[session.name] = _activity_cache[session.name][1]
+            else:
+                pending.append(session)
+
+    if pending:
+        activity = asyncio.run(fetch_sessions_activity(pending))
+
+        now = time.monotonic()
+
+        with _activity_cache_lock:
+            for session, result in zip(pending, activity):
+                results[session.name] = result
+                _activity_cache[session.name] = (now, result)
+
+    return results
@@ -1,27 +1,231 @@
+import collections
 import logging
+import threading
+import time
 
+import mod_wsgi
 import requests
 from django.conf import settings
 from django.utils import timezone
 
-from .operator import background_task
-
 logger = logging.getLogger("educates")
 
 
-@background_task
-def send_event_to_webhook(url, message):
-    try:
-        response = requests.post(url, json=message, timeout=2.5)
-        if response.status_code >= 400:
+class AnalyticsDelivery:
+    """Buffered delivery of analytics events to webhooks. Events for each
+    webhook are added to a separate bounded queue, with the oldest events
+    being discarded if the queue is full, and are delivered by a dedicated
+    thread for that webhook rather than by background tasks, so a webhook
+    which is slow or failing doesn't hold up delivery to others. Events are
+    collected for up to the batch interval before being sent, using a
+    persistent HTTP session. By default each event is posted separately as
+    the webhook expects, but if the batch size is greater than one, events
+    are instead posted together as a list. Failed deliveries are retried
+    with increasing backoff. A thread exits once its webhook has been idle
+    for the idle timeout.
+
+    """
+
+    def __init__(
+        self, queue_size, batch_size, batch_interval, retries, timeout, idle_timeout
+    ):  # pylint: disable=too-many-arguments
+        self.queue_size = queue_size
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+        self.retries = retries
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self._queues = {}
+        self._threads = {}
+        self._condition = threading.Condition()
+        self._subscribed = False
+        self._stopping = False
+
+        self.queued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.requests = 0
+        self.retried = 0
+
+    def enqueue(self, url, message):
+        """Add the event to the queue for delivery to the webhook."""
+
+        with self._condition:
+            if self._stopping:
+                return
+
+            queue = self._queues.get(url)
+
+            if queue is None:
+                queue = collections.deque(maxlen=self.queue_size)
+                self._queues[url] = queue
+
+            if len(queue) == queue.maxlen:
+                self.dropped += 1
+
+            queue.append(message)
+
+            self.queued += 1
+
+            if url not in self._threads:
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(url, queue),
+                    name="analytics-delivery",
+                    daemon=True,
+                )
+                self._threads[url] = thread
+                thread.start()
+
+            if not self._subscribed:
+                self._subscribed = True
+
+                mod_wsgi.subscribe_shutdown(  # pylint: disable=no-member
+                    lambda *_, **__: self.stop()
+                )
+
+            self._condition.notify_all()
+
+    def stop(self, timeout=5.0):
+        """Stop accepting events and wait for those queued to be sent."""
+
+        with self._condition:
+            self._stopping = True
+            threads = list(self._threads.values())
+            self._condition.notify_all()
+
+        deadline = time.monotonic() + timeout
+
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _worker(self, url, queue):
+        """Delivers batches of events from the queue for the webhook until
+        stopped, or until there have been no events for the idle timeout.
+
+        """
+
+        session = requests.Session()
+
+        while True:
+            with self._condition:
+                idle = time.monotonic() + self.idle_timeout
+
+                while not queue and not self._stopping:
+                    remaining = idle - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._condition.wait(remaining)
+
+                if not queue:
+                    del self._threads[url]
+                    del self._queues[url]
+                    break
+
+                # Wait for further events to make up a batch unless stopping.
+
+                deadline = time.monotonic() + self.batch_interval
+
+                while len(queue) < self.batch_size and not self._stopping:
+                    remaining = deadline - time.monotonic()
+
+                    if remaining <= 0:
+                        break
+
+                    self._condition.wait(remaining)
+
+                batch = [
+                    queue.popleft() for _ in range(min(self.batch_size, len(queue)))
+                ]
+
+            if self.batch_size == 1:
+                for message in batch:
+                    self._deliver(session, url, message, 1)
+            else:
+                self._deliver(session, url, batch, len(batch))
+
+        session.close()
+
+    def _deliver(self, session, url, payload, count):
+        """Post the payload to the webhook, retrying on failure. The backoff
+        between attempts is cut short if delivery is being stopped.
+
+        """
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._condition:
+                    self.retried += 1
+
+                    if self._stopping:
+                        break
+
+                    self._condition.wait(min(30.0, 0.5 * 2 ** (attempt - 1)))
+
+            with self._condition:
+                self.requests += 1
+
+            try:
+                response = session.post(url, json=payload, timeout=self.timeout)
+
+            except requests.exceptions.RequestException:
+                logger.warning("Unable to report %d events to %s.", count, url)
+                continue
+
+            if response.status_code < 400:
+                with self._condition:
+                    self.delivered += count
+
+                return
+
             logger.error(
-                "Failed to report event to %s: %s (status code %s)",
+                "Failed to report %d events to %s (status code %s).",
+                count,
                 url,
-                message,
                 response.status_code,
             )
-    except Exception:
-        logger.exception("Unable to report event to %s: %s", url, message)
+
+            # Client errors other than rate limiting will not succeed if
+            # retried.
+
+            if response.status_code < 500 and response.status_code != 429:
+                break
+
+        logger.error("Discarding %d events for %s: %s", count, url, payload)
+
+        with self._condition:
+            self.failed += count
+
+    def statistics(self):
+        """Returns the queue depth across all webhooks and counts of events
+        processed.
+
+        """
+
+        with self._condition:
+            return {
+                "depth": sum(len(queue) for queue in self._queues.values()),
+                "queued": self.queued,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "requests": self.requests,
+                "retried": self.retried,
+            }
+
+
+analytics_delivery = AnalyticsDelivery(
+    queue_size=settings.ANALYTICS_QUEUE_SIZE,
+    batch_size=settings.ANALYTICS_BATCH_SIZE,
+    batch_interval=settings.ANALYTICS_BATCH_INTERVAL,
+    retries=settings.ANALYTICS_WEBHOOK_RETRIES,
+    timeout=settings.ANALYTICS_WEBHOOK_TIMEOUT,
+    idle_timeout=settings.ANALYTICS_IDLE_TIMEOUT,
+)
 
 
 def report_analytics_event(entity, event, data={}):
@@ -95,7 +299,7 @@ def report_analytics_event(entity, event, data={}):
 
     if message:
         if settings.ANALYTICS_WEBHOOK_URL:
-            send_event_to_webhook(settings.ANALYTICS_WEBHOOK_URL, message).schedule()
+            analytics_delivery.enqueue(settings.ANALYTICS_WEBHOOK_URL, message)
 
         if analytics_url:
-            send_event_to_webhook(analytics_url, message).schedule()
+            analytics_delivery.enqueue(analytics_url, message)
@@ -5,46 +5,144 @@ later deleting historical records of sessions and inactive anonymous users.
 
 import traceback
 import logging
+import threading
+import time
 
 from datetime import timedelta
 
 import pykube
-import requests
 
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Exists, OuterRef, ProtectedError
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 
-from ..models import SessionState, Session
+from ..models import SessionState, Session, TrainingPortal
 
 from .sessions import replace_reserved_session
-from .locking import resources_lock
-from .operator import background_task
+from .locking import environment_lock, session_lock
+from .operator import background_task, LOW_PRIORITY
+from .activity import query_sessions_activity
 from .analytics import report_analytics_event
+from .reconciliation import schedule_environment_reconciliation
 
 logger = logging.getLogger("educates")
 
 api = pykube.HTTPClient(pykube.KubeConfig.from_env())
 
 
-@background_task
-@resources_lock
-@transaction.atomic
-def purge_expired_workshop_sessions():
-    """Look for workshop sessions which have expired and delete them."""
+class CleanupProgress:
+    """Counts of records deleted by the cleanup of old workshop sessions and
+    anonymous users, updated as each chunk is deleted so progress of a long
+    running cleanup can be reported.
 
-    now = timezone.now()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.runs = 0
+        self.chunks = 0
+        self.sessions_deleted = 0
+        self.users_deleted = 0
+        self.duration_last = 0.0
+        self.duration_maximum = 0.0
+
+    def record_chunk(self, sessions=0, users=0):
+        """Record the deletion of a chunk of workshop sessions or users."""
+
+        with self._lock:
+            self.chunks += 1
+            self.sessions_deleted += sessions
+            self.users_deleted += users
+
+    def record_run(self, duration):
+        """Record the completion of a cleanup run and the time it took."""
+
+        with self._lock:
+            self.runs += 1
+            self.duration_last = duration
+            self.duration_maximum = max(self.duration_maximum, duration)
+
+    def statistics(self):
+        """Returns the counts of runs, chunks and records deleted, and how
+        long cleanup runs took, resetting the maximum duration.
+
+        """
+
+        with self._lock:
+            details = {
+                "runs": self.runs,
+                "chunks": self.chunks,
+                "sessions_deleted": self.sessions_deleted,
+                "users_deleted": self.users_deleted,
+                "duration_last": self.duration_last,
+                "duration_maximum": self.duration_maximum,
+            }
+
+            self.duration_maximum = 0.0
+
+            return details
 
-    # Loop over all records of workshop sessions in the database and check
-    # whether any should be deleted and/or marked as stopped.
+
+cleanup_progress = CleanupProgress()
+
+
+def deployed_workshop_sessions():
+    """Returns the set of names of workshop sessions deployed to the cluster
+    for this training portal, using a single list request. Returns None if
+    the list could not be obtained.
+
+    """
 
     K8SWorkshopSession = pykube.object_factory(
         api, "training.educates.dev/v1beta1", "WorkshopSession"
     )
 
-    for session in Session.objects.all():
-        if not session.is_starting() and not session.is_stopped():
+    try:
+        resources = K8SWorkshopSession.objects(api).filter(
+            selector={"training.educates.dev/portal.name": settings.PORTAL_NAME}
+        )
+
+        return {resource.name for resource in resources}
+
+    except pykube.exceptions.PyKubeError:
+        logger.exception("Failed to list deployed workshop sessions.")
+
+    return None
+
+
+@background_task(priority=LOW_PRIORITY, coalesce=True)
+def purge_expired_workshop_sessions():
+    """Look for workshop sessions which have expired and delete them. No lock
+    is held as deletion of workshop sessions is done by separate tasks which
+    acquire the required locks.
+
+    """
+
+    now = timezone.now()
+
+    # Retrieve records of workshop sessions in the database which haven't yet
+    # stopped. These are retrieved before listing the deployed workshop
+    # sessions so that any workshop session which has progressed beyond
+    # starting will have been deployed before the list is obtained.
+
+    sessions = list(
+        Session.objects.exclude(state=SessionState.STOPPED).select_related(
+            "environment"
+        )
+    )
+
+    deployed_sessions = deployed_workshop_sessions()
+
+    orphan_candidates = []
+
+    # Loop over the records of workshop sessions and check whether any should
+    # be deleted and/or marked as stopped.
+
+    for session in sessions:
+        if not session.is_starting() and deployed_sessions is not None:
             # If the workshop session isn't still starting, and hasn't stopped
             # yet, check to see whether there is a deployed workshop session.
             # If there isn't, it means it was deleted manually. In this case
@@ -52,10 +150,7 @@ def purge_expired_workshop_sessions():
             # there will be no deployment to delete, but still have to mark
             # the workshop session as deleted in the database.
 
-            try:
-                K8SWorkshopSession.objects(api).get(name=session.name)
-
-            except pykube.exceptions.ObjectDoesNotExist:
+            if session.name not in deployed_sessions:
                 logger.info(
                     "Schedule cleanup of vanished workshop session %s.",
                     session.name,
@@ -67,9 +162,6 @@ def purge_expired_workshop_sessions():
 
                 continue
 
-            except pykube.exceptions.PyKubeError:
-                pass
-
         if session.is_allocated() or session.is_stopping():
             # If the workshop session is in use, including where it has been
             # explicitly marked for expiration, if expiration time has been
@@ -93,84 +185,47 @@ def purge_expired_workshop_sessions():
                 # these, a reserved session which has been running for a while,
                 # will be incorrectly seen as orhpaned.
 
-                try:
-                    # Query the idle time from the workshop session instance.
-                    # Use the internal Kubernetes service for accessing the
-                    # workshop instance as will fail if use public ingress and
-                    # using a self signed CA as not currently injected such a
-                    # CA into the training portal pod.
-
-                    # host = f"{session.name}.{settings.INGRESS_DOMAIN}"
-                    # url = f"{settings.INGRESS_PROTOCOL}://{host}/session/activity"
-
-                    url = f"http://{session.name}.{session.environment.name}/session/activity"
-
-                    response = requests.get(url)
-
-                    if response.status_code == 200:
-                        # If got a response and we have exceeded the
-                        # inactivity timeout then trigger deletion of the
-                        # workshop session.
+                orphan_candidates.append(session)
 
-                        idle_time = timedelta(seconds=response.json()["idle-time"])
-                        last_view = timedelta(seconds=response.json()["last-view"])
+    # Query the idle time from the workshop sessions which could have been
+    # orphaned. The workshop sessions are queried concurrently and any which
+    # don't respond are skipped until the next time this is run.
 
-                        if idle_time >= session.environment.orphaned:
-                            logger.info(
-                                "Schedule deletion of orphaned workshop session %s after period of %s seconds.",
-                                session.name,
-                                idle_time.total_seconds(),
-                            )
+    activity = query_sessions_activity(orphan_candidates)
 
-                            report_analytics_event(session, "Session/Orphaned")
+    for session in orphan_candidates:
+        details = activity.get(session.name)
 
-                            delete_workshop_session(session).schedule()
+        if details is None:
+            continue
 
-                        elif last_view >= (3 * session.environment.orphaned):
-                            logger.info(
-                                "Schedule deletion of inactive workshop session %s after period of %s seconds.",
-                                session.name,
-                                last_view.total_seconds(),
-                            )
+        # If we have exceeded the inactivity timeout then trigger deletion of
+        # the workshop session.
 
-                            report_analytics_event(session, "Session/Inactive")
+        if details.idle_time >= session.environment.orphaned:
+            logger.info(
+                "Schedule deletion of orphaned workshop session %s after period of %s seconds.",
+                session.name,
+                details.idle_time.total_seconds(),
+            )
 
-                            delete_workshop_session(session).schedule()
+            report_analytics_event(session, "Session/Orphaned")
 
-                    else:
-                        # XXX If we don't get a valid response then not
-                        # currently doing anything. Need a better method to
-                        # determine if was running but has since failed in
-                        # some way and become uncontactable. In that case
-                        # right now will only be deleted when workshop timeout
-                        # expires if there is one.
+            delete_workshop_session(session).schedule()
 
-                        pass
+        elif details.last_view >= (3 * session.environment.orphaned):
+            logger.info(
+                "Schedule deletion of inactive workshop session %s after period of %s seconds.",
+                session.name,
+                details.last_view.total_seconds(),
+            )
 
-                except requests.exceptions.ConnectionError:
-                    # XXX This can just be because it is slow to start up.
-                    # Need a better method to determine if was running but has
-                    # since failed in some way and become uncontactable. In
-                    # that case right now will only be deleted when workshop
-                    # timeout expires if there is one.
+            report_analytics_event(session, "Session/Inactive")
 
-                    logger.warning(
-                        "Cannot connect to workshop session %s.", session.name
-                    )
+            delete_workshop_session(session).schedule()
 
-                except Exception:  # pylint: disable=broad-except
-                    # Not aware of circumstances where would get an unexpected
-                    # exception, but need to log and ignore it as we don't
-                    # want to stop looping over all sessions.
 
-                    logger.exception(
-                        "Failed to query idle time for workshop session %s.",
-                        session.name,
-                    )
-
-
-@background_task
-@resources_lock
+@background_task(coalesce=True)
 def delete_workshop_session(session):
     """Deletes a workshop session."""
 
@@ -196,49 +251,198 @@ def delete_workshop_session(session):
 
     # Update the workshop session as stopped in the database, then see
     # whether a new workshop session needs to be created in its place as
-    # a reserved session.
+    # a reserved session. The database record is reloaded as it may have
+    # changed, or deletion may have been scheduled more than once.
+
+    environment = session.environment
+
+    with environment_lock(environment), session_lock(
+        session.name
+    ), transaction.atomic():
+        session.refresh_from_db()
+
+        if session.is_stopped():
+            return
 
-    with transaction.atomic():
         session.mark_as_stopped()
         if session.owner:
             report_analytics_event(session, "Session/Deleted")
 
-        replace_reserved_session(session.environment)
+        environment.refresh_from_db()
+
+        replace_reserved_session(environment)
 
+        # If the workshop environment is stopping, it may now be able to be
+        # deleted.
 
-@background_task
-@resources_lock
+        if environment.is_stopping():
+            schedule_environment_reconciliation(environment)
+
+
+@background_task(priority=LOW_PRIORITY, coalesce=True)
 def cleanup_old_sessions_and_users():
     """Delete records for any sessions older than a certain time, and then
     remove any anonymous user accounts that have no active sessions and which
-    are older than a certain time.
+    are older than a certain time. Records are deleted in chunks, each in its
+    own short transaction, so other database updates are not held up. No lock
+    is held as a workshop session being allocated to a user concurrently will
+    prevent deletion of the user.
 
     """
 
-    with transaction.atomic():
-        # Delete record of workshop sessions more than 36 hours old.
+    start = time.monotonic()
+
+    cutoff = timezone.now() - timedelta(hours=settings.CLEANUP_RETENTION_PERIOD)
+
+    chunk_size = settings.CLEANUP_CHUNK_SIZE
+
+    # Delete record of workshop sessions which stopped before the cutoff.
+    # Chunks are selected in order of name so the same records are not
+    # selected again.
+
+    sessions_deleted = 0
+
+    last_name = ""
+
+    while True:
+        names = list(
+            Session.objects.filter(
+                state=SessionState.STOPPED, expires__lte=cutoff, name__gt=last_name
+            )
+            .order_by("name")
+            .values_list("name", flat=True)[:chunk_size]
+        )
+
+        if not names:
+            break
+
+        last_name = names[-1]
+
+        deleted = Session.bulk_delete_stopped_sessions(names)
+
+        sessions_deleted += deleted
 
-        cutoff = timezone.now() - timedelta(hours=36)
+        cleanup_progress.record_chunk(sessions=deleted)
 
-        sessions = Session.objects.filter(
-            state=SessionState.STOPPED, expires__lte=cutoff
+        logger.info("Deleted %d old workshop sessions so far.", sessions_deleted)
+
+    # Delete any anonymous users which joined before the cutoff, which now
+    # don't have any workshop sessions associated with them.
+
+    User = get_user_model()  # pylint: disable=invalid-name
+
+    without_sessions = ~Exists(Session.objects.filter(owner=OuterRef("pk")))
+
+    users_deleted = 0
+
+    last_pk = 0
+
+    while True:
+        users = list(
+            User.objects.filter(
+                without_sessions,
+                groups__name="anonymous",
+                date_joined__lte=cutoff,
+                pk__gt=last_pk,
+            )
+            .order_by("pk")
+            .values_list("pk", "username")[:chunk_size]
         )
 
-        for session in sessions:
-            logger.info("Cleanup old workshop session %s.", session.name)
-            session.delete()
+        if not users:
+            break
+
+        last_pk = users[-1][0]
+
+        deleted = delete_anonymous_users(users, without_sessions)
+
+        for username in deleted:
+            logger.info("Deleting anonymous user %s.", username)
+
+            report_analytics_event(
+                User(username=username), "User/Delete", {"group": "anonymous"}
+            )
+
+        users_deleted += len(deleted)
+
+        cleanup_progress.record_chunk(users=len(deleted))
+
+        logger.info("Deleted %d anonymous users so far.", users_deleted)
 
-        # Delete any anonymous users older than 36 hours old, which
-        # now don't have any workshop sessions associated with them.
+    duration = time.monotonic() - start
 
-        User = get_user_model()  # pylint: disable=invalid-name
+    cleanup_progress.record_run(duration)
 
-        users = User.objects.filter(groups__name="anonymous", date_joined__lte=cutoff)
+    logger.info(
+        "Cleaned up %d old workshop sessions and %d anonymous users in %.2f seconds.",
+        sessions_deleted,
+        users_deleted,
+        duration,
+    )
+
+
+def delete_anonymous_users(users, without_sessions):
+    """Delete the chunk of anonymous users in a single transaction, returning
+    the names of the users deleted. Where a workshop session has since been
+    allocated to a user, that user is skipped.
+
+    """
+
+    User = get_user_model()  # pylint: disable=invalid-name
+
+    pks = [pk for pk, _ in users]
+
+    try:
+        with transaction.atomic():
+            deleted = set(
+                User.objects.filter(without_sessions, pk__in=pks).values_list(
+                    "pk", flat=True
+                )
+            )
+
+            User.objects.filter(pk__in=deleted).delete()
+
+    except ProtectedError:
+        # A workshop session was allocated to one of the users after they
+        # were selected, so fall back to deleting them one at a time.
+
+        deleted = set()
 
-        for user in users:
-            sessions = Session.objects.filter(owner=user)
+        for pk in pks:
+            try:
+                with transaction.atomic():
+                    user = User.objects.filter(without_sessions, pk=pk).first()
+
+                    if not user:
+                        continue
+
+                    user.delete()
+
+            except ProtectedError:
+                continue
+
+            deleted.add(pk)
+
+    return [username for pk, username in users if pk in deleted]
+
+
+@background_task(priority=LOW_PRIORITY, coalesce=True)
+def verify_session_counters():
+    """Rebuilds the counts of workshop sessions maintained for the workshop
+    environments and training portal from the workshop sessions themselves,
+    logging where they had drifted from the true values.
+
+    """
+
+    for portal in TrainingPortal.objects.all():
+        for environment in portal.environment_set.all():
+            if environment.rebuild_session_counters():
+                logger.warning(
+                    "Corrected session counters for workshop environment %s.",
+                    environment.name,
+                )
 
-            if not sessions:
-                logger.info("Deleting anonymous user %s.", user.get_username())
-                report_analytics_event(user, "User/Delete", {"group": "anonymous"})
-                user.delete()
+        if portal.rebuild_session_counters():
+            logger.warning(
+                "Corrected session counters for training portal %s.", portal.name
+            )
@@ -19,13 +19,14 @@ from django.utils import timezone
 
 from .resources import ResourceBody
 from .operator import background_task
-from .locking import resources_lock
+from .locking import resources_lock, environment_lock
 from .sessions import (
-    update_session_status,
-    setup_workshop_session,
-    create_workshop_session,
+    schedule_session_status_update,
+    setup_workshop_sessions,
+    schedule_workshop_session_creation,
 )
 from .analytics import report_analytics_event
+from .reconciliation import schedule_environment_reconciliation
 
 from ..models import TrainingPortal, Environment, Workshop
 
@@ -198,32 +199,22 @@ def activate_workshop_environment(resource):
     # sure we don't go over any capacity cap for the training portal as a
     # whole.
 
-    sessions = []
-
     maximum = portal.sessions_maximum
 
     if maximum == 0:
         maximum = environment.initial
     else:
+        portal.refresh_session_counters()
+
         maximum -= portal.active_sessions_count()
 
     required = min(environment.initial, maximum)
 
-    for _ in range(required):
-        sessions.append(setup_workshop_session(environment))
-
-    def _schedule_session_creation():
-        if sessions:
-            logger.info(
-                "Schedule creation of %d new reserved workshop sessions for workshop environment %s.",
-                len(sessions),
-                environment.name,
-            )
+    sessions = setup_workshop_sessions(environment, required)
 
-            for session, secret in sessions:
-                create_workshop_session(session, secret)
+    schedule_workshop_session_creation(environment, sessions)
 
-    transaction.on_commit(_schedule_session_creation)
+    schedule_environment_reconciliation(environment)
 
 
 @kopf.on.event(
@@ -323,18 +314,19 @@ def shutdown_workshop_environments(training_portal, workshops):
             else:
                 logger.info("Stopping workshop environment %s.", environment.name)
 
-            update_environment_status(environment.name, "Stopping")
+            schedule_environment_status_update(environment.name, "Stopping")
             environment.mark_as_stopping()
             report_analytics_event(environment, "Environment/Terminate")
 
             for session in environment.available_sessions():
-                update_session_status(session.name, "Stopping")
+                schedule_session_status_update(session.name, "Stopping")
                 session.mark_as_stopping()
                 report_analytics_event(session, "Session/Terminate")
 
+            schedule_environment_reconciliation(environment)
 
-@background_task
-@resources_lock
+
+@background_task(coalesce=True)
 def delete_workshop_environment(environment):
     """Deletes a workshop environment. If this is called when there are still
     workshop sessions, they will be forcibly deleted.
@@ -358,7 +350,24 @@ def delete_workshop_environment(environment):
         logger.exception("Failed to delete workshop environment %s.", environment.name)
 
 
-@background_task
+def environments_due_for_refresh(training_portal):
+    """Returns the list of running workshop environments which have a refresh
+    interval and for which that interval has been exceeded.
+
+    """
+
+    now = timezone.now()
+
+    return [
+        environment
+        for environment in training_portal.running_environments().exclude(
+            refresh=timedelta()
+        )
+        if now - environment.created_at > environment.refresh
+    ]
+
+
+@background_task(coalesce=True)
 @resources_lock
 @transaction.atomic
 def refresh_workshop_environments(training_portal):
@@ -368,22 +377,16 @@ def refresh_workshop_environments(training_portal):
 
     """
 
-    for environment in training_portal.running_environments():
-        if environment.refresh.total_seconds() != 0:
-            duration = timezone.now() - environment.created_at
-
-            if duration.total_seconds() > environment.refresh.total_seconds():
-                logger.info(
-                    "Trigger periodic refresh of workshop environment %s.",
-                    environment.name,
-                )
+    for environment in environments_due_for_refresh(training_portal):
+        logger.info(
+            "Trigger periodic refresh of workshop environment %s.",
+            environment.name,
+        )
 
-                replace_workshop_environment(environment)
+        replace_workshop_environment(environment)
 
 
-@background_task
-@resources_lock
-@transaction.atomic
+@background_task(coalesce=True)
 def delete_workshop_environments(training_portal):
     """Looks for workshop environments which are marked as stopping and if
     the number of active workshop sessions has reached zero, the workshop
@@ -392,14 +395,34 @@ def delete_workshop_environments(training_portal):
     """
 
     for environment in training_portal.stopping_environments():
-        if environment.active_sessions_count() == 0:
-            logger.info(
-                "Trigger deletion of workshop environment %s.", environment.name
-            )
+        retire_workshop_environment(environment)
+
+
+def retire_workshop_environment(environment):
+    """If the workshop environment is marked as stopping and the number of
+    active workshop sessions has reached zero, mark it as stopped and trigger
+    its deletion. The lock for the workshop environment is acquired by this
+    function.
+
+    """
+
+    with environment_lock(environment), transaction.atomic():
+        environment.refresh_from_db()
 
-            delete_workshop_environment(environment).schedule()
-            environment.mark_as_stopped()
-            report_analytics_event(environment, "Environment/Deleted")
+        if not environment.is_stopping():
+            return
+
+        if environment.active_sessions_count() != 0:
+            return
+
+        logger.info("Trigger deletion of workshop environment %s.", environment.name)
+
+        transaction.on_commit(
+            lambda: delete_workshop_environment(environment).schedule()
+        )
+
+        environment.mark_as_stopped()
+        report_analytics_event(environment, "Environment/Deleted")
 
 
 def update_workshop_environments(training_portal, workshops):
@@ -440,10 +463,15 @@ def update_workshop_environments(training_portal, workshops):
 
             environment.save()
 
-            update_environment_status_details(
+            schedule_environment_status_details_update(
                 environment.name, environment.capacity, environment.reserved
             )
 
+            # Changes to capacity or reserved sessions may require workshop
+            # sessions to be created or deleted.
+
+            schedule_environment_reconciliation(environment)
+
 
 @background_task
 @resources_lock
@@ -670,15 +698,17 @@ def replace_workshop_environment(environment):
             environment.workshop_name,
         )
 
-    update_environment_status(environment.name, "Stopping")
+    schedule_environment_status_update(environment.name, "Stopping")
     environment.mark_as_stopping()
     report_analytics_event(environment, "Environment/Terminate")
 
     for session in environment.available_sessions():
-        update_session_status(session.name, "Stopping")
+        schedule_session_status_update(session.name, "Stopping")
         session.mark_as_stopping()
         report_analytics_event(session, "Session/Terminate")
 
+    schedule_environment_reconciliation(environment)
+
     # Now schedule creation of the replacement workshop session.
 
     process_workshop_environment(environment.portal, workshop, position).schedule()
@@ -721,3 +751,44 @@ def update_environment_status_details(name, capacity, reserved):
         logger.exception(
             "Failed to update status details of workshop environment %s.", name
         )
+
+
+@background_task(coalesce=True)
+def apply_environment_status(name, phase):
+    """Update the status of the Kubernetes resource object for the workshop
+    environment from a background task.
+
+    """
+
+    update_environment_status(name, phase)
+
+
+def schedule_environment_status_update(name, phase):
+    """Schedule an update of the status of the Kubernetes resource object for
+    the workshop environment for when the current database transaction has
+    been committed.
+
+    """
+
+    transaction.on_commit(lambda: apply_environment_status(name, phase).schedule())
+
+
+@background_task(coalesce=True)
+def apply_environment_status_details(name, capacity, reserved):
+    """Update the capacity for the workshop environment recorded in the status
+    from a background task.
+
+    """
+
+    update_environment_status_details(name, capacity, reserved)
+
+
+def schedule_environment_status_details_update(name, capacity, reserved):
+    """Schedule an update of the capacity for the workshop environment recorded
+    in the status for when the current database transaction has been committed.
+
+    """
+
+    transaction.on_commit(
+        lambda: apply_environment_status_details(name, capacity, reserved).schedule()
+    )
@@ -1,20 +1,161 @@
-"""Implementation of a global lock for database operations affecting workshop
-sessions.
+"""Implementation of locks for database operations affecting workshop
+environments and workshop sessions.
+
+The locks must always be acquired in the following order, and code holding a
+lock for one user, workshop environment or workshop session must not acquire
+the lock for another.
+
+* The lock for a user, only when allocating a workshop session to the user.
+* The resources lock, in shared mode for operations which only affect a single
+  workshop environment, or in exclusive mode for reconciliation of the training
+  portal configuration which can affect all workshop environments.
+* The capacity lock, only when the training portal imposes a maximum on the
+  number of workshop sessions across all workshop environments.
+* The lock for a workshop environment.
+* The lock for a workshop session.
+
+Locks should be acquired before starting a database transaction and only
+released after it has been committed. Calls to the Kubernetes REST API should
+be made after the transaction has been committed and the locks released.
 
 """
 
+import contextlib
 import threading
+import zlib
 
 import wrapt
 
 
-_global_lock = threading.Lock()
+class SharedExclusiveLock:
+    """Lock which can be held by many threads in shared mode, or by a single
+    thread in exclusive mode. Threads waiting for exclusive mode take priority
+    over new requests for shared mode so they are not starved. The lock is
+    reentrant, and a thread which holds the lock in exclusive mode can also
+    acquire it in shared mode.
+
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive_owner = None
+        self._exclusive_depth = 0
+        self._exclusive_waiting = 0
+        self._local = threading.local()
+
+    def acquire_shared(self):
+        with self._condition:
+            if self._exclusive_owner == threading.get_ident():
+                self._exclusive_depth += 1
+                return
+
+            # Don't wait when the thread already holds the lock in shared mode
+            # else it would deadlock with any thread waiting on exclusive mode.
+
+            depth = getattr(self._local, "depth", 0)
+
+            self._local.depth = depth + 1
+
+            if depth:
+                return
+
+            while self._exclusive_owner is not None or self._exclusive_waiting:
+                self._condition.wait()
+
+            self._shared += 1
+
+    def release_shared(self):
+        with self._condition:
+            if self._exclusive_owner == threading.get_ident():
+                self._exclusive_depth -= 1
+                return
+
+            self._local.depth -= 1
+
+            if self._local.depth:
+                return
+
+            self._shared -= 1
+
+            if not self._shared:
+                self._condition.notify_all()
+
+    def acquire_exclusive(self):
+        with self._condition:
+            if self._exclusive_owner == threading.get_ident():
+                self._exclusive_depth += 1
+                return
+
+            self._exclusive_waiting += 1
+
+            try:
+                while self._exclusive_owner is not None or self._shared:
+                    self._condition.wait()
+
+            finally:
+                self._exclusive_waiting -= 1
+
+            self._exclusive_owner = threading.get_ident()
+            self._exclusive_depth = 1
+
+    def release_exclusive(self):
+        with self._condition:
+            self._exclusive_depth -= 1
+
+            if not self._exclusive_depth:
+                self._exclusive_owner = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def shared(self):
+        """Context manager holding the lock in shared mode."""
+
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    def __enter__(self):
+        self.acquire_exclusive()
+        return self
+
+    def __exit__(self, *_):
+        self.release_exclusive()
+
+
+class StripedLocks:
+    """Set of locks where the lock for a name is selected by hashing the
+    name. This bounds the number of locks while making it unlikely that
+    unrelated names share the same lock. Reentrant locks are used so a thread
+    doesn't deadlock if it happens to need the same lock twice.
+
+    """
+
+    def __init__(self, stripes):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def __call__(self, name):
+        return self._locks[zlib.crc32(str(name).encode("UTF-8")) % len(self._locks)]
+
+
+_global_lock = SharedExclusiveLock()
+
+_capacity_lock = threading.RLock()
+
+_environment_locks = StripedLocks(64)
+
+_session_locks = StripedLocks(256)
+
+_user_locks = StripedLocks(64)
 
 
 def resources_lock(wrapped=None):
     """Returns a lock when used for context manager, or decorator when
-    applied to a function. This is used to ensure only one things is working
-    with Kubernetes REST API or database at any one time to avoid issues.
+    applied to a function. This holds the resources lock in exclusive mode and
+    should only be used for reconciling the training portal configuration
+    where changes can affect all workshop environments.
 
     """
 
@@ -27,3 +168,52 @@ def resources_lock(wrapped=None):
             return wrapped(*args, **kwargs)
 
     return wrapper(wrapped)  # pylint: disable=no-value-for-parameter
+
+
+@contextlib.contextmanager
+def portal_lock(portal):
+    """Returns a context manager holding the locks required to make decisions
+    about the capacity of the training portal as a whole.
+
+    """
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(_global_lock.shared())
+
+        if portal.sessions_maximum:
+            stack.enter_context(_capacity_lock)
+
+        yield
+
+
+@contextlib.contextmanager
+def environment_lock(environment):
+    """Returns a context manager holding the locks required for allocating,
+    creating or deleting workshop sessions for a workshop environment. The
+    capacity lock is only acquired when the training portal has a maximum on
+    the number of workshop sessions, so where it doesn't, operations for
+    different workshop environments can proceed in parallel.
+
+    """
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(portal_lock(environment.portal))
+        stack.enter_context(_environment_locks(environment.name))
+
+        yield
+
+
+def session_lock(name):
+    """Returns the lock for changing the state of the named workshop session."""
+
+    return _session_locks(name)
+
+
+def user_lock(user):
+    """Returns the lock for allocating workshop sessions to the user. This
+    ensures concurrent requests for the same user can't each be allocated a
+    workshop session.
+
+    """
+
+    return _user_locks(user.get_username())
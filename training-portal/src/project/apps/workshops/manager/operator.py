@@ -8,11 +8,16 @@ import signal
 import asyncio
 import contextlib
 import functools
+import heapq
+import itertools
 import logging
+import time
+import concurrent.futures
 
-from threading import Thread, Event
+from threading import Thread, Event, Condition
 
-from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
 
 import mod_wsgi
 import kopf
@@ -23,6 +28,137 @@ logger = logging.getLogger("educates")
 
 _event_loop = None  # pylint: disable=invalid-name
 
+# Priorities for background tasks. Tasks with a lower value are run first, so
+# that work a user is waiting on isn't held up behind housekeeping tasks.
+
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 2
+
+
+class TaskScheduler:
+    """Pool of worker threads which run background tasks. Tasks waiting to be
+    run are queued in order of priority, and then in the order they were
+    submitted. Where a task which can be coalesced is submitted while an
+    identical task is still waiting to be run, the waiting task is used for
+    both rather than queueing the task a second time.
+
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+
+        self._condition = Condition()
+        self._queue = []
+        self._waiting = {}
+        self._sequence = itertools.count()
+        self._threads = []
+        self._busy = 0
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.latency_total = 0.0
+        self.latency_maximum = 0.0
+
+    def submit(self, task):
+        """Queue the task to be run by a worker thread, returning a future
+        for the result of the task.
+
+        """
+
+        key = task.coalesce_key()
+
+        with self._condition:
+            self.submitted += 1
+
+            if key is not None and key in self._waiting:
+                self.coalesced += 1
+                return self._waiting[key][1]
+
+            future = concurrent.futures.Future()
+
+            entry = (task, future, key, time.monotonic())
+
+            heapq.heappush(self._queue, (task.priority, next(self._sequence), entry))
+
+            if key is not None:
+                self._waiting[key] = entry
+
+            # Worker threads are only started when first required.
+
+            if len(self._threads) < self.workers:
+                thread = Thread(target=self._worker, name="task-worker", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+            self._condition.notify()
+
+            return future
+
+    def _worker(self):
+        """Runs tasks from the queue in the worker thread."""
+
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+
+                task, future, key, queued = heapq.heappop(self._queue)[2]
+
+                if key is not None:
+                    del self._waiting[key]
+
+                latency = time.monotonic() - queued
+
+                self.latency_total += latency
+                self.latency_maximum = max(self.latency_maximum, latency)
+
+                self._busy += 1
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(task.run())
+
+                    except BaseException as exc:  # pylint: disable=broad-except
+                        future.set_exception(exc)
+
+            finally:
+                with self._condition:
+                    self._busy -= 1
+                    self.processed += 1
+
+    def statistics(self):
+        """Returns the queue depth, number of busy workers and latency of
+        tasks waiting to be run, resetting the maximum latency.
+
+        """
+
+        with self._condition:
+            latency_average = 0.0
+
+            if self.processed:
+                latency_average = self.latency_total / self.processed
+
+            details = {
+                "depth": len(self._queue),
+                "busy": self._busy,
+                "workers": self.workers,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "processed": self.processed,
+                "latency_average": latency_average,
+                "latency_maximum": self.latency_maximum,
+            }
+
+            self.latency_maximum = 0.0
+
+            return details
+
+
+task_scheduler = TaskScheduler(settings.TASK_WORKER_THREADS)
+
 
 class Task:
     """Encapsulation of an instance of a background task. It binds the
@@ -33,7 +169,7 @@ class Task:
     """
 
     def __init__(
-        self, wrapped, name, delay, repeat, args, kwargs
+        self, wrapped, name, delay, repeat, priority, coalesce, args, kwargs
     ):  # pylint: disable=too-many-arguments
         """Capture details of the function implementing the task and the
         parameters for invoking it.
@@ -44,42 +180,80 @@ class Task:
         self.name = name
         self.delay = delay
         self.repeat = repeat
+        self.priority = priority
+        self.coalesce = coalesce
         self.args = args
         self.kwargs = kwargs
 
+    def coalesce_key(self):
+        """Returns the key identifying identical tasks which can be coalesced
+        while waiting to be run, or None if the task cannot be coalesced.
+
+        """
+
+        if not self.coalesce:
+            return None
+
+        key = (self.name, self.args, tuple(sorted(self.kwargs.items())))
+
+        try:
+            hash(key)
+        except TypeError:
+            return None
+
+        return key
+
     def execute(self):
         """Execute the function for the task synchronously."""
 
         return self.wrapped(*self.args, **self.kwargs)
 
-    def schedule(self, *, delay=None):
-        """Schedule a task to be run using the asyncio library. The delay
-        before running the task which was originally specified can be
-        overridden at this point if necessary.
+    def run(self):
+        """Executes the function from a worker thread, capturing details of
+        any exception and logging it since nothing will even wait on the
+        results.
+
+        """
+
+        # Database connections are retained by the worker threads across
+        # tasks when persistent connections are enabled. Discard any which
+        # have expired or are no longer usable, as is done for requests.
+
+        close_old_connections()
+
+        try:
+            logger.debug("Executing task %s %s %s.", self.name, self.args, self.kwargs)
+            return self.wrapped(*self.args, **self.kwargs)
+
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Exception raised by task %s.", self.name)
+
+        finally:
+            close_old_connections()
+
+    def schedule(self, *, delay=None, priority=None):
+        """Schedule a task to be run by the pool of worker threads. Where the
+        task is to be delayed or repeated, the asyncio library is used to wait
+        before queueing it. The delay before running the task and the priority
+        which were originally specified can be overridden at this point if
+        necessary.
 
         """
 
         delay = delay or self.delay
 
+        if priority is not None:
+            self.priority = priority
+
+        if delay <= 0.0 and not self.repeat:
+            return task_scheduler.submit(self)
+
         async def sleep():
             if delay > 0.0:
                 await asyncio.sleep(delay)
 
-        @sync_to_async(thread_sensitive=False)
-        def execute():
-            """Executes the function, capturing details of any exception and
-            logging it since nothing will even wait on the results.
-
-            """
-
-            try:
-                logger.debug(
-                    "Executing task %s %s %s.", self.name, self.args, self.kwargs
-                )
-                return self.wrapped(*self.args, **self.kwargs)
-
-            except Exception:  # pylint: disable=broad-except
-                logger.exception("Exception raised by task %s.", self.name)
+        async def execute():
+            return await asyncio.wrap_future(task_scheduler.submit(self))
 
         async def task():
             """The asynchronous task wrapper for the function. Handles once
@@ -105,9 +279,19 @@ class Task:
         return asyncio.run_coroutine_threadsafe(task(), _event_loop)
 
 
-def background_task(wrapped=None, *, name=None, delay=0.0, repeat=False):
+def background_task(
+    wrapped=None,
+    *,
+    name=None,
+    delay=0.0,
+    repeat=False,
+    priority=NORMAL_PRIORITY,
+    coalesce=False,
+):  # pylint: disable=too-many-arguments
     """Designates a synchronous function as an asynchronous task. The function
     can be defined to be executed once, or set up to be called repeatedly.
+    Tasks which are safe to run once in place of multiple identical requests
+    can be marked as able to be coalesced.
 
     """
 
@@ -116,7 +300,14 @@ def background_task(wrapped=None, *, name=None, delay=0.0, repeat=False):
     # applyication to the function implementing the task.
 
     if wrapped is None:
-        return functools.partial(background_task, delay=delay, repeat=repeat)
+        return functools.partial(
+            background_task,
+            name=name,
+            delay=delay,
+            repeat=repeat,
+            priority=priority,
+            coalesce=coalesce,
+        )
 
     name = name or wrapped.__qualname__
 
@@ -126,7 +317,7 @@ def background_task(wrapped=None, *, name=None, delay=0.0, repeat=False):
     # returned.
 
     def wrapper(*args, **kwargs):
-        return Task(wrapped, name, delay, repeat, args, kwargs)
+        return Task(wrapped, name, delay, repeat, priority, coalesce, args, kwargs)
 
     return wrapper
 
@@ -17,28 +17,38 @@ from django.contrib.auth import get_user_model
 
 from oauth2_provider.models import Application, clear_expired
 
-from ..models import TrainingPortal
+from ..models import TrainingPortal, Environment
 
 from .resources import ResourceBody
-from .operator import background_task, initialize_kopf
+from .operator import background_task, initialize_kopf, task_scheduler, LOW_PRIORITY
 from .locking import resources_lock
+from .reconciliation import reconciliation_queue
 from .environments import (
     update_workshop_environments,
     initiate_workshop_environments,
     shutdown_workshop_environments,
     delete_workshop_environments,
     refresh_workshop_environments,
+    environments_due_for_refresh,
     update_environment_status,
     process_workshop_environment,
     replace_workshop_environment,
+    retire_workshop_environment,
 )
 from .sessions import (
     initiate_reserved_sessions,
+    initiate_environment_sessions,
     terminate_reserved_sessions,
+    terminate_environment_sessions,
     update_session_status,
 )
-from .cleanup import cleanup_old_sessions_and_users, purge_expired_workshop_sessions
-from .analytics import report_analytics_event
+from .cleanup import (
+    cleanup_old_sessions_and_users,
+    cleanup_progress,
+    purge_expired_workshop_sessions,
+    verify_session_counters,
+)
+from .analytics import analytics_delivery, report_analytics_event
 
 logger = logging.getLogger("educates")
 
@@ -309,17 +319,21 @@ def process_training_portal(resource):
     shutdown_workshop_environments(portal, workshops)
 
     # Update configuration of any workshop environments which already exist.
+    # This queues them to be reconciled against the new configuration. A
+    # change to the maximum number of sessions for the training portal may
+    # also require reserved sessions to be terminated.
 
     update_workshop_environments(portal, workshops)
 
+    transaction.on_commit(lambda: terminate_reserved_sessions(portal).schedule())
+
     # Initiate creation of any workshop environments which don't already
     # exist.
 
     initiate_workshop_environments(portal, workshops)
 
 
-@background_task(delay=60*60, repeat=True)
-@resources_lock
+@background_task(delay=60*60, repeat=True, priority=LOW_PRIORITY)
 @transaction.atomic
 def start_hourly_cleanup_task():
     """Hourly cleanup job."""
@@ -328,16 +342,73 @@ def start_hourly_cleanup_task():
 
     clear_expired()
 
+    # Check that the counts of workshop sessions maintained for capacity
+    # decisions haven't drifted from the true values.
 
-@background_task(delay=15.0, repeat=True)
-@resources_lock
-@transaction.atomic
+    verify_session_counters().schedule()
+
+
+@background_task(
+    delay=settings.RECONCILIATION_INTERVAL, repeat=True, priority=LOW_PRIORITY
+)
 def start_reconciliation_task(name):
     """Periodic reconcilliation task which ensures current deployments of
     workshop environments and workshop sessions matches desired configuration.
+    Changes are normally reconciled as they occur by processing the queue of
+    affected workshop environments, so this is a safety net for any changes
+    which were missed.
 
     """
 
+    statistics = reconciliation_queue.statistics()
+
+    logger.info(
+        "Reconciliation queue depth %d, processed %d, average latency %.3f seconds, maximum latency %.3f seconds.",
+        statistics["depth"],
+        statistics["processed"],
+        statistics["latency_average"],
+        statistics["latency_maximum"],
+    )
+
+    statistics = task_scheduler.statistics()
+
+    logger.info(
+        "Task queue depth %d, busy workers %d of %d, submitted %d, coalesced %d, processed %d, average latency %.3f seconds, maximum latency %.3f seconds.",
+        statistics["depth"],
+        statistics["busy"],
+        statistics["workers"],
+        statistics["submitted"],
+        statistics["coalesced"],
+        statistics["processed"],
+        statistics["latency_average"],
+        statistics["latency_maximum"],
+    )
+
+    statistics = analytics_delivery.statistics()
+
+    logger.info(
+        "Analytics queue depth %d, queued %d, delivered %d, failed %d, dropped %d, requests %d, retried %d.",
+        statistics["depth"],
+        statistics["queued"],
+        statistics["delivered"],
+        statistics["failed"],
+        statistics["dropped"],
+        statistics["requests"],
+        statistics["retried"],
+    )
+
+    statistics = cleanup_progress.statistics()
+
+    logger.info(
+        "Cleanup runs %d, chunks %d, sessions deleted %d, users deleted %d, last duration %.2f seconds, maximum duration %.2f seconds.",
+        statistics["runs"],
+        statistics["chunks"],
+        statistics["sessions_deleted"],
+        statistics["users_deleted"],
+        statistics["duration_last"],
+        statistics["duration_maximum"],
+    )
+
     # Need to guard against the training portal configuration not having been
     # read in as yet. This should only arise if there is a serious issues with
     # updates to resources not being prompt.
@@ -358,22 +429,73 @@ def start_reconciliation_task(name):
 
     terminate_reserved_sessions(portal).schedule()
 
-    # Queue further task to look for workshop environments that should be
-    # retired and replaced with a new one.
-
-    refresh_workshop_environments(portal).schedule()
-
     # Queue further task to look for where additional workshop sessions need
     # to be created in reserved as required reserved sessions or capacity of
     # workshop environment or training portal was changed.
 
     initiate_reserved_sessions(portal).schedule()
 
-    purge_expired_workshop_sessions().schedule()
-
     cleanup_old_sessions_and_users().schedule()
 
 
+@background_task(delay=15.0, repeat=True, priority=LOW_PRIORITY)
+def start_expiration_task():
+    """Periodic task which looks for workshop sessions which have expired or
+    been orphaned and deletes them, and for workshop environments which are
+    due to be refreshed. This needs to run frequently as both are based on
+    elapsed time rather than any change being made.
+
+    """
+
+    purge_expired_workshop_sessions().execute()
+
+    # Queue further task to retire any workshop environments which have
+    # exceeded their refresh interval and replace them with a new one. The
+    # check is made first so the lock for the resources is only acquired
+    # when there is work to be done.
+
+    for portal in TrainingPortal.objects.all():
+        if environments_due_for_refresh(portal):
+            refresh_workshop_environments(portal).schedule()
+
+
+@background_task(delay=1.0, repeat=True)
+def start_reconciliation_queue_task():
+    """Periodic task which reconciles any workshop environments which have
+    been queued as a result of changes affecting them.
+
+    """
+
+    for name, queued in reconciliation_queue.drain():
+        try:
+            reconcile_workshop_environment(name)
+
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to reconcile workshop environment %s.", name)
+
+        reconciliation_queue.record(queued)
+
+
+def reconcile_workshop_environment(name):
+    """Ensures the workshop sessions for a single workshop environment match
+    its configuration, and that it is deleted if stopping and no longer has
+    any active workshop sessions.
+
+    """
+
+    try:
+        environment = Environment.objects.get(name=name)
+    except Environment.DoesNotExist:
+        return
+
+    if environment.is_stopping():
+        retire_workshop_environment(environment)
+
+    elif environment.is_running():
+        terminate_environment_sessions(environment)
+        initiate_environment_sessions(environment)
+
+
 @kopf.on.event(
     "training.educates.dev",
     "v1beta1",
@@ -407,8 +529,12 @@ def training_portal_event(event, name, body, **_):
         logger.info("Starting up training portal background tasks.")
 
         start_reconciliation_task(name).schedule()
+        start_reconciliation_queue_task().schedule()
+        start_expiration_task().schedule()
         start_hourly_cleanup_task().schedule()
 
+        verify_session_counters().schedule()
+
     # Wrap up body of the resource to make it easier to work with later.
 
     resource = ResourceBody(body)
@@ -0,0 +1,101 @@
+"""Defines the queue of workshop environments which need to be reconciled.
+
+Rather than periodically scanning all workshop environments, changes which
+may require workshop sessions to be created or deleted, or a workshop
+environment to be deleted, add the name of the affected workshop environment
+to the queue. A background task then reconciles just those workshop
+environments. A slower periodic sweep of all workshop environments is still
+done as a safety net.
+
+"""
+
+import threading
+import time
+
+from django.db import transaction
+
+
+class ReconciliationQueue:
+    """Set of names of workshop environments waiting to be reconciled. A name
+    is only held once, so a burst of changes for the same workshop environment
+    results in it being reconciled once.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        self.processed = 0
+        self.latency_total = 0.0
+        self.latency_maximum = 0.0
+
+    def enqueue(self, name):
+        """Add the workshop environment to the queue, retaining the time it
+        was first added if it is already waiting.
+
+        """
+
+        with self._lock:
+            self._pending.setdefault(name, time.monotonic())
+
+    def drain(self):
+        """Remove and return all waiting workshop environments, along with
+        the time each was added to the queue.
+
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        return list(pending.items())
+
+    def record(self, queued):
+        """Record that reconciliation of a workshop environment added to the
+        queue at the specified time has completed.
+
+        """
+
+        latency = time.monotonic() - queued
+
+        with self._lock:
+            self.processed += 1
+            self.latency_total += latency
+            self.latency_maximum = max(self.latency_maximum, latency)
+
+    def statistics(self):
+        """Returns the queue depth and latency of processed items, resetting
+        the maximum latency.
+
+        """
+
+        with self._lock:
+            latency_average = 0.0
+
+            if self.processed:
+                latency_average = self.latency_total / self.processed
+
+            details = {
+                "depth": len(self._pending),
+                "processed": self.processed,
+                "latency_average": latency_average,
+                "latency_maximum": self.latency_maximum,
+            }
+
+            self.latency_maximum = 0.0
+
+            return details
+
+
+reconciliation_queue = ReconciliationQueue()
+
+
+def schedule_environment_reconciliation(environment):
+    """Queue the workshop environment to be reconciled once the current
+    database transaction has been committed.
+
+    """
+
+    name = environment.name
+
+    transaction.on_commit(lambda: reconciliation_queue.enqueue(name))
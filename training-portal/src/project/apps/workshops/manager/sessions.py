@@ -4,8 +4,7 @@ import string
 import random
 import logging
 import base64
-
-from itertools import islice
+import threading
 
 import pykube
 import rstr
@@ -19,9 +18,10 @@ from oauth2_provider.models import Application
 
 from ..models import Session
 
-from .operator import background_task
-from .locking import resources_lock
+from .operator import background_task, HIGH_PRIORITY, NORMAL_PRIORITY
+from .locking import environment_lock, portal_lock, session_lock
 from .analytics import report_analytics_event
+from .reconciliation import schedule_environment_reconciliation
 
 logger = logging.getLogger("educates")
 
@@ -57,6 +57,7 @@ def resolve_request_params(workshop, params):
     return final_params
 
 
+@background_task(priority=HIGH_PRIORITY)
 def create_request_resources(session):
     secret_body = {
         "apiVersion": "v1",
@@ -223,6 +224,82 @@ def update_session_status(name, phase, user=None):
         logger.exception("Failed to update status of workshop session %s.", name)
 
 
+# Latest status to be applied to the Kubernetes resource object for each
+# workshop session, keyed by the name of the workshop session. Background
+# tasks applying the status can run in any order, so each applies whatever
+# is the latest status rather than the status at the time it was scheduled.
+
+_pending_session_status = {}
+_pending_session_status_lock = threading.Lock()
+
+
+@background_task(priority=HIGH_PRIORITY, coalesce=True)
+def apply_session_status(name):
+    """Update the status of the Kubernetes resource object for the workshop
+    session from a background task to the latest status recorded for it,
+    holding the lock for the workshop session so updates for the same
+    workshop session are not made concurrently. If the latest status has
+    already been applied by an earlier task there is nothing to do.
+
+    """
+
+    with session_lock(name):
+        with _pending_session_status_lock:
+            details = _pending_session_status.pop(name, None)
+
+        if details:
+            update_session_status(name, *details)
+
+
+def schedule_session_status_update(name, phase, user=None):
+    """Schedule an update of the status of the Kubernetes resource object for
+    the workshop session for when the current database transaction has been
+    committed. This avoids calling the Kubernetes REST API while holding any
+    locks.
+
+    """
+
+    def _schedule_status_update():
+        # Where an update for a user hasn't been applied yet, the user is
+        # retained so it is still recorded in the status.
+
+        with _pending_session_status_lock:
+            _, pending_user = _pending_session_status.get(name, (None, None))
+            _pending_session_status[name] = (phase, user or pending_user)
+
+        apply_session_status(name).schedule()
+
+    transaction.on_commit(_schedule_status_update)
+
+
+def schedule_workshop_session_creation(environment, sessions):
+    """Schedule deployment of new workshop sessions for the workshop
+    environment for when the current database transaction has been committed.
+
+    """
+
+    def _schedule_session_creation():
+        if sessions:
+            logger.info(
+                "Schedule creation of %d new reserved workshop sessions for workshop environment %s.",
+                len(sessions),
+                environment.name,
+            )
+
+            # Each workshop session is deployed by a separate task on the
+            # shared pool of worker threads, which bounds how many are being
+            # deployed at the same time. As no user is waiting on reserved
+            # workshop sessions, they are deployed at normal priority.
+
+            for session, secret in sessions:
+                create_workshop_session(session, secret).schedule(
+                    priority=NORMAL_PRIORITY
+                )
+
+    transaction.on_commit(_schedule_session_creation)
+
+
+@background_task(priority=HIGH_PRIORITY)
 def create_workshop_session(session, secret):
     """Triggers the deployment of a new workshop session to the cluster."""
 
@@ -343,55 +420,53 @@ def create_workshop_session(session, secret):
 
     logger.info("Deployed workshop session %s.", session.name)
 
-    session.uid = resource.obj["metadata"]["uid"]
-    session.password = config_password
-
     # Update and save the state of the workshop session database record to
     # indicate it is running or waiting for confirmation on being activated if
-    # this session was created via the REST API.
-
-    session.url = (
-        f"{settings.INGRESS_PROTOCOL}://{session.name}.{settings.INGRESS_DOMAIN}"
-    )
+    # this session was created via the REST API. The database record is first
+    # reloaded as it may have been allocated to a user, or marked as stopping,
+    # while the workshop session was being deployed.
 
-    report_analytics_event(session, "Session/Created")
+    with environment_lock(environment), transaction.atomic():
+        session.refresh_from_db()
 
-    if session.owner:
-        update_session_status(session.name, "Allocated", session.owner)
-        report_analytics_event(session, "Session/Started")
-        if session.token:
-            session.mark_as_waiting()
-        else:
-            session.mark_as_running()
-
-            def _schedule_resource_creation():
-                create_request_resources(session)
-
-            transaction.on_commit(_schedule_resource_creation)
-    else:
-        update_session_status(session.name, "Available")
-        session.mark_as_waiting()
+        session.uid = resource.obj["metadata"]["uid"]
+        session.password = config_password
 
+        session.url = (
+            f"{settings.INGRESS_PROTOCOL}://{session.name}.{settings.INGRESS_DOMAIN}"
+        )
 
-def setup_workshop_session(environment, **session_kwargs):
-    """Setup database objects pertaining to a new workshop session."""
+        if session.is_stopping() or session.is_stopped():
+            session.save()
+            return
 
-    # Increase tally for number of workshop sessions created for the workshop
-    # environment and calculate session name. Ensure changed value for tally
-    # is saved.
+        report_analytics_event(session, "Session/Created")
 
-    tally = environment.tally = environment.tally + 1
+        if session.owner:
+            schedule_session_status_update(session.name, "Allocated", session.owner)
+            report_analytics_event(session, "Session/Started")
+            if session.token:
+                session.mark_as_waiting()
+            else:
+                session.mark_as_running()
+
+                transaction.on_commit(
+                    lambda: create_request_resources(session).schedule()
+                )
+        else:
+            schedule_session_status_update(session.name, "Available")
+            session.mark_as_waiting()
 
-    session_id = f"s{tally:03}"
-    session_name = f"{environment.name}-{session_id}"
 
-    environment.save()
+def oauth_redirect_uris(environment, session_name):
+    """Calculate the set of redirect URIs that the OAuth provider application
+    for a workshop session needs to trust. Needs to be enumerated as can't use
+    a wildcard, As such, need a redirect URI for the main workshop URL, one
+    for each embedded application such as the console, plus one for each
+    ingress as they are proxied via the workshop gateway and so are also
+    covered by OAuth.
 
-    # Calculate the set of redirect URIs that the OAuth provider application
-    # needs to trust. Needs to be enumerated as can't use a wildcard, As such,
-    # need a redirect URI for the main workshop URL, one for each embedded
-    # application such as the console, plus one for each ingress as they are
-    # proxied via the workshop gateway and so are also covered by OAuth.
+    """
 
     def redirect_uri_for_oauth_callback(name=None):
         def build_url(host):
@@ -424,7 +499,36 @@ def setup_workshop_session(environment, **session_kwargs):
     for ingress in ingresses:
         redirect_uris.extend(redirect_uri_for_oauth_callback(ingress["name"]))
 
-    # Create the OAuth provider application record. Each workshop session
+    return redirect_uris
+
+
+def setup_workshop_sessions(environment, count, **session_kwargs):
+    """Setup database objects pertaining to a number of new workshop sessions,
+    returning a list of the workshop sessions and the secret for each. The
+    database records are created using a fixed number of queries regardless
+    of the number of workshop sessions. The caller must hold the lock for the
+    workshop environment.
+
+    """
+
+    if count <= 0:
+        return []
+
+    # Increase tally for number of workshop sessions created for the workshop
+    # environment by the number of workshop sessions, and calculate session
+    # names from the range of values allocated. Ensure changed value for
+    # tally is saved. The tally is reloaded first and saved on its own so
+    # changes made by others to the workshop environment are not overwritten.
+
+    environment.refresh_from_db(fields=["tally"])
+
+    first = environment.tally + 1
+
+    environment.tally += count
+
+    environment.save(update_fields=["tally"])
+
+    # Create the OAuth provider application records. Each workshop session
     # has a unique application record tied to the URLs for that specific
     # workshop session.
 
@@ -433,46 +537,83 @@ def setup_workshop_session(environment, **session_kwargs):
     admin_user = User.objects.get(username=settings.ADMIN_USERNAME)
 
     characters = string.ascii_letters + string.digits
-    secret = "".join(random.sample(characters, 32))
-
-    application, _ = Application.objects.get_or_create(
-        name=session_name,
-        client_id=session_name,
-        user=admin_user,
-        redirect_uris=" ".join(redirect_uris),
-        client_type="public",
-        authorization_grant_type="authorization-code",
-        client_secret=secret,
-        skip_authorization=True,
+
+    details = []
+
+    for tally in range(first, first + count):
+        session_id = f"s{tally:03}"
+        session_name = f"{environment.name}-{session_id}"
+        secret = "".join(random.sample(characters, 32))
+
+        details.append((session_id, session_name, secret))
+
+    Application.objects.bulk_create(
+        [
+            Application(
+                name=session_name,
+                client_id=session_name,
+                user=admin_user,
+                redirect_uris=" ".join(oauth_redirect_uris(environment, session_name)),
+                client_type="public",
+                authorization_grant_type="authorization-code",
+                client_secret=secret,
+                skip_authorization=True,
+            )
+            for _, session_name, secret in details
+        ]
     )
 
-    # Create the database record for the workshop session, linking it to
-    # the OAuth provider application record.
+    # Not all databases return the primary keys of records created in bulk,
+    # so retrieve the application records again to link them.
 
-    session = Session.objects.create(
-        name=session_name,
-        id=session_id,
-        application=application,
-        created=session_kwargs.get("started", timezone.now()),
-        environment=environment,
-        **session_kwargs,
+    applications = Application.objects.in_bulk(
+        [session_name for _, session_name, _ in details], field_name="client_id"
     )
 
-    return session, secret
+    # Create the database records for the workshop sessions, linking each to
+    # its OAuth provider application record.
+
+    created = session_kwargs.get("started", timezone.now())
+
+    sessions = Session.bulk_create_sessions(
+        [
+            Session(
+                name=session_name,
+                id=session_id,
+                application=applications[session_name],
+                created=created,
+                environment=environment,
+                **session_kwargs,
+            )
+            for session_id, session_name, _ in details
+        ]
+    )
 
+    return [(session, secret) for session, (_, _, secret) in zip(sessions, details)]
 
-def create_new_session(environment):
+
+def setup_workshop_session(environment, **session_kwargs):
+    """Setup database objects pertaining to a new workshop session. The caller
+    must hold the lock for the workshop environment.
+
+    """
+
+    return setup_workshop_sessions(environment, 1, **session_kwargs)[0]
+
+
+def create_new_session(environment, priority=HIGH_PRIORITY):
     """Setup a record for the workshop session in the database and schedule
-    a task to deploy the workshop session in the cluster.
+    a task to deploy the workshop session in the cluster. Workshop sessions
+    are deployed at high priority unless overridden, as a user will usually
+    be waiting on them.
 
     """
 
     session, secret = setup_workshop_session(environment)
 
-    def _schedule_session_creation():
-        create_workshop_session(session, secret)
-
-    transaction.on_commit(_schedule_session_creation)
+    transaction.on_commit(
+        lambda: create_workshop_session(session, secret).schedule(priority=priority)
+    )
 
     return session
 
@@ -483,7 +624,8 @@ def replace_reserved_session(environment):
     allowed sessions across all workshops, initiate creation of a new workshop
     session. Note that this should only be called in circumstance where just
     deleted, or allocated a workshop session for the workshop environment. In
-    other words, replacing it.
+    other words, replacing it. The caller must hold the lock for the workshop
+    environment.
 
     """
 
@@ -492,6 +634,11 @@ def replace_reserved_session(environment):
     if not environment.reserved:
         return
 
+    # Reload the counts of workshop sessions as they may have changed since
+    # the workshop environment was retrieved.
+
+    environment.refresh_session_counters()
+
     # Check that haven't already reached limit on number of reserved sessions.
 
     if environment.available_sessions_count() >= environment.reserved:
@@ -509,6 +656,8 @@ def replace_reserved_session(environment):
     portal = environment.portal
 
     if portal.sessions_maximum:
+        portal.refresh_session_counters()
+
         if portal.active_sessions_count() >= portal.sessions_maximum:
             return
 
@@ -519,12 +668,10 @@ def replace_reserved_session(environment):
         environment.name,
     )
 
-    create_new_session(environment)
+    create_new_session(environment, priority=NORMAL_PRIORITY)
 
 
-@background_task
-@resources_lock
-@transaction.atomic
+@background_task(coalesce=True)
 def terminate_reserved_sessions(portal):
     """Terminate any reserved workshop sessions which put a workshop
     environment over the count for how many reserved sessions they are
@@ -533,184 +680,157 @@ def terminate_reserved_sessions(portal):
     """
 
     # First kill of reserved sessions for each workshop environment where
-    # they are over what is allowed for that workshop environment.
+    # they are over what is allowed for that workshop environment. Each
+    # workshop environment is dealt with separately, holding only the lock
+    # for that workshop environment.
 
     for environment in portal.running_environments():
-        # If initial number of sessions is greater than reserved sessions then
-        # don't reconcile until after number of sessions would fall below the
-        # required reserved number. Note that this doesn't really deal properly
-        # with where sessions are purged after some time and so count of all
-        # sessions drops back to zero. Should really look at number of sessions
-        # created over time, rather than how many exist right now.
-
-        if environment.initial > environment.reserved:
-            excess = environment.initial - environment.reserved
-            if environment.all_sessions_count() < excess:
-                continue
-            if environment.available_sessions_count() > environment.reserved:
-                continue
-
-        excess = max(0, environment.available_sessions_count() - environment.reserved)
-
-        for session in islice(environment.available_sessions(), 0, excess):
-            logger.info("Terminating reserved workshop session %s.", session.name)
-
-            update_session_status(session.name, "Stopping")
-            session.mark_as_stopping()
-            report_analytics_event(session, "Session/Terminate")
+        terminate_environment_sessions(environment)
 
     # Also check that not exceed capacity for the whole training portal. If
     # we are, try and kill of oldest reserved sessions associated with any
     # workshop environment.
 
     if portal.sessions_maximum != 0:
-        excess = max(0, portal.active_sessions_count() - portal.sessions_maximum)
+        with portal_lock(portal), transaction.atomic():
+            portal.refresh_session_counters()
 
-        for session in islice(
-            portal.available_sessions().order_by("created"), 0, excess
-        ):
-            logger.info("Terminating reserved workshop session %s.", session.name)
+            excess = max(0, portal.active_sessions_count() - portal.sessions_maximum)
 
-            update_session_status(session.name, "Stopping")
-            session.mark_as_stopping()
-            report_analytics_event(session, "Session/Terminate")
+            sessions = (
+                portal.available_sessions()
+                .order_by("created")
+                .select_for_update(of=("self",))
+            )
 
+            for session in sessions[:excess]:
+                logger.info("Terminating reserved workshop session %s.", session.name)
 
-@background_task
-@resources_lock
-@transaction.atomic
-def initiate_reserved_sessions(portal):
-    """Create additional reserved sessions if necessary to satisfy stated
-    reserved count for a workshop environment. Don't create a reserved session
-    if this would put the workshop environment of the training portal over any
-    maximum capacity.
+                schedule_session_status_update(session.name, "Stopping")
+                session.mark_as_stopping()
+                report_analytics_event(session, "Session/Terminate")
 
-    """
 
-    sessions = []
+def terminate_environment_sessions(environment):
+    """Terminate any reserved workshop sessions for the workshop environment
+    which are over the count for how many reserved sessions it is allowed.
+    The lock for the workshop environment is acquired by this function.
 
-    # Need a different approach when maximum number of sessions defined for
-    # the whole training portal. Even in that case, still additionally need to
-    # consider capacity of individual workshop environments.
+    """
 
-    if portal.sessions_maximum == 0:
-        # No global maximum on number of sessions for training portal. In
-        # this case can check easch workshop environment independently.
+    with environment_lock(environment), transaction.atomic():
+        environment.refresh_from_db()
 
-        for environment in portal.running_environments():
-            # If reserved sessions not required, skip to next one.
+        if environment.is_running():
+            terminate_excess_sessions(environment)
 
-            if environment.reserved == 0:
-                continue
 
-            # If initial number of sessions is 0 and no workshop sessions
-            # have yet been created, then skip to next one, as will only go
-            # on to create reserved sessions when the first request for a
-            # session arrives.
+def terminate_excess_sessions(environment):
+    """Terminate any reserved workshop sessions for the workshop environment
+    which are over the count for how many reserved sessions it is allowed.
+    The caller must hold the lock for the workshop environment.
 
-            if environment.initial == 0:
-                if environment.all_sessions_count() == 0:
-                    continue
+    """
 
-            # If already at capacity, skip to next one.
+    # If initial number of sessions is greater than reserved sessions then
+    # don't reconcile until after number of sessions would fall below the
+    # required reserved number. Note that this doesn't really deal properly
+    # with where sessions are purged after some time and so count of all
+    # sessions drops back to zero. Should really look at number of sessions
+    # created over time, rather than how many exist right now.
 
-            spare_capacity = environment.capacity - environment.active_sessions_count()
+    if environment.initial > environment.reserved:
+        excess = environment.initial - environment.reserved
+        if environment.all_sessions_count() < excess:
+            return
+        if environment.available_sessions_count() > environment.reserved:
+            return
 
-            if spare_capacity <= 0:
-                continue
+    excess = max(0, environment.available_sessions_count() - environment.reserved)
 
-            # If already have required number of reserved sessons, skip to
-            # next one.
+    # The workshop sessions are locked as they could be claimed concurrently
+    # by a user without the lock for the workshop environment being held.
 
-            spare_reserved = (
-                environment.reserved - environment.available_sessions_count()
-            )
+    for session in environment.available_sessions().select_for_update()[:excess]:
+        logger.info("Terminating reserved workshop session %s.", session.name)
 
-            if spare_reserved <= 0:
-                continue
+        schedule_session_status_update(session.name, "Stopping")
+        session.mark_as_stopping()
+        report_analytics_event(session, "Session/Terminate")
 
-            # Create required number of reserved sessions ensuring we do not
-            # go over capacity for the workshop environment.
 
-            spare_sessions = min(spare_reserved, spare_capacity)
+@background_task(coalesce=True)
+def initiate_reserved_sessions(portal):
+    """Create additional reserved sessions if necessary to satisfy stated
+    reserved count for a workshop environment. Don't create a reserved session
+    if this would put the workshop environment of the training portal over any
+    maximum capacity.
 
-            for _ in range(spare_sessions):
-                sessions.append(setup_workshop_session(environment))
+    """
 
-    else:
-        # Maximum number of sessions for training portal in force, so work out
-        # how much spare capacity we currently have for the training portal.
-        # If no capacity we can bail out straight away.
+    for environment in portal.running_environments():
+        initiate_environment_sessions(environment)
 
-        spare_capacity = portal.sessions_maximum - portal.active_sessions_count()
 
-        if spare_capacity <= 0:
-            return
+def initiate_environment_sessions(environment):
+    """Create additional reserved sessions for the workshop environment if
+    necessary to satisfy its stated reserved count, without putting the
+    workshop environment or the training portal over any maximum capacity.
+    The lock for the workshop environment is acquired by this function, which
+    when the training portal has a maximum number of sessions also ensures
+    the spare capacity of the training portal can't change while this is done.
 
-        # Now check each separate workshop environment.
+    """
 
-        for environment in portal.running_environments():
-            # If reserved sessions not required, skip to next one.
+    with environment_lock(environment), transaction.atomic():
+        environment.refresh_from_db()
 
-            if environment.reserved == 0:
-                continue
+        # If no longer running, or reserved sessions not required, nothing
+        # to do.
 
-            # If initial number of sessions is 0 and no workshop sessions
-            # have yet been created, then skip to next one, as will only go
-            # on to create reserved sessions when the first request for a
-            # session arrives.
+        if not environment.is_running() or environment.reserved == 0:
+            return
 
-            if environment.initial == 0:
-                if environment.all_sessions_count() == 0:
-                    continue
+        # If initial number of sessions is 0 and no workshop sessions have yet
+        # been created, then nothing to do, as will only go on to create
+        # reserved sessions when the first request for a session arrives.
 
-            # If already have required number of reserved sessons, skip to
-            # next one.
+        if environment.initial == 0:
+            if environment.all_sessions_count() == 0:
+                return
 
-            spare_reserved = (
-                environment.reserved - environment.available_sessions_count()
-            )
+        # Work out the spare capacity of the workshop environment, further
+        # limited by the spare capacity of the training portal as a whole if
+        # there is a maximum number of sessions for the training portal.
 
-            if spare_reserved <= 0:
-                continue
+        spare_capacity = environment.capacity - environment.active_sessions_count()
 
-            # Create required number of reserved sessions ensuring we do not
-            # go over capacity for the workshop environment, but also that
-            # this will not put us over capacity for whole training portal.
+        portal = environment.portal
 
-            spare_sessions = min(
-                spare_reserved,
-                environment.capacity - environment.active_sessions_count(),
+        if portal.sessions_maximum:
+            spare_capacity = min(
                 spare_capacity,
+                portal.sessions_maximum - portal.active_sessions_count(),
             )
 
-            for _ in range(spare_sessions):
-                sessions.append(setup_workshop_session(environment))
-
-                # Reduce count of how much capacity still have for the
-                # training portal as a whole.
-
-                spare_capacity -= 1
+        if spare_capacity <= 0:
+            return
 
-            # Bail out if reached capacity for the whole training portal.
+        # If already have required number of reserved sessons, nothing to do.
 
-            if spare_capacity <= 0:
-                break
+        spare_reserved = environment.reserved - environment.available_sessions_count()
 
-    # Schedule the actual creation of the reserved sessions.
+        if spare_reserved <= 0:
+            return
 
-    def _schedule_session_creation():
-        if sessions:
-            logger.info(
-                "Schedule creation of %d new reserved workshop sessions for workshop environment %s.",
-                len(sessions),
-                environment.name,
-            )
+        # Create required number of reserved sessions ensuring we do not go
+        # over capacity and schedule the actual creation of them.
 
-            for session, secret in sessions:
-                create_workshop_session(session, secret)
+        sessions = setup_workshop_sessions(
+            environment, min(spare_reserved, spare_capacity)
+        )
 
-    transaction.on_commit(_schedule_session_creation)
+        schedule_workshop_session_creation(environment, sessions)
 
 
 def allocate_session_for_user(
@@ -724,15 +844,85 @@ def allocate_session_for_user(
 ):
     """Allocate a workshop session to the user for the specified workshop
     environment from any reserved workshop sessions. Replace now allocated
-    workshop session with a new reserved session if required.
+    workshop session with a new reserved session if required. The caller must
+    hold the lock for the workshop environment.
+
+    """
+
+    session = Session.claim_reserved_session(environment, user)
+
+    if not session:
+        return
+
+    activate_claimed_session(
+        session, user, token, timeout, params, index_url, analytics_url
+    )
+
+    # See if we need to create a new reserved session to replace the one which
+    # was just allocated.
+
+    replace_reserved_session(environment)
+
+    return session
+
+
+def claim_session_for_user(
+    environment,
+    user,
+    token,
+    timeout=None,
+    params={},
+    index_url=None,
+    analytics_url=None,
+):
+    """Allocate a workshop session to the user for the specified workshop
+    environment from any reserved workshop sessions, without holding the lock
+    for the workshop environment. Returns None where the user already has a
+    workshop session, is not permitted another, or where there are no
+    reserved workshop sessions, in which case retrieve_session_for_user()
+    should be called with the lock for the workshop environment held. The
+    caller must hold the lock for the user and have started a database
+    transaction.
 
     """
 
-    session = environment.available_session()
+    environment.refresh_from_db()
+
+    if not environment.is_running():
+        return
+
+    if environment.allocated_session_for_user(user):
+        return
+
+    if not environment.portal.session_permitted_for_user(user):
+        return
+
+    session = Session.claim_reserved_session(environment, user)
 
     if not session:
         return
 
+    activate_claimed_session(
+        session, user, token, timeout, params, index_url, analytics_url
+    )
+
+    # Creating a new reserved session to replace the one which was just
+    # allocated requires the lock for the workshop environment, so leave that
+    # to reconciliation of the workshop environment.
+
+    schedule_environment_reconciliation(environment)
+
+    return session
+
+
+def activate_claimed_session(
+    session, user, token, timeout, params, index_url, analytics_url
+):
+    """Completes allocation of a reserved workshop session which has been
+    claimed for the user.
+
+    """
+
     # We will have a token when requested via the REST API. The owner and
     # token is updated in this case but left in pending state until activation
     # of the workshop session is subsequently confirmed. The extra
@@ -745,25 +935,15 @@ def allocate_session_for_user(
     session.analytics_url = analytics_url
 
     if token:
-        update_session_status(session.name, "Allocating", user)
+        schedule_session_status_update(session.name, "Allocating", user)
         report_analytics_event(session, "Session/Pending")
         session.mark_as_pending(user, token, timeout)
     else:
-        update_session_status(session.name, "Allocated", user)
+        schedule_session_status_update(session.name, "Allocated", user)
         report_analytics_event(session, "Session/Started")
         session.mark_as_running(user)
 
-        def _schedule_resource_creation():
-            create_request_resources(session)
-
-        transaction.on_commit(_schedule_resource_creation)
-
-    # See if we need to create a new reserved session to replace the one which
-    # was just allocated.
-
-    replace_reserved_session(environment)
-
-    return session
+        transaction.on_commit(lambda: create_request_resources(session).schedule())
 
 
 def create_session_for_user(
@@ -783,7 +963,11 @@ def create_session_for_user(
     # Check first if not exceeding the capacity of the workshop environment.
     # Using the active session count here, which includes workshop sessions
     # which are in reserve, but we would only usually be called in situation
-    # where there weren't any reserved sessions in the first place.
+    # where there weren't any reserved sessions in the first place. The counts
+    # of workshop sessions are reloaded once as they may have changed since
+    # the workshop environment was retrieved.
+
+    environment.refresh_session_counters()
 
     if environment.active_sessions_count() >= environment.capacity:
         return
@@ -803,9 +987,9 @@ def create_session_for_user(
         session.analytics_url = analytics_url
 
         if token:
-            update_session_status(session.name, "Allocating", user)
+            schedule_session_status_update(session.name, "Allocating", user)
         else:
-            update_session_status(session.name, "Allocated", user)
+            schedule_session_status_update(session.name, "Allocated", user)
 
         session.mark_as_pending(user, token, timeout)
 
@@ -819,6 +1003,8 @@ def create_session_for_user(
     # Check the number of allocated workshop sessions for the whole training
     # portal and see if we can still have any more workshops sessions.
 
+    portal.refresh_session_counters()
+
     if portal.allocated_sessions_count() >= portal.sessions_maximum:
         return
 
@@ -835,9 +1021,9 @@ def create_session_for_user(
         session.analytics_url = analytics_url
 
         if token:
-            update_session_status(session.name, "Allocating", user)
+            schedule_session_status_update(session.name, "Allocating", user)
         else:
-            update_session_status(session.name, "Allocated", user)
+            schedule_session_status_update(session.name, "Allocated", user)
 
         session.mark_as_pending(user, token, timeout)
 
@@ -853,14 +1039,14 @@ def create_session_for_user(
     # tracking any statistics yet to do that with certainty, so kill off the
     # oldest session. We kill it off by expiring it immediately and then
     # letting the session reaper kick in and delete it. Double check that
-    # there is at least one reserved session.
+    # there is at least one reserved session. The reserved session is stopped
+    # using a conditional update as it could concurrently be claimed by a user
+    # of the other workshop environment.
 
-    sessions = portal.available_sessions().order_by("created")
+    session = Session.stop_oldest_reserved_session(portal)
 
-    if sessions:
-        session = sessions[0]
-        update_session_status(session.name, "Stopping")
-        session.mark_as_stopping()
+    if session:
+        schedule_session_status_update(session.name, "Stopping")
         report_analytics_event(session, "Session/Terminate")
 
     # Now create the new workshop session for the required workshop
@@ -874,9 +1060,9 @@ def create_session_for_user(
     session.analytics_url = analytics_url
 
     if token:
-        update_session_status(session.name, "Allocating", user)
+        schedule_session_status_update(session.name, "Allocating", user)
     else:
-        update_session_status(session.name, "Allocated", user)
+        schedule_session_status_update(session.name, "Allocated", user)
 
     session.mark_as_pending(user, token, timeout)
 
@@ -904,7 +1090,10 @@ def retrieve_session_for_user(
     it will not overwrite any existing token as we want to reuse the existing
     one and not generate a new one. if we can't find an existing session, we
     will create a new one if there is available capacity. If there is no
-    available capacity, no session will be returned.
+    available capacity, no session will be returned. The caller must hold the
+    lock for the workshop environment and have started a database
+    transaction, with the workshop environment reloaded after acquiring the
+    lock.
 
     """
 
@@ -0,0 +1,83 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_session_counters(apps, schema_editor):
+    TrainingPortal = apps.get_model("workshops", "TrainingPortal")
+    Environment = apps.get_model("workshops", "Environment")
+    Session = apps.get_model("workshops", "Session")
+
+    # Values of SessionState at the time of this migration.
+
+    STARTING, WAITING, STOPPED = 1, 2, 5
+
+    for environment in Environment.objects.all():
+        counts = Session.objects.filter(environment=environment).aggregate(
+            sessions_total=Count("pk"),
+            sessions_active=Count("pk", filter=~Q(state=STOPPED)),
+            sessions_allocated=Count(
+                "pk", filter=Q(owner__isnull=False) & ~Q(state=STOPPED)
+            ),
+            sessions_available=Count("pk", filter=Q(owner__isnull=True, state=WAITING)),
+        )
+
+        Environment.objects.filter(pk=environment.pk).update(**counts)
+
+    for portal in TrainingPortal.objects.all():
+        counts = Session.objects.filter(environment__portal=portal).aggregate(
+            sessions_active=Count("pk", filter=~Q(state=STOPPED)),
+            sessions_allocated=Count(
+                "pk", filter=Q(owner__isnull=False) & ~Q(state=STOPPED)
+            ),
+            sessions_available=Count(
+                "pk", filter=Q(owner__isnull=True, state__in=(STARTING, WAITING))
+            ),
+        )
+
+        TrainingPortal.objects.filter(pk=portal.pk).update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("workshops", "0015_environment_resource_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="environment",
+            name="sessions_active",
+            field=models.IntegerField(default=0, verbose_name="active sessions"),
+        ),
+        migrations.AddField(
+            model_name="environment",
+            name="sessions_allocated",
+            field=models.IntegerField(default=0, verbose_name="allocated sessions"),
+        ),
+        migrations.AddField(
+            model_name="environment",
+            name="sessions_available",
+            field=models.IntegerField(default=0, verbose_name="available sessions"),
+        ),
+        migrations.AddField(
+            model_name="environment",
+            name="sessions_total",
+            field=models.IntegerField(default=0, verbose_name="total sessions"),
+        ),
+        migrations.AddField(
+            model_name="trainingportal",
+            name="sessions_active",
+            field=models.IntegerField(default=0, verbose_name="active sessions"),
+        ),
+        migrations.AddField(
+            model_name="trainingportal",
+            name="sessions_allocated",
+            field=models.IntegerField(default=0, verbose_name="allocated sessions"),
+        ),
+        migrations.AddField(
+            model_name="trainingportal",
+            name="sessions_available",
+            field=models.IntegerField(default=0, verbose_name="available sessions"),
+        ),
+        migrations.RunPython(populate_session_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("workshops", "0016_session_counters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["owner", "state"], name="workshops_session_owner_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["environment", "state"], name="workshops_session_env_idx"
+            ),
+        ),
+    ]
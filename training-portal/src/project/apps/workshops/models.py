@@ -5,15 +5,17 @@ import enum
 
 from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
-from django.db.models import Sum
+from django.db.models import Count, F, Q, Sum
 
 from oauth2_provider.models import Application
 
+from .caches import invalidate_catalog_cache
+
 
 User = get_user_model()
 
@@ -51,6 +53,31 @@ class JSONField(models.Field):
         return self.value_from_object(obj)
 
 
+SESSION_COUNTER_FIELDS = (
+    "sessions_total",
+    "sessions_active",
+    "sessions_allocated",
+    "sessions_available",
+)
+
+
+def save_excluding_counters(instance, save, *args, **kwargs):
+    """Saves a training portal or workshop environment. When updating an
+    existing database record the counts of workshop sessions are not saved, as
+    they are updated separately and the values held may be out of date.
+
+    """
+
+    if not instance._state.adding and kwargs.get("update_fields") is None:
+        kwargs["update_fields"] = [
+            field.name
+            for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in SESSION_COUNTER_FIELDS
+        ]
+
+    save(*args, **kwargs)
+
+
 class TrainingPortal(models.Model):
     """Database model type representing the training portal."""
 
@@ -98,6 +125,65 @@ class TrainingPortal(models.Model):
     update_workshop = models.BooleanField(
         verbose_name="workshop updates", default=False
     )
+    sessions_active = models.IntegerField(verbose_name="active sessions", default=0)
+    sessions_allocated = models.IntegerField(
+        verbose_name="allocated sessions", default=0
+    )
+    sessions_available = models.IntegerField(
+        verbose_name="available sessions", default=0
+    )
+
+    def save(self, *args, **kwargs):
+        save_excluding_counters(self, super().save, *args, **kwargs)
+
+    def refresh_session_counters(self):
+        """Reloads the counts of workshop sessions maintained in the database
+        record as they may have been changed since this was retrieved. The
+        counts returned by the count methods are those held by this instance,
+        so this should be called once before making a decision based on them.
+
+        """
+
+        self.refresh_from_db(
+            fields=["sessions_active", "sessions_allocated", "sessions_available"]
+        )
+
+    def rebuild_session_counters(self):
+        """Recalculates the counts of workshop sessions maintained in the
+        database record from the workshop sessions themselves, returning
+        whether they had drifted from the true values.
+
+        """
+
+        with transaction.atomic():
+            current = (
+                TrainingPortal.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values("sessions_active", "sessions_allocated", "sessions_available")
+                .get()
+            )
+
+            counts = Session.objects.filter(environment__portal=self).aggregate(
+                sessions_active=Count("pk", filter=~Q(state=SessionState.STOPPED)),
+                sessions_allocated=Count(
+                    "pk",
+                    filter=Q(owner__isnull=False) & ~Q(state=SessionState.STOPPED),
+                ),
+                sessions_available=Count(
+                    "pk",
+                    filter=Q(
+                        owner__isnull=True,
+                        state__in=(SessionState.STARTING, SessionState.WAITING),
+                    ),
+                ),
+            )
+
+            if counts == current:
+                return False
+
+            TrainingPortal.objects.filter(pk=self.pk).update(**counts)
+
+        return True
 
     def starting_environments(self):
         """Returns the set of workshop environments which are still in the
@@ -241,7 +327,7 @@ class TrainingPortal(models.Model):
 
         """
 
-        return self.available_sessions().count()
+        return self.sessions_available
 
     available_sessions_count.short_description = "Available"
 
@@ -266,7 +352,7 @@ class TrainingPortal(models.Model):
 
         """
 
-        return self.allocated_sessions().count()
+        return self.sessions_allocated
 
     allocated_sessions_count.short_description = "Allocated"
 
@@ -290,7 +376,7 @@ class TrainingPortal(models.Model):
 
         """
 
-        return self.active_sessions().count()
+        return self.sessions_active
 
     active_sessions_count.short_description = "Active"
 
@@ -314,7 +400,7 @@ class TrainingPortal(models.Model):
 
         """
 
-        return self.total_sessions().count()
+        return self.all_sessions().count()
 
     all_sessions_count.short_description = "Total"
 
@@ -329,6 +415,8 @@ class TrainingPortal(models.Model):
         if not self.sessions_maximum:
             return True
 
+        self.refresh_session_counters()
+
         return self.allocated_sessions_count() < self.sessions_maximum
 
     def allocated_session(self, name, user=None):
@@ -369,6 +457,19 @@ class TrainingPortal(models.Model):
             state=SessionState.STOPPED
         )
 
+    def current_sessions_for_user(self, user):
+        """Returns the set of workshop sessions allocated across all workshop
+        environments for the specified user which are not in the process of
+        stopping, along with the workshop environment and workshop for each.
+
+        """
+
+        return (
+            Session.objects.filter(environment__portal=self, owner=user)
+            .exclude(state__in=(SessionState.STOPPING, SessionState.STOPPED))
+            .select_related("environment__workshop")
+        )
+
     def stopped_session(self, name, user=None):
         """Returns any stopped workshop session with the specified name.
         Optionally validates whether allocated to the specified user and
@@ -406,17 +507,14 @@ class TrainingPortal(models.Model):
         if user.is_staff:
             return True
 
-        sessions = self.allocated_sessions_for_user(user)
-
         if user.groups.filter(name="anonymous").exists():
-            if self.sessions_anonymous:
-                if sessions.count() >= self.sessions_anonymous:
-                    return False
-
+            maximum = self.sessions_anonymous
         else:
-            if self.sessions_registered:
-                if sessions.count() >= self.sessions_registered:
-                    return False
+            maximum = self.sessions_registered
+
+        if maximum:
+            if self.allocated_sessions_for_user(user).count() >= maximum:
+                return False
 
         return True
 
@@ -481,6 +579,14 @@ class Environment(models.Model):
     env = JSONField(verbose_name="environment overrides", default=[])
     labels = JSONField(verbose_name="label overrides", default={})
     tally = models.IntegerField(verbose_name="workshop tally", default=0)
+    sessions_total = models.IntegerField(verbose_name="total sessions", default=0)
+    sessions_active = models.IntegerField(verbose_name="active sessions", default=0)
+    sessions_allocated = models.IntegerField(
+        verbose_name="allocated sessions", default=0
+    )
+    sessions_available = models.IntegerField(
+        verbose_name="available sessions", default=0
+    )
 
     def portal_name(self):
         return self.portal.name
@@ -542,6 +648,65 @@ class Environment(models.Model):
         self.save()
         return self
 
+    def save(self, *args, **kwargs):
+        save_excluding_counters(self, super().save, *args, **kwargs)
+
+    def refresh_session_counters(self):
+        """Reloads the counts of workshop sessions maintained in the database
+        record as they may have been changed since this was retrieved. The
+        counts returned by the count methods are those held by this instance,
+        so this should be called once before making a decision based on them.
+
+        """
+
+        self.refresh_from_db(
+            fields=[
+                "sessions_total",
+                "sessions_active",
+                "sessions_allocated",
+                "sessions_available",
+            ]
+        )
+
+    def rebuild_session_counters(self):
+        """Recalculates the counts of workshop sessions maintained in the
+        database record from the workshop sessions themselves, returning
+        whether they had drifted from the true values.
+
+        """
+
+        with transaction.atomic():
+            current = (
+                Environment.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values(
+                    "sessions_total",
+                    "sessions_active",
+                    "sessions_allocated",
+                    "sessions_available",
+                )
+                .get()
+            )
+
+            counts = self.session_set.aggregate(
+                sessions_total=Count("pk"),
+                sessions_active=Count("pk", filter=~Q(state=SessionState.STOPPED)),
+                sessions_allocated=Count(
+                    "pk",
+                    filter=Q(owner__isnull=False) & ~Q(state=SessionState.STOPPED),
+                ),
+                sessions_available=Count(
+                    "pk", filter=Q(owner__isnull=True, state=SessionState.WAITING)
+                ),
+            )
+
+            if counts == current:
+                return False
+
+            Environment.objects.filter(pk=self.pk).update(**counts)
+
+        return True
+
     def available_session(self):
         sessions = self.available_sessions()
         return sessions and sessions[0] or None
@@ -556,7 +721,7 @@ class Environment(models.Model):
         return self.session_set.filter(owner__isnull=True, state=SessionState.WAITING)
 
     def available_sessions_count(self):
-        return self.available_sessions().count()
+        return self.sessions_available
 
     available_sessions_count.short_description = "Available"
 
@@ -566,7 +731,7 @@ class Environment(models.Model):
         )
 
     def allocated_sessions_count(self):
-        return self.allocated_sessions().count()
+        return self.sessions_allocated
 
     allocated_sessions_count.short_description = "Allocated"
 
@@ -587,7 +752,7 @@ class Environment(models.Model):
 
         """
 
-        return self.active_sessions().count()
+        return self.sessions_active
 
     active_sessions_count.short_description = "Active"
 
@@ -609,7 +774,7 @@ class Environment(models.Model):
 
         """
 
-        return self.all_sessions().count()
+        return self.sessions_total
 
     all_sessions_count.short_description = "Total"
 
@@ -641,6 +806,70 @@ class SessionState(enum.IntEnum):
         return [(key.value, key.name) for key in cls]
 
 
+def session_counters(state, owner_id):
+    """Returns how a workshop session in the specified state and with the
+    specified owner contributes to each of the counts of workshop sessions
+    maintained for the workshop environment and the training portal.
+
+    """
+
+    active = state != SessionState.STOPPED
+    reserved = owner_id is None and state in (SessionState.STARTING, SessionState.WAITING)
+
+    return {
+        "total": 1,
+        "active": int(active),
+        "allocated": int(active and owner_id is not None),
+        "available": int(owner_id is None and state == SessionState.WAITING),
+        "reserved": int(reserved),
+    }
+
+
+def session_counters_delta(previous, current):
+    """Returns the change in the counts of workshop sessions resulting from a
+    workshop session changing from the previous to the current state and
+    owner. Either can be None where the workshop session didn't exist.
+
+    """
+
+    before = previous and session_counters(*previous) or {}
+    after = current and session_counters(*current) or {}
+
+    return {
+        name: after.get(name, 0) - before.get(name, 0)
+        for name in ("total", "active", "allocated", "available", "reserved")
+    }
+
+
+def adjust_session_counters(environment_id, delta):
+    """Applies a change in the counts of workshop sessions to the workshop
+    environment and the training portal it belongs to. The change is applied
+    using update queries so concurrent changes are not lost. Since update
+    queries don't send model signals, cached catalog responses are discarded
+    here, which covers workshop sessions being claimed, created or deleted in
+    bulk.
+
+    """
+
+    if not any(delta.values()):
+        return
+
+    invalidate_catalog_cache()
+
+    Environment.objects.filter(pk=environment_id).update(
+        sessions_total=F("sessions_total") + delta["total"],
+        sessions_active=F("sessions_active") + delta["active"],
+        sessions_allocated=F("sessions_allocated") + delta["allocated"],
+        sessions_available=F("sessions_available") + delta["available"],
+    )
+
+    TrainingPortal.objects.filter(environment__id=environment_id).update(
+        sessions_active=F("sessions_active") + delta["active"],
+        sessions_allocated=F("sessions_allocated") + delta["allocated"],
+        sessions_available=F("sessions_available") + delta["reserved"],
+    )
+
+
 class Session(models.Model):
     name = models.CharField(
         verbose_name="session name", max_length=256, primary_key=True
@@ -669,6 +898,198 @@ class Session(models.Model):
     index_url = models.URLField(verbose_name="index url", null=True, blank=True)
     analytics_url = models.URLField(verbose_name="analytics url", null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner", "state"], name="workshops_session_owner_idx"),
+            models.Index(
+                fields=["environment", "state"], name="workshops_session_env_idx"
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Saves the workshop session, updating the counts of workshop sessions
+        maintained for the workshop environment and training portal in the
+        same transaction.
+
+        """
+
+        with transaction.atomic():
+            previous = (
+                Session.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("state", "owner_id")
+                .first()
+            )
+
+            super().save(*args, **kwargs)
+
+            self.update_session_counters(previous, (self.state, self.owner_id))
+
+    def delete(self, *args, **kwargs):
+        """Deletes the workshop session, updating the counts of workshop
+        sessions maintained for the workshop environment and training portal
+        in the same transaction.
+
+        """
+
+        with transaction.atomic():
+            previous = (
+                Session.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values_list("state", "owner_id")
+                .first()
+            )
+
+            result = super().delete(*args, **kwargs)
+
+            self.update_session_counters(previous, None)
+
+            return result
+
+    def update_session_counters(self, previous, current):
+        """Applies the change in the counts of workshop sessions resulting from
+        the workshop session changing from the previous to the current state
+        and owner. Either can be None where the workshop session didn't exist.
+
+        """
+
+        adjust_session_counters(
+            self.environment_id, session_counters_delta(previous, current)
+        )
+
+    @classmethod
+    def bulk_delete_stopped_sessions(cls, names):
+        """Deletes the database records for those of the named workshop
+        sessions which have stopped using a single query, updating the counts
+        of workshop sessions maintained for the workshop environments in the
+        same transaction. Returns the number of workshop sessions deleted.
+
+        """
+
+        with transaction.atomic():
+            sessions = cls.objects.filter(name__in=names, state=SessionState.STOPPED)
+
+            counts = list(
+                sessions.order_by()
+                .values_list("environment_id")
+                .annotate(count=Count("pk"))
+            )
+
+            deleted, _ = sessions.delete()
+
+            counters = session_counters(SessionState.STOPPED, None)
+
+            for environment_id, count in counts:
+                adjust_session_counters(
+                    environment_id,
+                    {name: -value * count for name, value in counters.items()},
+                )
+
+        return deleted
+
+    @classmethod
+    def claim_reserved_session(cls, environment, user):
+        """Allocates to the user a reserved workshop session of the workshop
+        environment which is waiting to be used, returning it, or None if
+        there are none. Each workshop session is claimed using a conditional
+        update, so concurrent requests can never be allocated the same
+        workshop session, without needing to hold the lock for the workshop
+        environment.
+
+        """
+
+        with transaction.atomic():
+            while True:
+                candidates = list(
+                    environment.available_sessions().values_list("name", flat=True)[:5]
+                )
+
+                if not candidates:
+                    return None
+
+                for name in candidates:
+                    claimed = cls.objects.filter(
+                        name=name, owner__isnull=True, state=SessionState.WAITING
+                    ).update(owner=user)
+
+                    if claimed:
+                        adjust_session_counters(
+                            environment.pk,
+                            session_counters_delta(
+                                (SessionState.WAITING, None),
+                                (SessionState.WAITING, user.pk),
+                            ),
+                        )
+
+                        session = cls.objects.get(name=name)
+                        session.environment = environment
+
+                        return session
+
+    @classmethod
+    def stop_oldest_reserved_session(cls, portal):
+        """Marks as stopping the oldest reserved workshop session across all
+        workshop environments of the training portal, returning it, or None if
+        there are none. As with claiming a workshop session, a conditional
+        update is used so a workshop session which has concurrently been
+        allocated to a user is never stopped.
+
+        """
+
+        with transaction.atomic():
+            while True:
+                candidates = list(
+                    portal.available_sessions()
+                    .order_by("created")
+                    .values_list("name", "environment_id", "state")[:5]
+                )
+
+                if not candidates:
+                    return None
+
+                for name, environment_id, state in candidates:
+                    stopped = cls.objects.filter(
+                        name=name, owner__isnull=True, state=state
+                    ).update(state=SessionState.STOPPING, expires=timezone.now())
+
+                    if stopped:
+                        adjust_session_counters(
+                            environment_id,
+                            session_counters_delta(
+                                (state, None),
+                                (SessionState.STOPPING, None),
+                            ),
+                        )
+
+                        return cls.objects.get(name=name)
+
+    @classmethod
+    def bulk_create_sessions(cls, sessions):
+        """Creates the database records for multiple new workshop sessions
+        using a single query, updating the counts of workshop sessions
+        maintained for the workshop environments and training portal in the
+        same transaction.
+
+        """
+
+        with transaction.atomic():
+            sessions = cls.objects.bulk_create(sessions)
+
+            deltas = {}
+
+            for session in sessions:
+                delta = deltas.setdefault(session.environment_id, {})
+
+                for name, value in session_counters(
+                    session.state, session.owner_id
+                ).items():
+                    delta[name] = delta.get(name, 0) + value
+
+            for environment_id, delta in deltas.items():
+                adjust_session_counters(environment_id, delta)
+
+        return sessions
+
     def environment_name(self):
         return self.environment.name
 
@@ -15,10 +15,25 @@ from django.views.decorators.http import require_http_methods
 from django.utils.http import urlencode
 from django.http import JsonResponse
 from django.conf import settings
+from django.db.models import Prefetch
+from django.db.models.signals import post_delete, post_save
 
 from oauth2_provider.decorators import protected_resource
 
-from ..models import TrainingPortal, EnvironmentState, SessionState
+from ..models import (
+    TrainingPortal,
+    Workshop,
+    Environment,
+    EnvironmentState,
+    Session,
+    SessionState,
+)
+from ..caches import catalog_cache, invalidate_catalog_cache
+
+
+for model in (TrainingPortal, Workshop, Environment, Session):
+    post_save.connect(invalidate_catalog_cache, sender=model)
+    post_delete.connect(invalidate_catalog_cache, sender=model)
 
 
 @require_http_methods(["GET"])
@@ -38,18 +53,24 @@ def catalog(request):
 
     portal = TrainingPortal.objects.get(name=settings.TRAINING_PORTAL)
 
-    for environment in portal.running_environments():
+    # Look up any workshop sessions the user has across all the workshop
+    # environments in one query, rather than one query per environment.
+
+    user_sessions = {}
+
+    if notification != "session-deleted" and request.user.is_authenticated:
+        for session in portal.current_sessions_for_user(request.user):
+            user_sessions.setdefault(session.environment_id, session)
+
+    for environment in portal.running_environments().select_related("workshop"):
         details = {}
         details["environment"] = environment.name
         details["workshop"] = environment.workshop
 
-        capacity = max(0, environment.capacity - environment.allocated_sessions_count())
+        capacity = max(0, environment.capacity - environment.sessions_allocated)
         details["capacity"] = capacity
 
-        details["session"] = None
-
-        if notification != "session-deleted" and request.user.is_authenticated:
-            details["session"] = environment.allocated_session_for_user(request.user)
+        details["session"] = user_sessions.get(environment.pk)
 
         entries.append(details)
 
@@ -90,46 +111,17 @@ if settings.PORTAL_PASSWORD:
     catalog = permit_access_to_event(catalog)
 
 
-@require_http_methods(["GET"])
-def catalog_environments(request):
+def environments_catalog(environment_states, include_sessions, query_string):
     """Returns details of workshop environments for REST API."""
 
     entries = []
 
-    # If user is authenticated and a robot account, allow for inclusion
-    # of sessions to be included.
-
-    environment_states = []
-
-    include_sessions = False
-
-    if request.user.is_authenticated:
-        if request.user.groups.filter(name="robots").exists():
-            include_sessions = request.GET.get("sessions", "").lower() in (
-                "true",
-                "1",
-            )
-
-            include_states = list(map(str.lower, request.GET.getlist("state")))
-
-            if "starting" in include_states:
-                environment_states.append(EnvironmentState.STARTING)
-            if "running" in include_states:
-                environment_states.append(EnvironmentState.RUNNING)
-            if "stopping" in include_states:
-                environment_states.append(EnvironmentState.STOPPING)
-            if "stopped" in include_states:
-                environment_states.append(EnvironmentState.STOPPED)
-
     # XXX What if the portal configuration doesn't exist as process
     # hasn't been initialized yet. Should return error indicating the
     # service is not available.
 
     portal = TrainingPortal.objects.get(name=settings.TRAINING_PORTAL)
 
-    if not environment_states:
-        environment_states.append(EnvironmentState.RUNNING)
-
     def parse_query_string(query_string):
         params = {}
         pairs = query_string.split('&')
@@ -161,14 +153,33 @@ def catalog_environments(request):
 
         return params
 
-    query_params = parse_query_string(request.META['QUERY_STRING'])
+    query_params = parse_query_string(query_string)
 
     query_params_name = query_params.get('name', [])
 
     query_params_labels = query_params.get('labels', {})
     query_params_labels = {k: v[-1] for k, v in query_params_labels.items()}
 
-    for environment in portal.environments_in_state(environment_states):
+    environments = portal.environments_in_state(environment_states).select_related(
+        "workshop"
+    )
+
+    # Where workshop sessions are to be included, retrieve those allocated to
+    # users, along with their owners, for all the workshop environments at the
+    # same time.
+
+    if include_sessions:
+        environments = environments.prefetch_related(
+            Prefetch(
+                "session_set",
+                queryset=Session.objects.exclude(owner__isnull=True)
+                .exclude(state=SessionState.STOPPED)
+                .select_related("owner"),
+                to_attr="prefetched_allocated_sessions",
+            )
+        )
+
+    for environment in environments:
         if query_params_name and environment.workshop.name not in query_params_name:
             continue
 
@@ -205,13 +216,13 @@ def catalog_environments(request):
         details["capacity"] = environment.capacity
         details["reserved"] = environment.reserved
 
-        details["allocated"] = environment.allocated_sessions_count()
-        details["available"] = environment.available_sessions_count()
+        details["allocated"] = environment.sessions_allocated
+        details["available"] = environment.sessions_available
 
         if include_sessions:
             sessions_data = []
 
-            for session in environment.allocated_sessions():
+            for session in environment.prefetched_allocated_sessions:
                 session_data = {
                     "name": session.name,
                     "state": SessionState(session.state).name,
@@ -235,8 +246,6 @@ def catalog_environments(request):
 
         entries.append(details)
 
-    allocated_sessions = portal.allocated_sessions()
-
     result = {
         "portal": {
             "name": settings.TRAINING_PORTAL,
@@ -248,22 +257,73 @@ def catalog_environments(request):
                 "maximum": portal.sessions_maximum,
                 "registered": portal.sessions_registered,
                 "anonymous": portal.sessions_anonymous,
-                "allocated": allocated_sessions.count(),
+                "allocated": portal.sessions_allocated,
             },
         },
         "environments": entries,
     }
 
+    return result
+
+
+@require_http_methods(["GET"])
+def catalog_environments(request):
+    """Returns details of workshop environments for REST API."""
+
+    # If user is authenticated and a robot account, allow for inclusion
+    # of sessions to be included.
+
+    environment_states = []
+
+    include_sessions = False
+
+    if request.user.is_authenticated:
+        if request.user.groups.filter(name="robots").exists():
+            include_sessions = request.GET.get("sessions", "").lower() in (
+                "true",
+                "1",
+            )
+
+            include_states = list(map(str.lower, request.GET.getlist("state")))
+
+            if "starting" in include_states:
+                environment_states.append(EnvironmentState.STARTING)
+            if "running" in include_states:
+                environment_states.append(EnvironmentState.RUNNING)
+            if "stopping" in include_states:
+                environment_states.append(EnvironmentState.STOPPING)
+            if "stopped" in include_states:
+                environment_states.append(EnvironmentState.STOPPED)
+
+    if not environment_states:
+        environment_states.append(EnvironmentState.RUNNING)
+
+    # Responses may be cached for a short time as front end portals poll this
+    # frequently. The response depends on the query string and whether the
+    # user is permitted to see workshop sessions and all environment states.
+
+    cache_key = (
+        "environments",
+        include_sessions,
+        tuple(environment_states),
+        request.META["QUERY_STRING"],
+    )
+
+    result = catalog_cache.fetch(
+        cache_key,
+        lambda: environments_catalog(
+            environment_states, include_sessions, request.META["QUERY_STRING"]
+        ),
+    )
+
     return JsonResponse(result)
 
 
 if settings.CATALOG_VISIBILITY != "public":
     catalog_environments = protected_resource()(catalog_environments)
 
-@require_http_methods(["GET"])
-def catalog_workshops(request):
-    """Returns details of available workshops for REST API. Only returns
-       workshops with environments in the running state."""
+def workshops_catalog():
+    """Returns details of available workshops for REST API."""
 
     entries = []
 
@@ -273,7 +333,7 @@ def catalog_workshops(request):
 
     portal = TrainingPortal.objects.get(name=settings.TRAINING_PORTAL)
 
-    for environment in portal.running_environments():
+    for environment in portal.running_environments().select_related("workshop"):
         labels = copy.deepcopy(portal.default_labels)
         labels.update(environment.workshop.labels)
         labels.update(environment.labels)
@@ -297,15 +357,13 @@ def catalog_workshops(request):
                 "duration": int(environment.expires.total_seconds()),
                 "capacity": environment.capacity,
                 "reserved": environment.reserved,
-                "allocated": environment.allocated_sessions_count(),
-                "available": environment.available_sessions_count(),
+                "allocated": environment.sessions_allocated,
+                "available": environment.sessions_available,
             },
         }
 
         entries.append(details)
 
-    allocated_sessions = portal.allocated_sessions()
-
     result = {
         "portal": {
             "name": settings.TRAINING_PORTAL,
@@ -317,12 +375,22 @@ def catalog_workshops(request):
                 "maximum": portal.sessions_maximum,
                 "registered": portal.sessions_registered,
                 "anonymous": portal.sessions_anonymous,
-                "allocated": allocated_sessions.count(),
+                "allocated": portal.sessions_allocated,
             },
         },
         "workshops": entries,
     }
 
+    return result
+
+
+@require_http_methods(["GET"])
+def catalog_workshops(request):
+    """Returns details of available workshops for REST API. Only returns
+       workshops with environments in the running state."""
+
+    result = catalog_cache.fetch(("workshops",), workshops_catalog)
+
     return JsonResponse(result)
 
 
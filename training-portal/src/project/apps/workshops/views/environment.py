@@ -24,23 +24,21 @@ from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.utils.http import urlencode
 from django.http import JsonResponse
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.contrib.auth import login
 from django.conf import settings
 
 from oauth2_provider.decorators import protected_resource
 
 from ..manager.analytics import report_analytics_event
-from ..manager.sessions import retrieve_session_for_user
-from ..manager.locking import resources_lock
+from ..manager.sessions import claim_session_for_user, retrieve_session_for_user
+from ..manager.locking import environment_lock, user_lock
 from ..models import TrainingPortal, Environment, EnvironmentState, SessionState
 from .helpers import update_query_params
 
 
 @login_required
 @require_http_methods(["GET"])
-@resources_lock
-@transaction.atomic
 def environment(request, name):
     """Initiate creation of a workshop session against the specific workshop
     environment.
@@ -72,9 +70,14 @@ def environment(request, name):
             )
         )
 
-    # Retrieve a session for the user for this workshop environment.
+    # Retrieve a session for the user for this workshop environment. Only the
+    # locks for the user and the workshop environment are held while doing
+    # this.
+
+    with user_lock(request.user), environment_lock(instance), transaction.atomic():
+        instance.refresh_from_db()
 
-    session = retrieve_session_for_user(instance, request.user, index_url=index_url)
+        session = retrieve_session_for_user(instance, request.user, index_url=index_url)
 
     if session:
         return redirect("workshops_session", name=session.name)
@@ -99,7 +102,6 @@ def environment(request, name):
 
 
 @require_http_methods(["GET"])
-@resources_lock
 @transaction.atomic
 def environment_create(request, name):
     """Direct URL that can be used to create workshop sessions. Will redirect
@@ -164,8 +166,6 @@ def environment_create(request, name):
 @csrf_exempt
 @protected_resource()
 @require_http_methods(["GET"])
-@resources_lock
-@transaction.atomic
 def environment_status(request, name):
     """Return the status of the workshop environment, including the number of
     workshop sessions currently running.
@@ -257,8 +257,8 @@ def environment_status(request, name):
     details["capacity"] = environment.capacity
     details["reserved"] = environment.reserved
 
-    details["allocated"] = environment.allocated_sessions_count()
-    details["available"] = environment.available_sessions_count()
+    details["allocated"] = environment.sessions_allocated
+    details["available"] = environment.sessions_available
 
     return JsonResponse(details)
 
@@ -266,8 +266,6 @@ def environment_status(request, name):
 @csrf_exempt
 @protected_resource()
 @require_http_methods(["GET", "POST"])
-@resources_lock
-@transaction.atomic
 def environment_request(request, name):
     """URL for requesting creation of a workshop session against a specific
     workshop environment, via the REST API.
@@ -395,15 +393,24 @@ def environment_request(request, name):
 
     User = get_user_model()  # pylint: disable=invalid-name
 
+    # Since no lock is held when creating the user, a concurrent request for
+    # the same user may create it first, in which case use that one.
+
     try:
         user = User.objects.get(username=username)
     except User.DoesNotExist:
-        user = User.objects.create_user(username, **user_details)
-        group, _ = Group.objects.get_or_create(name="anonymous")
-        user.groups.add(group)
-        user.save()
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username, **user_details)
+                group, _ = Group.objects.get_or_create(name="anonymous")
+                user.groups.add(group)
+                user.save()
+
+        except IntegrityError:
+            user = User.objects.get(username=username)
 
-        report_analytics_event(user, "User/Create", {"group": "anonymous"})
+        else:
+            report_analytics_event(user, "User/Create", {"group": "anonymous"})
 
     # Do not allow workshop requests for a target user which has staff status or
     # which is in the robots group.
@@ -416,9 +423,37 @@ def environment_request(request, name):
     characters = string.ascii_letters + string.digits
     token = "".join(random.sample(characters, 32))
 
-    session = retrieve_session_for_user(
-        instance, user, session_name, token, timeout, params, index_url, analytics_url
-    )
+    # Where possible a reserved session is claimed for the user without the
+    # lock for the workshop environment, so requests for different users can
+    # proceed in parallel. Otherwise, such as where the user already has a
+    # session or a new session needs to be created, fall back to holding the
+    # lock for the workshop environment. The lock for the user is held
+    # throughout so concurrent requests for the same user can't each be
+    # allocated a session.
+
+    with user_lock(user):
+        session = None
+
+        if not session_name:
+            with transaction.atomic():
+                session = claim_session_for_user(
+                    instance, user, token, timeout, params, index_url, analytics_url
+                )
+
+        if not session:
+            with environment_lock(instance), transaction.atomic():
+                instance.refresh_from_db()
+
+                session = retrieve_session_for_user(
+                    instance,
+                    user,
+                    session_name,
+                    token,
+                    timeout,
+                    params,
+                    index_url,
+                    analytics_url,
+                )
 
     if not session:
         return JsonResponse({"error": "No session available"}, status=503)
@@ -36,9 +36,9 @@ from oauth2_provider.decorators import protected_resource
 
 from csp.decorators import csp_update
 
-from ..manager.locking import resources_lock
+from ..manager.locking import session_lock
 from ..manager.cleanup import delete_workshop_session
-from ..manager.sessions import update_session_status, create_request_resources
+from ..manager.sessions import schedule_session_status_update, create_request_resources
 from ..manager.analytics import report_analytics_event
 from ..models import TrainingPortal, SessionState
 from .helpers import update_query_params
@@ -46,8 +46,6 @@ from .helpers import update_query_params
 
 @login_required(login_url="/")
 @require_http_methods(["GET"])
-@resources_lock
-@transaction.atomic
 def session(request, name):
     """Renders the framed workshop session."""
 
@@ -169,15 +167,17 @@ def session_activate(request, name):
     if not instance.owner.is_active:
         return HttpResponseServerError("Owner for session is not active")
 
-    if not instance.is_running():
-        update_session_status(instance.name, "Allocated", instance.owner)
-        report_analytics_event(instance, "Session/Started")
-        instance.mark_as_running()
+    with session_lock(instance.name), transaction.atomic():
+        instance.refresh_from_db()
 
-        def _schedule_resource_creation():
-            create_request_resources(instance)
+        if instance.is_allocated() and not instance.is_running():
+            schedule_session_status_update(instance.name, "Allocated", instance.owner)
+            report_analytics_event(instance, "Session/Started")
+            instance.mark_as_running()
 
-        transaction.on_commit(_schedule_resource_creation)
+            transaction.on_commit(
+                lambda: create_request_resources(instance).schedule()
+            )
 
     login(request, instance.owner, backend=settings.AUTHENTICATION_BACKENDS[0])
 
@@ -210,11 +210,17 @@ def session_terminate(request, name):
         if instance.owner != request.user:
             return HttpResponseForbidden("Access to session not permitted")
 
-    instance.mark_as_stopping()
+    with session_lock(instance.name), transaction.atomic():
+        instance.refresh_from_db()
+
+        if instance.is_allocated():
+            instance.mark_as_stopping()
 
-    report_analytics_event(instance, "Session/Stopping")
+            report_analytics_event(instance, "Session/Stopping")
 
-    transaction.on_commit(lambda: delete_workshop_session(instance).schedule())
+            transaction.on_commit(
+                lambda: delete_workshop_session(instance).schedule()
+            )
 
     details = {}
 
@@ -226,8 +232,6 @@ def session_terminate(request, name):
 
 @login_required(login_url="/")
 @require_http_methods(["GET"])
-@resources_lock
-@transaction.atomic
 def session_delete(request, name):
     """Triggers deletion of a workshop session."""
 
@@ -271,11 +275,17 @@ def session_delete(request, name):
     # Mark the instance as stopping now so that it will not be picked up
     # by the user again if they attempt to create a new session immediately.
 
-    instance.mark_as_stopping()
+    with session_lock(instance.name), transaction.atomic():
+        instance.refresh_from_db()
 
-    report_analytics_event(instance, "Session/Stopping")
+        if instance.is_allocated():
+            instance.mark_as_stopping()
 
-    transaction.on_commit(lambda: delete_workshop_session(instance).schedule())
+            report_analytics_event(instance, "Session/Stopping")
+
+            transaction.on_commit(
+                lambda: delete_workshop_session(instance).schedule()
+            )
 
     notification = request.GET.get("notification", None)
 
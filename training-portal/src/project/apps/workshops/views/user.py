@@ -12,7 +12,7 @@ from django.http import JsonResponse
 
 from oauth2_provider.decorators import protected_resource
 
-from ..models import Environment
+from ..models import Session, SessionState
 
 
 @protected_resource()
@@ -36,10 +36,23 @@ def user_sessions(request, name):
 
     sessions = []
 
-    for environment in Environment.objects.all():
-        session = environment.allocated_session_for_user(user)
+    # Retrieve all the workshop sessions allocated to the user, along with
+    # the workshop environment and workshop for each, in a single query.
+    # There should be at most one workshop session per workshop environment.
+
+    environments = set()
+
+    current_sessions = (
+        Session.objects.filter(owner=user)
+        .exclude(state__in=(SessionState.STOPPING, SessionState.STOPPED))
+        .select_related("environment__workshop")
+        .order_by("environment_id")
+    )
+
+    for session in current_sessions:
+        if session.environment_id not in environments:
+            environments.add(session.environment_id)
 
-        if session:
             details = {}
 
             details["name"] = session.name
@@ -0,0 +1,58 @@
+"""SQLite database backend which acquires the database write lock at the
+start of a transaction rather than on the first write.
+
+Locking in the training portal is done per workshop environment, so separate
+transactions can now run concurrently. With a deferred transaction, SQLite
+fails immediately with "database is locked" when a transaction which has read
+from the database later tries to write while another transaction holds the
+write lock, ignoring the busy timeout. Starting transactions in immediate mode
+means they instead wait on the busy timeout for the write lock.
+
+The "profile" option selects the settings applied to each new connection. The
+"default" profile leaves SQLite with its defaults. The "performance" profile
+switches the database to write ahead logging so that readers are no longer
+blocked by a writer, and only syncs to disk at checkpoints rather than on each
+commit. A crash of the host may then lose the most recently committed
+transactions, but cannot corrupt the database.
+
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PROFILES = {
+    "default": [],
+    "performance": [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA temp_store = MEMORY",
+    ],
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+
+        profile = params.pop("profile", "default")
+
+        if profile not in PROFILES:
+            raise ImproperlyConfigured(f"Unknown SQLite profile {profile}.")
+
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+
+        # The busy timeout is set by the "timeout" option when connecting.
+
+        profile = self.settings_dict["OPTIONS"].get("profile", "default")
+
+        for statement in PROFILES[profile]:
+            connection.execute(statement)
+
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
@@ -1,5 +1,6 @@
 import os
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.utils import get_random_secret_key
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -75,15 +76,45 @@ WSGI_APPLICATION = "project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": os.path.join(DATA_DIR, "db.sqlite3"),
-        "OPTIONS": {
-            "timeout": 15,
+# By default the database is a SQLite database file under DATA_DIR, with the
+# connection settings for SQLite selected by SQLITE_PROFILE. An external
+# PostgreSQL database can be used instead by setting DATABASE_ENGINE, in which
+# case database connections are kept open between requests and background
+# tasks for up to DATABASE_CONN_MAX_AGE seconds.
+
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE", "sqlite3")
+
+if DATABASE_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DATABASE_NAME", "training-portal"),
+            "USER": os.environ.get("DATABASE_USER", ""),
+            "PASSWORD": os.environ.get("DATABASE_PASSWORD", ""),
+            "HOST": os.environ.get("DATABASE_HOST", ""),
+            "PORT": os.environ.get("DATABASE_PORT", ""),
+            "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", "300")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": 15,
+            },
         }
     }
-}
+
+elif DATABASE_ENGINE == "sqlite3":
+    DATABASES = {
+        "default": {
+            "ENGINE": "project.backends.sqlite3",
+            "NAME": os.path.join(DATA_DIR, "db.sqlite3"),
+            "OPTIONS": {
+                "timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", "15")),
+                "profile": os.environ.get("SQLITE_PROFILE", "default"),
+            }
+        }
+    }
+
+else:
+    raise ImproperlyConfigured(f"Unsupported database engine {DATABASE_ENGINE}.")
 
 
 # Password validation
@@ -185,6 +216,26 @@ AMPLITUDE_TRACKING_ID = os.environ.get("AMPLITUDE_TRACKING_ID", "")
 
 ANALYTICS_WEBHOOK_URL = os.environ.get("ANALYTICS_WEBHOOK_URL", "")
 
+ANALYTICS_QUEUE_SIZE = int(os.environ.get("ANALYTICS_QUEUE_SIZE", "10000"))
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", "1"))
+ANALYTICS_BATCH_INTERVAL = float(os.environ.get("ANALYTICS_BATCH_INTERVAL", "1.0"))
+ANALYTICS_WEBHOOK_RETRIES = int(os.environ.get("ANALYTICS_WEBHOOK_RETRIES", "3"))
+ANALYTICS_WEBHOOK_TIMEOUT = float(os.environ.get("ANALYTICS_WEBHOOK_TIMEOUT", "2.5"))
+ANALYTICS_IDLE_TIMEOUT = float(os.environ.get("ANALYTICS_IDLE_TIMEOUT", "300.0"))
+
+ACTIVITY_PROBE_CONCURRENCY = int(os.environ.get("ACTIVITY_PROBE_CONCURRENCY", "50"))
+ACTIVITY_PROBE_TIMEOUT = float(os.environ.get("ACTIVITY_PROBE_TIMEOUT", "5.0"))
+ACTIVITY_PROBE_CACHE_TTL = float(os.environ.get("ACTIVITY_PROBE_CACHE_TTL", "10.0"))
+
+RECONCILIATION_INTERVAL = float(os.environ.get("RECONCILIATION_INTERVAL", "120.0"))
+
+CLEANUP_RETENTION_PERIOD = float(os.environ.get("CLEANUP_RETENTION_PERIOD", "36"))
+CLEANUP_CHUNK_SIZE = int(os.environ.get("CLEANUP_CHUNK_SIZE", "500"))
+
+TASK_WORKER_THREADS = int(os.environ.get("TASK_WORKER_THREADS", "8"))
+
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", "0.0"))
+
 INGRESS_DOMAIN = os.environ.get("INGRESS_DOMAIN", "127-0-0-1.nip.io")
 INGRESS_CLASS = os.environ.get("INGRESS_CLASS", "")
 INGRESS_PROTOCOL = os.environ.get("INGRESS_PROTOCOL", "http")